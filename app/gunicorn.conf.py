@@ -0,0 +1,41 @@
+# Production configuration for the prompt generation server.
+#
+# Run from the repository root:
+#     gunicorn -c app/gunicorn.conf.py
+#
+# The server spends nearly all of its time waiting on upstream generations, so it scales with
+# threads rather than processes: one process with many threads shares a single connection pool,
+# response cache and set of /metrics counters. Add processes only when CPU bound, and then set
+# AUTOPROMPT_RESPONSE_CACHE_PATH so they share cached responses (each process still reports its
+# own /metrics).
+#
+# On SIGTERM gunicorn stops accepting connections and gives in-flight requests up to
+# `graceful_timeout` seconds to finish; `worker_exit` then drains the generation threads and
+# closes the upstream connections.
+import os
+
+wsgi_app = "app.server:app"
+bind = os.getenv("AUTOPROMPT_BIND", "0.0.0.0:5000")
+
+worker_class = "gthread"
+workers = int(os.getenv("AUTOPROMPT_WORKERS", "1"))
+# Each /generate_prompts request holds a thread for the slower of its two generations. The app
+# reads the same variable to size its generation pool (AUTOPROMPT_BRANCH_WORKERS defaults to
+# 2 x (threads + AUTOPROMPT_BATCH_CONCURRENCY)) and answers 503 once every slot is busy.
+threads = int(os.getenv("AUTOPROMPT_THREADS", "32"))
+
+# Longer than the branch deadline, so a slow generation is answered rather than cut off
+graceful_timeout = float(os.getenv("AUTOPROMPT_BRANCH_TIMEOUT", "60")) + 15
+timeout = 120
+keepalive = 5
+
+# Import the app once before forking, so workers start with the module already loaded
+preload_app = workers > 1
+
+accesslog = "-"
+errorlog = "-"
+
+
+def worker_exit(server, worker):
+    from app.server import shutdown
+    shutdown()
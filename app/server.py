@@ -1,17 +1,204 @@
-from flask import Flask, request, jsonify, send_from_directory
-# from src.prompt_generation.prompt_template import TEMPLATE_TOT, GOT_TEMPLATE
-import cohere
-from dotenv import load_dotenv
+import sys
 import os
-# Load environment variables from .env file
-load_dotenv()
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
-# Initialize the Cohere client with the API key from env.
-cohere_api_key = os.getenv("COHERE_API_KEY")
-co = cohere.Client(cohere_api_key)
+from flask import Flask, Response, g, request, jsonify, send_from_directory
+# from src.prompt_generation.prompt_template import TEMPLATE_TOT, GOT_TEMPLATE
+from src.llm_cache import get_cache
+from src.prompt_generation.fanout import run_fanout
+from src.llm_client import close_clients, generate_text, stream_text
+from src.metrics import CONTENT_TYPE, Registry
+from src.response_cache import ResponseCache
 
 app = Flask(__name__)
 
+# Seconds each of the ToT/GoT generations may take before the request returns without it; the
+# upstream call is given the same deadline, so a timed-out generation also stops
+BRANCH_TIMEOUT = float(os.getenv("AUTOPROMPT_BRANCH_TIMEOUT", "60"))
+
+# Inputs generated concurrently per /generate_prompts/batch request (each input issues two
+# upstream calls), and the largest batch accepted
+BATCH_CONCURRENCY = int(os.getenv("AUTOPROMPT_BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("AUTOPROMPT_BATCH_MAX_ITEMS", "1000"))
+
+
+class ServerBusy(Exception):
+    """
+    Raised when the branch pool has no room for a request's generations.
+    """
+
+
+class _Started(threading.Event):
+    """
+    Set, with the time, when a submitted generation starts running on a worker.
+    """
+    at = None
+
+    def set(self):
+        self.at = time.monotonic()
+        super().set()
+
+
+class BranchPool:
+    """
+    Worker threads for the ToT/GoT generations, with admission control.
+
+    A request's generations are only accepted if a worker is free for each of them (or one of
+    `max_queued` queue slots), so a burst beyond capacity is turned away at once with
+    ServerBusy instead of waiting in the queue until its deadline expires. Callers that are
+    already streaming a response (batch items) may instead wait a bounded time for room.
+    """
+
+    def __init__(self, max_workers, max_queued=0):
+        # Threads are started on demand, so a generous max_workers costs nothing when idle
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prompt-branch")
+        self.capacity = max_workers + max_queued
+        self.in_use = 0
+        self.rejected = 0
+        self.lock = threading.Condition()
+
+    def _release(self, future):
+        with self.lock:
+            self.in_use -= 1
+            self.lock.notify_all()
+
+    def check_room(self, count):
+        """
+        Raise ServerBusy, counted as a rejection, if `count` generations could not be accepted now.
+        """
+        with self.lock:
+            if self.in_use + count > self.capacity:
+                self.rejected += count
+                raise ServerBusy(f"All {self.capacity} generation slots are busy; retry shortly")
+
+    def submit_all(self, calls, wait=0.0):
+        """
+        Submit zero-argument calls together, or none of them if there is no room for all.
+
+        Parameters:
+        - calls (list): Zero-argument calls to run.
+        - wait (float): Seconds to wait for room before giving up; 0 rejects at once.
+
+        Returns:
+        - list: One future per call. Each has a `started` event (see _Started), so callers
+          can measure their deadline from when the call starts rather than from submission.
+
+        Raises:
+        - ServerBusy: If fewer than len(calls) workers and queue slots are free (within `wait`).
+        """
+        deadline = time.monotonic() + wait
+        with self.lock:
+            while self.in_use + len(calls) > self.capacity:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += len(calls)
+                    raise ServerBusy(f"All {self.capacity} generation slots are busy; retry shortly")
+                self.lock.wait(remaining)
+            self.in_use += len(calls)
+        def run(call, started):
+            started.set()
+            return call()
+
+        futures = []
+        for call in calls:
+            started = _Started()
+            future = self.executor.submit(run, call, started)
+            future.started = started
+            future.add_done_callback(self._release)
+            futures.append(future)
+        return futures
+
+    def stats(self):
+        with self.lock:
+            return {"in_use": self.in_use, "capacity": self.capacity, "rejected": self.rejected}
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+# Every /generate_prompts request thread (AUTOPROMPT_THREADS in app/gunicorn.conf.py) needs two
+# workers, and a batch request needs two per concurrently generated input. Requests beyond
+# AUTOPROMPT_BRANCH_WORKERS + AUTOPROMPT_BRANCH_QUEUE generations are rejected with a 503.
+REQUEST_THREADS = int(os.getenv("AUTOPROMPT_THREADS", "32"))
+branch_pool = BranchPool(
+    max_workers=int(os.getenv("AUTOPROMPT_BRANCH_WORKERS", str(2 * (REQUEST_THREADS + BATCH_CONCURRENCY)))),
+    max_queued=int(os.getenv("AUTOPROMPT_BRANCH_QUEUE", "0")),
+)
+
+# Cache of complete ToT/GoT results per input prompt; identical concurrent requests share one
+# upstream call. Set AUTOPROMPT_RESPONSE_CACHE_PATH to share entries between server processes.
+response_cache = ResponseCache(
+    ttl_seconds=float(os.getenv("AUTOPROMPT_RESPONSE_CACHE_TTL", "3600")),
+    max_entries=int(os.getenv("AUTOPROMPT_RESPONSE_CACHE_ENTRIES", "1024")),
+    max_bytes=int(float(os.getenv("AUTOPROMPT_RESPONSE_CACHE_MB", "64")) * 1024 * 1024),
+    disk_path=os.getenv("AUTOPROMPT_RESPONSE_CACHE_PATH") or None,
+)
+
+# Metrics served at /metrics in the Prometheus text format. They are kept per process, so run
+# one worker process with many threads (see app/gunicorn.conf.py) for a complete view.
+metrics = Registry()
+request_latency = metrics.histogram(
+    "autoprompt_request_duration_seconds",
+    "Time from receiving a request to returning its response headers.",
+    ("endpoint", "method", "status"),
+)
+requests_total = metrics.counter(
+    "autoprompt_requests_total", "Requests served, by endpoint and status code.", ("endpoint", "method", "status")
+)
+requests_in_flight = metrics.gauge("autoprompt_requests_in_flight", "Requests currently being handled.")
+upstream_latency = metrics.histogram(
+    "autoprompt_upstream_duration_seconds", "Duration of a full generation call, by template.", ("template", "mode")
+)
+upstream_calls_total = metrics.counter(
+    "autoprompt_upstream_calls_total", "Generation calls, by template and outcome.", ("template", "mode", "outcome")
+)
+upstream_in_flight = metrics.gauge("autoprompt_upstream_in_flight", "Generation calls currently in progress.")
+cache_metrics = metrics.gauge("autoprompt_cache", "Cache statistics (see /cache_stats).", ("cache", "stat"))
+branch_pool_metrics = metrics.gauge(
+    "autoprompt_branch_pool", "Generation slots in use, their total, and generations rejected when all were busy.", ("stat",)
+)
+
+
+def collect_cache_metrics():
+    caches = {"response": response_cache.stats()}
+    llm_cache = get_cache()
+    if llm_cache is not None:
+        caches["llm"] = llm_cache.stats()
+    for cache, stats in caches.items():
+        for stat, value in stats.items():
+            cache_metrics.set(value, cache=cache, stat=stat)
+    for stat, value in branch_pool.stats().items():
+        branch_pool_metrics.set(value, stat=stat)
+
+
+metrics.add_collector(collect_cache_metrics)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    requests_in_flight.inc()
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    labels = {"endpoint": endpoint, "method": request.method, "status": response.status_code}
+    request_latency.observe(time.perf_counter() - g.request_start, **labels)
+    requests_total.inc(**labels)
+    return response
+
+
+@app.teardown_request
+def finish_request(error=None):
+    requests_in_flight.dec()
+
 
 # Template with a placeholder
 TEMPLATE_TOT = """ Imagine you are a prompt creator for a Large Language Model. Your task is to create a "tree of thought" prompt for generating a story. The goal is to break down the story creation process into multiple layers or steps, with each layer containing several branching ideas that explore different possibilities.
@@ -109,6 +296,119 @@ DO NOT ADD ANY EXTRA INFORMATION.
 """
 
 
+BRANCH_TEMPLATES = {"ToT": TEMPLATE_TOT, "GoT": GOT_TEMPLATE}
+
+
+def response_cache_key(input_prompt):
+    """
+    Key the cached ToT/GoT results on the input prompt and everything used to generate them.
+    """
+    return ResponseCache.make_key("generate_prompts", TEMPLATE_TOT, GOT_TEMPLATE, 1000, 0.7, input_prompt)
+
+
+def timed_upstream(name, mode, call):
+    """
+    Run one generation call (or consume one stream) and record its latency and outcome.
+    """
+    upstream_in_flight.inc()
+    start_time = time.perf_counter()
+    outcome = "error"
+    try:
+        result = call()
+        outcome = "ok"
+        return result
+    finally:
+        upstream_in_flight.dec()
+        upstream_latency.observe(time.perf_counter() - start_time, template=name, mode=mode)
+        upstream_calls_total.inc(template=name, mode=mode, outcome=outcome)
+
+
+def generate_branches(input_prompt, timeout=BRANCH_TIMEOUT, wait=0.0):
+    """
+    Generate the ToT and GoT prompts for an input prompt concurrently.
+
+    Parameters:
+    - input_prompt (str): The user's story prompt.
+    - timeout (float): Seconds each branch may take, measured from when it starts running. The
+      upstream call is bounded by the same deadline, so a branch that times out also stops and
+      frees its worker. With AUTOPROMPT_BRANCH_QUEUE > 0, a branch may first wait up to
+      `timeout` for a worker.
+    - wait (float): Seconds to wait for room in the branch pool before raising ServerBusy.
+
+    Returns:
+    - tuple: (results, errors), dicts keyed by "ToT"/"GoT". A branch that failed or timed out
+      is missing from `results` and has its error message in `errors`.
+
+    Raises:
+    - ServerBusy: If the branch pool has no room for both generations.
+    """
+    calls = [
+        lambda name=name, template=template: timed_upstream(
+            name, "generate",
+            lambda: generate_text(
+                template.format(input_text=f"'{input_prompt}'"),
+                max_tokens=1000,
+                temperature=0.7,
+                template=template,
+                deadline=timeout,
+            ),
+        )
+        for name, template in BRANCH_TEMPLATES.items()
+    ]
+    submitted_at = time.monotonic()
+    futures = dict(zip(BRANCH_TEMPLATES, branch_pool.submit_all(calls, wait=wait)))
+
+    # The branches run side by side, so the total wait is bounded by `timeout`, not twice it
+    results, errors = {}, {}
+    for name, future in futures.items():
+        # A branch still queued when its wait for a worker runs out is dropped before it starts
+        if not future.started.wait(timeout=max(0.0, submitted_at + timeout - time.monotonic())) and future.cancel():
+            errors[name] = f"No worker became free within {timeout:g} seconds"
+            continue
+        future.started.wait()
+        try:
+            results[name] = future.result(timeout=max(0.0, future.started.at + timeout - time.monotonic()))
+        except FutureTimeoutError:
+            errors[name] = f"Timed out after {timeout:g} seconds"
+        except Exception as e:
+            errors[name] = str(e)
+    return results, errors
+
+
+def build_prompt_response(input_prompt, wait=0.0):
+    """
+    Generate (or fetch from the cache) the ToT and GoT prompts for one input prompt.
+
+    `wait` is how long to wait for room in the branch pool (see `generate_branches`).
+
+    Returns:
+    - dict: The response body. It has an "error" key if both branches failed, and an
+      "errors" key alongside the prompts if only one did.
+
+    Raises:
+    - ServerBusy: If the server has no room for the generations.
+    """
+    # Generate the Tree of Thought (ToT) and Graph of Thought (GoT) prompts in parallel, reusing
+    # a cached or in-flight result for the same prompt; partial results are not cached
+    prompt_list, errors = response_cache.get_or_compute(
+        response_cache_key(input_prompt),
+        lambda: generate_branches(input_prompt, wait=wait),
+        cacheable=lambda result: not result[1],
+    )
+    if not prompt_list:
+        return {'error': '; '.join(f"{name}: {message}" for name, message in errors.items())}
+
+    # Return the results; a branch that failed is null and its error is reported alongside
+    response = {
+        'input_prompt': input_prompt,
+        'tree_of_thought_prompt': prompt_list.get("ToT"),
+        'graph_of_thought_prompt': prompt_list.get("GoT")
+    }
+    if errors:
+        response['errors'] = errors
+    return response
+
+
 @app.route('/generate_prompts', methods=['POST'])
 def generate_prompt():
     # Parse the input JSON
@@ -119,38 +419,215 @@ def generate_prompt():
         return jsonify({'error': 'Input prompt is required'}), 400
 
     try:
-        # Dictionary to hold ToT and GoT prompts
-        prompt_list = {}
-
-        # Generate Tree of Thought (ToT) prompt
-        tot_prompt = TEMPLATE_TOT.format(input_text=f"'{input_prompt}'")
-        tot_response = co.generate(
-            prompt=tot_prompt,
-            max_tokens=1000,
-            temperature=0.7
-        )
-        tot_generated_text = tot_response.generations[0].text.strip()
-        prompt_list["ToT"] = tot_generated_text
-
-        # Generate Graph of Thought (GoT) prompt
-        got_prompt = GOT_TEMPLATE.format(input_text=f"'{input_prompt}'")
-        got_response = co.generate(
-            prompt=got_prompt,
-            max_tokens=1000,
-            temperature=0.7
+        response = build_prompt_response(input_prompt)
+    except ServerBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    return jsonify(response), (500 if 'error' in response else 200)
+
+
+def generate_batch(input_prompts, concurrency):
+    """
+    Generate prompts for many inputs with at most `concurrency` inputs in flight.
+
+    Items wait up to BRANCH_TIMEOUT for room in the branch pool rather than failing at once,
+    since the response is already streaming. Closing the iterator (e.g. when the client
+    disconnects) stops the inputs that have not started yet.
+
+    Returns:
+    - iterator: One response dict per input, yielded in input order as soon as every earlier
+      input has finished. Each has its "index"; failed inputs carry an "error" instead of prompts.
+    """
+    cancelled = threading.Event()
+
+    def build_item(job):
+        index, input_prompt = job
+        if cancelled.is_set():
+            return {'error': 'Batch cancelled'}
+        if not isinstance(input_prompt, str) or not input_prompt:
+            return {'error': 'Input prompt is required'}
+        return build_prompt_response(input_prompt, wait=BRANCH_TIMEOUT)
+
+    completed = queue.Queue()
+    jobs = list(enumerate(input_prompts))
+    runner = threading.Thread(
+        target=run_fanout,
+        args=(build_item, jobs, concurrency),
+        kwargs={'on_complete': lambda index, job, result, latency, error: completed.put((index, result, error))},
+        daemon=True,
+    )
+    runner.start()
+
+    # Hold back items that finish early until everything before them has been sent
+    finished = {}
+    try:
+        for next_index, input_prompt in jobs:
+            while next_index not in finished:
+                index, result, error = completed.get()
+                finished[index] = result if error is None else {'error': str(error)}
+            item = finished.pop(next_index)
+            yield {'index': next_index, 'input_prompt': input_prompt, **item}
+    finally:
+        # Also reached when the client disconnects; inputs not yet started are skipped
+        cancelled.set()
+
+
+@app.route('/generate_prompts/batch', methods=['POST'])
+def generate_prompt_batch():
+    # Expects {"input_prompts": [...], "concurrency": optional int, "stream": optional bool}
+    data = request.get_json(silent=True) or {}
+    input_prompts = data.get('input_prompts')
+
+    if not isinstance(input_prompts, list) or not input_prompts:
+        return jsonify({'error': 'input_prompts must be a non-empty list'}), 400
+    if len(input_prompts) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'At most {BATCH_MAX_ITEMS} input prompts are accepted per batch'}), 400
+
+    try:
+        concurrency = max(1, min(int(data.get('concurrency', BATCH_CONCURRENCY)), BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'concurrency must be an integer'}), 400
+    # Shed load before streaming starts, as /generate_prompts does; once streaming, items wait for room
+    try:
+        branch_pool.check_room(len(BRANCH_TEMPLATES))
+    except ServerBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    items = generate_batch(input_prompts, concurrency)
+
+    # Stream one JSON line per input as results become available, or return them all at once
+    if data.get('stream') or 'application/x-ndjson' in request.headers.get('Accept', ''):
+        return Response(
+            (json.dumps(item) + '\n' for item in items),
+            mimetype='application/x-ndjson',
+            headers={'X-Accel-Buffering': 'no'},
         )
-        got_generated_text = got_response.generations[0].text.strip()
-        prompt_list["GoT"] = got_generated_text
-
-        # Return the results
-        return jsonify({
-            'input_prompt': input_prompt,
-            'tree_of_thought_prompt': prompt_list["ToT"],
-            'graph_of_thought_prompt': prompt_list["GoT"]
-        })
-
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return jsonify({'results': list(items)})
+
+def sse_event(event, data):
+    """
+    Format one Server-Sent Event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_branches(input_prompt, timeout=BRANCH_TIMEOUT):
+    """
+    Stream the ToT and GoT generations as interleaved, tagged Server-Sent Events.
+
+    Each branch streams from the LLM in its own worker thread and pushes its segments onto a
+    shared queue, so segments are forwarded in arrival order as soon as either branch produces
+    them. Events:
+    - "token": {"branch": "ToT" | "GoT", "text": <segment>}
+    - "done": {"branch": ...} once a branch has finished
+    - "error": {"branch": ..., "error": <message>} if a branch failed or timed out
+    - "end": {} after both branches are done
+
+    A cached result is replayed as one token event per branch; a fully successful stream is
+    stored in the response cache.
+    """
+    cache_key = response_cache_key(input_prompt)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        prompt_list, _ = cached
+        for name in BRANCH_TEMPLATES:
+            yield sse_event("token", {"branch": name, "text": prompt_list[name]})
+            yield sse_event("done", {"branch": name})
+        yield sse_event("end", {})
+        return
+
+    events = queue.Queue()
+    cancelled = threading.Event()
+
+    def consume_stream(name, template):
+        for segment in stream_text(template.format(input_text=f"'{input_prompt}'"),
+                                   max_tokens=1000, temperature=0.7, template=template, deadline=timeout):
+            if cancelled.is_set():
+                return False
+            events.put(("token", name, segment))
+        return True
+
+    def run_branch(name, template):
+        try:
+            if timed_upstream(name, "stream", lambda: consume_stream(name, template)):
+                events.put(("done", name, None))
+        except Exception as e:
+            events.put(("error", name, str(e)))
+
+    try:
+        branch_pool.submit_all([lambda name=name, template=template: run_branch(name, template)
+                                for name, template in BRANCH_TEMPLATES.items()])
+    except ServerBusy as e:
+        for name in BRANCH_TEMPLATES:
+            yield sse_event("error", {"branch": name, "error": str(e)})
+        yield sse_event("end", {})
+        return
+
+    deadline = time.monotonic() + timeout
+    pending = set(BRANCH_TEMPLATES)
+    segments = {name: [] for name in BRANCH_TEMPLATES}
+    failed = False
+    try:
+        while pending:
+            try:
+                kind, name, payload = events.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                for name in sorted(pending):
+                    yield sse_event("error", {"branch": name, "error": f"Timed out after {timeout:g} seconds"})
+                break
+            if kind == "token":
+                segments[name].append(payload)
+                yield sse_event("token", {"branch": name, "text": payload})
+            elif kind == "done":
+                pending.discard(name)
+                yield sse_event("done", {"branch": name})
+            else:
+                pending.discard(name)
+                failed = True
+                yield sse_event("error", {"branch": name, "error": payload})
+        if not pending and not failed:
+            response_cache.put(cache_key, [{name: "".join(parts).strip() for name, parts in segments.items()}, {}])
+        yield sse_event("end", {})
+    finally:
+        # Also reached when the client disconnects; stop the workers at their next segment
+        cancelled.set()
+
+
+@app.route('/generate_prompts/stream', methods=['GET', 'POST'])
+def generate_prompt_stream():
+    # Accept a JSON body (fetch) or a query parameter (EventSource only issues GET requests)
+    if request.method == 'POST':
+        input_prompt = (request.get_json(silent=True) or {}).get('input_prompt', '')
+    else:
+        input_prompt = request.args.get('input_prompt', '')
+
+    if not input_prompt:
+        return jsonify({'error': 'Input prompt is required'}), 400
+
+    return Response(
+        stream_branches(input_prompt),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    llm_cache = get_cache()
+    return jsonify({
+        'response_cache': response_cache.stats(),
+        'llm_cache': llm_cache.stats() if llm_cache is not None else None
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
+def shutdown():
+    """
+    Release the server's resources once it has stopped accepting requests: wait for in-flight
+    branch generations to finish, then close the pooled upstream connections.
+    """
+    branch_pool.shutdown(wait=True)
+    close_clients()
 
 # Route to serve the UI
 @app.route('/')
@@ -0,0 +1,263 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Row-level code paths that can be benchmarked
+SCENARIOS = ["generate", "rank_pre", "rank_post", "rank_embedding", "evaluate", "pipeline"]
+
+
+def synthetic_rows(num_rows, seed=0):
+    """
+    Build a deterministic dataset of (prompt, human story, candidate prompts) rows.
+
+    Candidates and stories come from the stand-in server's canned outputs, so the ranking and
+    evaluation scenarios can run without generating them first.
+    """
+    from src.local_llm_server import canned_output
+    from src.prompt_generation.prompt_template import TEMPLATE_TOT
+
+    rows = []
+    for i in range(num_rows):
+        prompt = f"Benchmark prompt {i}: a stranger arrives in a quiet village with a letter"
+        story = canned_output(f"Choose branches from the following prompt structure to create an interesting story: {prompt}", 500, seed)
+        candidates = [canned_output(TEMPLATE_TOT.format(input_text=f"'{prompt}'") + str(j), 1000, seed) for j in range(3)]
+        rows.append({"Prompt": prompt, "Human Story": story, "Response 1": candidates[0],
+                     "Response 2": candidates[1], "Response 3": candidates[2]})
+    return rows
+
+
+def _row_function(scenario):
+    from src import pipeline
+
+    if scenario == "generate":
+        return pipeline.make_generate_stage("tot")
+    if scenario == "rank_pre":
+        return pipeline.make_rank_stage("pre")
+    if scenario == "rank_post":
+        return pipeline.make_rank_stage("post")
+    if scenario == "rank_embedding":
+        return pipeline.make_rank_stage("manual")
+    if scenario == "evaluate":
+        return pipeline.make_evaluate_stage()
+    raise ValueError(f"Unknown scenario '{scenario}'.")
+
+
+def run_case(scenario, concurrency, num_rows, base_url, seed=0):
+    """
+    Run one benchmark case in the current process and return its measurements.
+
+    Meant to run in a fresh process per case, so peak RSS and caches do not carry over. One
+    extra row is run untimed first, so imports, client construction and the first connection
+    are reported as `cold_start_seconds` instead of landing in the first timed rows.
+    """
+    os.environ["COHERE_BASE_URL"] = base_url
+    os.environ.setdefault("COHERE_API_KEY", "local")
+    os.environ["AUTOPROMPT_CACHE"] = "0"  # Measure upstream calls, not cache hits
+
+    import urllib.request
+
+    def server_requests():
+        with urllib.request.urlopen(f"{base_url}/stats") as response:
+            return json.load(response)
+
+    rows = synthetic_rows(num_rows + 1, seed)
+    warmup_row = rows.pop()
+    latencies = []
+    errors = 0
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        from src.pipeline import make_evaluate_stage, make_generate_stage, make_rank_stage
+
+        cold_start = time.perf_counter()
+        if scenario == "rank_embedding":
+            # Load the model before timing, as a long-running job would
+            from src.prompt_ranking.rank_manual_metrics import get_embedding_model
+            get_embedding_model()
+        if scenario == "evaluate":
+            # The best prompt is picked before timing, as the evaluation scripts read it from a CSV
+            rank = make_rank_stage("pre")
+            warmup_row = rank(warmup_row)
+            rows = [rank(row) for row in rows]
+        if scenario == "pipeline":
+            warmup_row = make_generate_stage("tot")(warmup_row)
+            warmup_row = make_rank_stage("pre")(warmup_row)
+            make_evaluate_stage()(warmup_row)
+        else:
+            _row_function(scenario)(dict(warmup_row))
+        cold_start_seconds = time.perf_counter() - cold_start
+
+        before = server_requests()
+        start_time = time.perf_counter()
+
+        if scenario == "pipeline":
+            from src.pipeline import Stage, run_pipeline
+
+            stages = [
+                Stage("generate", make_generate_stage("tot"), concurrency),
+                Stage("rank_pre", make_rank_stage("pre"), concurrency),
+                Stage("evaluate", make_evaluate_stage(), concurrency),
+            ]
+            records = ({"Prompt": row["Prompt"], "Human Story": row["Human Story"], "Started": time.perf_counter()} for row in rows)
+
+            def sink(record):
+                latencies.append(time.perf_counter() - record["Started"])
+
+            stats = run_pipeline(records, stages, sink, queue_size=concurrency * 2)
+            errors = stats["failed_rows"]
+        else:
+            fn = _row_function(scenario)
+
+            def timed(row):
+                row_start = time.perf_counter()
+                try:
+                    fn(dict(row))
+                except Exception:
+                    return None
+                return time.perf_counter() - row_start
+
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for latency in executor.map(timed, rows):
+                    if latency is None:
+                        errors += 1
+                    else:
+                        latencies.append(latency)
+
+        wall_seconds = time.perf_counter() - start_time
+        after = server_requests()
+
+    completed = len(latencies)
+    latencies = np.array(latencies) if latencies else np.array([np.nan])
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "rows": num_rows,
+        "completed_rows": completed,
+        "failed_rows": errors,
+        "wall_seconds": round(wall_seconds, 4),
+        "cold_start_seconds": round(cold_start_seconds, 4),
+        "rows_per_second": round(completed / wall_seconds, 4) if wall_seconds > 0 else None,
+        "latency_seconds": {
+            "p50": round(float(np.percentile(latencies, 50)), 4),
+            "p95": round(float(np.percentile(latencies, 95)), 4),
+            "p99": round(float(np.percentile(latencies, 99)), 4),
+            "mean": round(float(np.mean(latencies)), 4),
+        },
+        "calls_per_row": round((after["requests"] - before["requests"]) / num_rows, 3),
+        "rate_limited_calls": after["rate_limited"] - before["rate_limited"],
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+    }
+
+
+def _run_case_isolated(args):
+    scenario, concurrency, num_rows, base_url, seed = args
+    try:
+        return run_case(scenario, concurrency, num_rows, base_url, seed)
+    except Exception as e:
+        return {"scenario": scenario, "concurrency": concurrency, "rows": num_rows, "error": f"{type(e).__name__}: {e}"}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare_reports(baseline, current):
+    """
+    Print the change in rows/sec and p95 latency for every case present in both reports.
+    """
+    def key(result):
+        return result["scenario"], result["concurrency"], result["rows"]
+
+    baseline_results = {key(result): result for result in baseline["results"] if "error" not in result}
+    print(f"\n=== Compared with {baseline['meta'].get('commit')} ===")
+    for result in current["results"]:
+        previous = baseline_results.get(key(result))
+        if previous is None or "error" in result:
+            continue
+        throughput_change = result["rows_per_second"] / previous["rows_per_second"] - 1 if previous["rows_per_second"] else float("nan")
+        p95_change = result["latency_seconds"]["p95"] / previous["latency_seconds"]["p95"] - 1 if previous["latency_seconds"]["p95"] else float("nan")
+        print(f"{result['scenario']:<15} c={result['concurrency']:<3} rows={result['rows']:<5} "
+              f"rows/s {throughput_change:+.1%}  p95 {p95_change:+.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the generation, ranking and evaluation paths against the local stand-in LLM server.")
+    parser.add_argument("--scenarios", type=str, default="generate,rank_pre,rank_post,evaluate,pipeline", help=f"Comma-separated scenarios from: {', '.join(SCENARIOS)}.")
+    parser.add_argument("--concurrency", type=str, default="1,4,16", help="Comma-separated concurrency levels.")
+    parser.add_argument("--rows", type=str, default="20", help="Comma-separated dataset sizes.")
+    parser.add_argument("--ttft", type=str, default="lognormal:200,0.5", help="Stand-in time-to-first-token distribution (see src/local_llm_server.py).")
+    parser.add_argument("--tokens_per_second", type=float, default=2000.0, help="Stand-in output rate.")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="Fraction of stand-in requests answered with 429.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the dataset and the stand-in server.")
+    parser.add_argument("--output", type=str, default="results/benchmark.json", help="Path of the JSON report.")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier JSON report to compare against.")
+    args = parser.parse_args()
+
+    from src.local_llm_server import start_server
+
+    server = start_server(ttft=args.ttft, tokens_per_second=args.tokens_per_second,
+                          rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+    backend = {"ttft": args.ttft, "tokens_per_second": args.tokens_per_second,
+               "rate_limit_rate": args.rate_limit_rate, "seed": args.seed}
+
+    cases = [
+        (scenario, int(concurrency), int(rows), server.url, args.seed)
+        for scenario in args.scenarios.split(",")
+        for rows in args.rows.split(",")
+        for concurrency in args.concurrency.split(",")
+    ]
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for case in cases:
+        # A fresh interpreter per case, so peak RSS and warm caches do not carry over
+        with context.Pool(1) as pool:
+            result = pool.apply(_run_case_isolated, (case,))
+        results.append(result)
+        if "error" in result:
+            print(f"{result['scenario']:<15} c={result['concurrency']:<3} rows={result['rows']:<5} failed: {result['error']}")
+        else:
+            latency = result["latency_seconds"]
+            print(f"{result['scenario']:<15} c={result['concurrency']:<3} rows={result['rows']:<5} "
+                  f"{result['rows_per_second']:8.2f} rows/s  p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  "
+                  f"p99 {latency['p99']:.3f}s  {result['calls_per_row']:.1f} calls/row  {result['peak_rss_mb']:.0f} MB  "
+                  f"cold start {result['cold_start_seconds']:.2f}s")
+    server.shutdown()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backend": backend,
+        },
+        "results": results,
+    }
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Report saved to '{args.output}'.")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare_reports(json.load(file), report)
@@ -0,0 +1,131 @@
+import csv
+import hashlib
+import json
+import os
+
+
+def row_key(*values):
+    """
+    Build a stable key for an input row from its position and contents.
+
+    Parameters:
+    - values: Values identifying the row, e.g. its index, starting prompt and candidate prompts.
+
+    Returns:
+    - str: A hex digest that is identical across runs for the same input row.
+    """
+    payload = json.dumps([str(value) for value in values], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class CheckpointWriter:
+    """
+    Append-as-you-go CSV writer with periodic fsync, resume and atomic finalization.
+
+    Rows are written to `<output_csv>.partial` together with their row key as soon as they
+    are computed. On resume, keys already present in the partial file are skipped. Once all
+    rows are done, `finalize` writes the output CSV (without the key column) to a temporary
+    file and atomically renames it into place. An existing partial file is only discarded when
+    asked to, so starting without `resume` cannot silently throw away a crashed run's progress.
+    """
+
+    KEY_COLUMN = "Row Key"
+
+    def __init__(self, output_csv, header, resume=False, fsync_every=10, overwrite=False):
+        """
+        Parameters:
+        - output_csv (str): Path of the final output CSV.
+        - header (list): Column names of the output CSV.
+        - resume (bool): Keep rows from an existing partial file and skip their input rows.
+        - fsync_every (int): Number of rows between fsyncs of the partial file.
+        - overwrite (bool): Start afresh even if a partial file exists, discarding its rows.
+
+        Raises:
+        - FileExistsError: If a partial file exists and neither `resume` nor `overwrite` is set.
+        """
+        self.output_csv = output_csv
+        self.partial_csv = output_csv + ".partial"
+        self.header = header
+        self.fsync_every = fsync_every
+        self.completed = set()
+        self.pending = 0
+
+        if resume and os.path.exists(self.partial_csv):
+            self._recover_partial()
+            print(f"Resuming: {len(self.completed)} rows already completed in '{self.partial_csv}'.")
+        else:
+            if os.path.exists(self.partial_csv):
+                if not overwrite:
+                    raise FileExistsError(f"'{self.partial_csv}' holds the progress of an interrupted run; "
+                                          f"rerun with --resume to continue it or --overwrite to discard it.")
+                print(f"Overwriting '{self.partial_csv}' from an earlier run.")
+            self.file = open(self.partial_csv, mode='w', newline='', encoding='utf-8')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow([self.KEY_COLUMN] + header)
+            self._sync()
+
+    def _recover_partial(self):
+        # A crash can leave a truncated last row; rewrite the partial file with complete rows only
+        width = len(self.header) + 1
+        tmp_csv = self.partial_csv + ".tmp"
+        with open(self.partial_csv, mode='r', newline='', encoding='utf-8') as source, \
+                open(tmp_csv, mode='w', newline='', encoding='utf-8') as target:
+            reader = csv.reader(source)
+            writer = csv.writer(target)
+            if next(reader, None) != [self.KEY_COLUMN] + self.header:
+                raise ValueError(f"Partial file '{self.partial_csv}' has a different header; remove it or run without resume.")
+            writer.writerow([self.KEY_COLUMN] + self.header)
+            try:
+                for row in reader:
+                    if len(row) == width:
+                        writer.writerow(row)
+                        self.completed.add(row[0])
+            except csv.Error:
+                pass  # Unterminated quoted field at the end of the file
+        os.replace(tmp_csv, self.partial_csv)
+
+        self.file = open(self.partial_csv, mode='a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def is_done(self, key):
+        """
+        Return True if the row with this key was completed by a previous run.
+        """
+        return key in self.completed
+
+    def write(self, key, row):
+        """
+        Append one output row, fsyncing every `fsync_every` rows.
+        """
+        self.writer.writerow([key] + list(row))
+        self.file.flush()  # Hand each complete row to the OS so a crash cannot leave it half-buffered
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self._sync()
+
+    def finalize(self):
+        """
+        Write the completed rows to the output CSV atomically and remove the partial file.
+        """
+        self._sync()
+        self.file.close()
+
+        tmp_csv = self.output_csv + ".tmp"
+        with open(self.partial_csv, mode='r', newline='', encoding='utf-8') as source, \
+                open(tmp_csv, mode='w', newline='', encoding='utf-8') as target:
+            reader = csv.reader(source)
+            writer = csv.writer(target)
+            next(reader)
+            writer.writerow(self.header)
+            for row in reader:
+                writer.writerow(row[1:])
+            target.flush()
+            os.fsync(target.fileno())
+        os.replace(tmp_csv, self.output_csv)
+        os.remove(self.partial_csv)
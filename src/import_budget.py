@@ -0,0 +1,71 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Maximum cumulative import time (seconds) for each entry point. Heavy dependencies
+# (cohere, pandas, torch, sentence_transformers) are imported on first use, so importing an
+# entry point for --help, a test or a worker fork should stay well under these.
+ENTRY_POINT_BUDGETS = {
+    "src.prompt_generation.cot_prompt": 0.2,
+    "src.prompt_generation.tot_prompts": 0.2,
+    "src.prompt_generation.got_prompts": 0.2,
+    "src.prompt_ranking.rank_manual_metrics": 0.3,
+    "src.prompt_ranking.rank_pre_generation": 0.2,
+    "src.prompt_ranking.rank_post_generation": 0.3,
+    "src.story_evaluation.generate_CoT": 0.3,
+    "src.story_evaluation.generate_ToT": 0.3,
+    "src.story_evaluation.generate_GoT": 0.3,
+    "src.story_evaluation_post_ranking.evaluation_manual_metrics": 0.3,
+    "src.story_evaluation_post_ranking.evaluation_post_generation": 0.3,
+    "src.story_evaluation_post_ranking.evaluation_pre_generation": 0.3,
+    "app.server": 0.6,
+}
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def measure_import_time(module, repeat=3):
+    """
+    Measure the cumulative import time of a module in a fresh interpreter.
+
+    Parameters:
+    - module (str): Dotted module name to import.
+    - repeat (int): Number of fresh interpreters to try; the fastest run is reported.
+
+    Returns:
+    - float: Import time in seconds, excluding interpreter startup.
+    """
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=REPO_ROOT, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+            raise RuntimeError(f"Importing {module} failed:\n{errors[-1] if errors else ''}")
+        # Lines look like "import time:   self [us] | cumulative | imported package"
+        for line in result.stderr.splitlines():
+            parts = line.split("|")
+            if len(parts) == 3 and parts[2].strip() == module:
+                timings.append(int(parts[1]) / 1e6)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the import time of every entry point against its budget.")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per module; the fastest run counts.")
+    args = parser.parse_args()
+
+    over_budget = []
+    for module, budget in ENTRY_POINT_BUDGETS.items():
+        elapsed = measure_import_time(module, args.repeat)
+        status = "ok" if elapsed <= budget else "OVER BUDGET"
+        print(f"{module:<65} {elapsed * 1000:8.1f} ms / {budget * 1000:6.0f} ms  {status}")
+        if elapsed > budget:
+            over_budget.append(module)
+
+    if over_budget:
+        print(f"{len(over_budget)} entry point(s) over budget.")
+        sys.exit(1)
@@ -0,0 +1,192 @@
+import json
+import math
+import re
+import threading
+
+from src.llm_client import forget_text, generate_text
+
+# Closing instruction shared by the judge templates
+JSON_INSTRUCTION = (
+    'Answer only with a JSON object mapping each metric name to its score, nothing else. For example: {example}'
+)
+
+# Asks again for the metrics a judgement left out, with the same prompt and submission
+REASK_NOTE = "Score only the metrics listed below; the others have already been scored."
+
+# Binary story metrics shared by the story judges in src/utils.py and rank_post_generation.py
+STORY_METRICS = {
+    "Helpfulness": "Does the story contribute to the plot, character development, or themes?",
+    "Directness": "Does the story stay focused and move the plot forward?",
+    "Grammaticality": "Is the story grammatically correct and easy to read?",
+    "Relevance": "Does the story stay on-topic and relevant to its theme or prompt?",
+    "Edge": "Does the story include unique or surprising elements?",
+    "Supposition": "Does the story explore hypothetical situations or provoke analysis?",
+    "Creativity": "How original and imaginative is the story?",
+    "Coherence": "Is the language in the story coherent for the reader?",
+}
+
+# "Metric: score" lines, accepted when a judge ignores the JSON instruction
+_LINE_PATTERN = re.compile(r"^[\s\-*\"'#]*([A-Za-z][A-Za-z ]*?)[\s*\"']*[:=]\s*[\"']?(-?\d+(?:\.\d+)?)", re.MULTILINE)
+
+
+def _normalise(name):
+    return re.sub(r"[^a-z]", "", name.lower())
+
+
+class JudgeSchema:
+    """
+    The metrics a judge scores and the range of valid scores, compiled once and used to parse
+    every response in a single pass.
+    """
+
+    def __init__(self, metrics, low=0, high=1):
+        """
+        Parameters:
+        - metrics (dict): Metric name to the question the judge answers for it, in prompt order.
+        - low (int): Lowest valid score.
+        - high (int): Highest valid score.
+        """
+        self.metrics = dict(metrics)
+        self.low = low
+        self.high = high
+        self.lookup = {_normalise(name): name for name in self.metrics}
+        self.example = json.dumps({name: high if i % 2 == 0 else low for i, name in enumerate(list(self.metrics)[:2])})
+
+    def describe(self, names=None):
+        """
+        Return the "Name: question" lines for the given metrics (all by default), for a template's {metrics} field.
+        """
+        return "\n".join(f"    {name}: {self.metrics[name]}" for name in (names or self.metrics))
+
+    def instruction(self):
+        return JSON_INSTRUCTION.format(example=self.example)
+
+    def validate(self, items):
+        """
+        Validate (name, value) pairs against the schema.
+
+        Returns:
+        - dict: Valid scores by canonical metric name. Unknown metrics and invalid values are dropped.
+        """
+        scores = {}
+        for name, value in items:
+            metric = self.lookup.get(_normalise(str(name)))
+            if metric is None or metric in scores or isinstance(value, bool):
+                continue
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                continue
+            if number.is_integer() and self.low <= number <= self.high:
+                scores[metric] = int(number)
+        return scores
+
+    def parse(self, response_text):
+        """
+        Parse a judge response: a JSON object if there is one, otherwise "Metric: score" lines.
+
+        Returns:
+        - tuple: (scores, missing) with the valid scores by metric and the list of metrics without one.
+        """
+        items = None
+        start, end = response_text.find("{"), response_text.rfind("}")
+        if start != -1 and end > start:
+            try:
+                parsed = json.loads(response_text[start:end + 1])
+                if isinstance(parsed, dict):
+                    items = parsed.items()
+            except json.JSONDecodeError:
+                pass
+        if items is None:
+            items = _LINE_PATTERN.findall(response_text)
+        scores = self.validate(items)
+        return scores, [name for name in self.metrics if name not in scores]
+
+
+_stats = {"judgements": 0, "parse_failures": 0, "partial": 0, "reasks": 0, "recovered": 0, "incomplete": 0, "discarded": 0}
+_stats_lock = threading.Lock()
+
+
+def record(**increments):
+    """
+    Add to the judge protocol counters (see `stats`).
+    """
+    with _stats_lock:
+        for name, value in increments.items():
+            _stats[name] += value
+
+
+def stats():
+    """
+    Return the judge protocol counters:
+    - judgements: judge calls made, re-asks excluded.
+    - parse_failures: responses with no usable score at all.
+    - partial: responses missing some metrics.
+    - reasks / recovered: re-asks sent, and judgements they completed.
+    - incomplete: judgements returned with NaN for metrics still missing.
+    - discarded: judgements with no usable score, raised as errors.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def judge(template, fields, schema, max_tokens=500, temperature=0.01, api_key=None, reasks=1, allow_partial=True):
+    """
+    Run a judge call and return its validated scores, re-asking only for missing metrics.
+
+    Parameters:
+    - template (str): Judge template with a {metrics} field for the metric lines and an
+      {instruction} field for the answer format, plus the fields in `fields`.
+    - fields (dict): Values for the template's other fields (prompt, story, ...).
+    - schema (JudgeSchema): Metrics and score range to validate against.
+    - max_tokens (int): Maximum tokens for the judge's answer.
+    - temperature (float): Sampling temperature; near zero so the judgement is cached.
+    - api_key (str): Cohere API key.
+    - reasks (int): Follow-up calls allowed for metrics the judge left out or got wrong.
+    - allow_partial (bool): Return NaN for metrics still missing after the re-asks instead of raising.
+
+    Returns:
+    - dict: Score per metric, in schema order; NaN for missing metrics when `allow_partial` is set.
+
+    Raises:
+    - ValueError: If no metric could be scored, or some are missing and `allow_partial` is not set.
+    """
+    def ask(names, note=""):
+        formatted_prompt = template.format(metrics=schema.describe(names), instruction=(note + " " if note else "") + schema.instruction(), **fields)
+        response_text = generate_text(formatted_prompt, max_tokens=max_tokens, temperature=temperature, template=template, api_key=api_key)
+        scores, missing = schema.parse(response_text)
+        if any(name in missing for name in (names or schema.metrics)):
+            # An answer missing scores would otherwise be replayed from the cache on every retry
+            forget_text(formatted_prompt, max_tokens=max_tokens, temperature=temperature, template=template)
+        return (scores, missing), response_text
+
+    (scores, missing), response_text = ask(None)
+    record(judgements=1)
+    if not scores:
+        record(parse_failures=1)
+    elif missing:
+        record(partial=1)
+
+    for _ in range(reasks if missing else 0):
+        record(reasks=1)
+        (new_scores, _), _ = ask(missing, REASK_NOTE)
+        # Only the metrics that were asked for are taken from the re-ask
+        scores.update({name: score for name, score in new_scores.items() if name in missing})
+        missing = [name for name in missing if name not in scores]
+        if not missing:
+            record(recovered=1)
+            break
+
+    if not scores:
+        record(discarded=1)
+        raise ValueError(f"No valid scores in judge response: {response_text}")
+    if missing:
+        if not allow_partial:
+            record(discarded=1)
+            raise ValueError(f"Judge response is missing scores for {', '.join(missing)}: {response_text}")
+        record(incomplete=1)
+    return {name: scores.get(name, math.nan) for name in schema.metrics}
+
+
+# Schemas are compiled once and shared by every judge call
+STORY_SCHEMA = JudgeSchema(STORY_METRICS, low=0, high=1)
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Calls at or below this temperature are treated as deterministic (the judges run at 0.01).
+DETERMINISTIC_TEMPERATURE = 0.05
+
+
+class LLMCache:
+    """
+    On-disk, content-addressed cache of LLM generations backed by SQLite.
+
+    Entries are keyed by a hash of (template, rendered prompt, model, temperature, max_tokens)
+    and evicted least-recently-used once the stored text exceeds `max_bytes`.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, cache_sampled=False):
+        """
+        Parameters:
+        - path (str): SQLite file holding the cache.
+        - max_bytes (int): Size budget for cached text; older entries are evicted beyond it.
+        - cache_sampled (bool): Also cache calls with temperature above DETERMINISTIC_TEMPERATURE.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.cache_sampled = cache_sampled
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS generations_last_access ON generations(last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+
+    @staticmethod
+    def make_key(template, prompt, model, temperature, max_tokens, sample=None):
+        """
+        Hash the inputs that determine a generation into a cache key.
+
+        `sample` tells apart repeated samples of the same prompt (e.g. the candidates of one
+        entry), which would otherwise share a key and all be served the first sample's text.
+        """
+        parts = [template, prompt, model, temperature, max_tokens]
+        if sample is not None:
+            parts.append(sample)  # Keys without a sample index stay as they were
+        payload = json.dumps(parts, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def should_cache(self, temperature):
+        """
+        Return True if a call at this temperature is eligible for caching under the current policy.
+
+        A temperature of None leaves it to the API default, which samples, so it counts as sampled.
+        """
+        if self.cache_sampled:
+            return True
+        return temperature is not None and temperature <= DETERMINISTIC_TEMPERATURE
+
+    def get(self, key):
+        """
+        Return the cached text for `key`, or None on a miss.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT text FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE generations SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, key, text):
+        """
+        Store `text` under `key` and evict least-recently-used entries if over budget.
+        """
+        size = len(text.encode("utf-8"))
+        with self.lock:
+            previous = self.conn.execute("SELECT size FROM generations WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO generations (key, text, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, text, size, time.time()),
+            )
+            self.total_bytes += size - (previous[0] if previous else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def delete(self, key):
+        """
+        Remove the entry for `key`, if any, e.g. a response its caller could not use.
+        """
+        with self.lock:
+            previous = self.conn.execute("SELECT size FROM generations WHERE key = ?", (key,)).fetchone()
+            if previous is None:
+                return
+            self.conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+            self.total_bytes -= previous[0]
+            self.conn.commit()
+
+    def _evict(self):
+        # Drop the least recently used entries until usage is back under 90% of the budget
+        target = self.max_bytes * 0.9
+        while self.total_bytes > target:
+            rows = self.conn.execute(
+                "SELECT key, size FROM generations ORDER BY last_access ASC LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.total_bytes <= target:
+                    break
+                self.conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+                self.total_bytes -= size
+
+    def stats(self):
+        """
+        Return hit/miss counters and the current size of the cache.
+        """
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "bytes": self.total_bytes,
+            }
+
+
+_cache = None
+_cache_configured = False
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Return the process-wide LLM cache, or None if caching is disabled with AUTOPROMPT_CACHE=0.
+
+    The cache is configured from the environment (or .env file) on first use:
+    - AUTOPROMPT_CACHE_PATH: SQLite file (default ~/.cache/autopromptgenie/llm_cache.sqlite).
+    - AUTOPROMPT_CACHE_MAX_MB: Size budget in megabytes (default 512).
+    - AUTOPROMPT_CACHE_SAMPLED: Set to 1 to also cache sampled generations (temperature above
+      DETERMINISTIC_TEMPERATURE or left to the API default), which are otherwise skipped since a hit replaces a fresh sample with an old one.
+    """
+    global _cache, _cache_configured
+    if not _cache_configured:
+        with _cache_lock:
+            if not _cache_configured:
+                from dotenv import load_dotenv
+                load_dotenv()
+                if os.getenv("AUTOPROMPT_CACHE", "1") != "0":
+                    _cache = LLMCache(
+                        os.path.expanduser(os.getenv("AUTOPROMPT_CACHE_PATH", "~/.cache/autopromptgenie/llm_cache.sqlite")),
+                        max_bytes=int(float(os.getenv("AUTOPROMPT_CACHE_MAX_MB", "512")) * 1024 * 1024),
+                        cache_sampled=os.getenv("AUTOPROMPT_CACHE_SAMPLED", "0") == "1",
+                    )
+                _cache_configured = True
+    return _cache
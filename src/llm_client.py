@@ -0,0 +1,302 @@
+import os
+import sys
+import threading
+import time
+
+from src.llm_cache import get_cache
+from src.rate_control import current_controller, rate_limits_handled
+from src.resilience import call_with_retries, get_hedger, get_retry_policy
+from src.tracing import enabled as tracing_enabled, span, template_id
+
+_clients = {}
+_http_clients = []
+_host_semaphores = {}
+_lock = threading.Lock()
+_env_loaded = False
+_transport_class = None
+
+
+def load_env():
+    """
+    Load environment variables from the .env file once per process.
+
+    Called lazily by the accessors below instead of at import time, so importing a module
+    for --help, a test or a worker fork does not touch the filesystem or the network.
+    """
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+def get_api_key():
+    """
+    Return the Cohere API key from the environment (or .env file).
+    """
+    load_env()
+    return os.getenv("COHERE_API_KEY")
+
+
+def _pool_settings():
+    # Pool settings, overridable from the environment so long evaluation runs can be tuned
+    # without touching code.
+    load_env()
+    pool_size = int(os.getenv("COHERE_POOL_SIZE", "16"))  # Max open connections per client
+    return {
+        "pool_size": pool_size,
+        "keepalive": int(os.getenv("COHERE_POOL_KEEPALIVE", "8")),  # Idle connections kept warm
+        "keepalive_expiry": float(os.getenv("COHERE_KEEPALIVE_EXPIRY", "60")),  # Seconds an idle connection is kept
+        "per_host_limit": int(os.getenv("COHERE_PER_HOST_LIMIT", str(pool_size))),  # Concurrent requests per upstream host
+        "timeout": float(os.getenv("COHERE_TIMEOUT", "120")),  # Seconds per request
+    }
+
+
+def _get_transport_class():
+    """
+    Return the HTTP transport class that caps the number of in-flight requests per upstream host.
+
+    httpx only limits the total size of the pool; this keeps a single slow host from
+    taking every connection when several base URLs share the same process. The class is
+    defined on first use so httpx is not imported with this module.
+    """
+    global _transport_class
+    if _transport_class is None:
+        import httpx
+
+        class HostLimitedTransport(httpx.HTTPTransport):
+            def __init__(self, per_host_limit, **kwargs):
+                super().__init__(**kwargs)
+                self.per_host_limit = per_host_limit
+
+            def handle_request(self, request):
+                host = request.url.host
+                with _lock:
+                    semaphore = _host_semaphores.get(host)
+                    if semaphore is None:
+                        semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                        _host_semaphores[host] = semaphore
+                with semaphore:
+                    return super().handle_request(request)
+
+        _transport_class = HostLimitedTransport
+    return _transport_class
+
+
+def _build_http_client(settings):
+    """
+    Build a keep-alive httpx client with a bounded connection pool.
+    """
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=settings["pool_size"],
+        max_keepalive_connections=min(settings["keepalive"], settings["pool_size"]),
+        keepalive_expiry=settings["keepalive_expiry"],
+    )
+    transport = _get_transport_class()(settings["per_host_limit"], limits=limits, retries=0)
+    return httpx.Client(transport=transport, limits=limits, timeout=settings["timeout"])
+
+
+def get_client(api_key=None, base_url=None):
+    """
+    Return the shared Cohere client for the given API key.
+
+    Clients are created on first use, once per (api_key, base_url), and reused by every
+    caller, so all pipeline stages share the same pool of warm connections. The function
+    is thread-safe.
+
+    Parameters:
+    - api_key (str): Cohere API key. Defaults to the COHERE_API_KEY environment variable.
+    - base_url (str): Override for the Cohere endpoint. Defaults to COHERE_BASE_URL if set.
+
+    Returns:
+    - cohere.Client: A client backed by a pooled keep-alive HTTP connection.
+    """
+    api_key = api_key or get_api_key()
+    base_url = base_url or os.getenv("COHERE_BASE_URL")
+    key = (api_key, base_url)
+
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            import cohere  # Deferred: importing the SDK takes about a second
+
+            settings = _pool_settings()
+            http_client = _build_http_client(settings)
+            _http_clients.append(http_client)
+            kwargs = {"httpx_client": http_client, "timeout": settings["timeout"]}
+            if base_url:
+                kwargs["base_url"] = base_url
+            client = cohere.Client(api_key, **kwargs)
+            _clients[key] = client
+    return client
+
+
+def close_clients():
+    """
+    Close every pooled client and release its connections.
+    """
+    with _lock:
+        for http_client in _http_clients:
+            http_client.close()
+        _http_clients.clear()
+        _clients.clear()
+
+
+def _output_tokens(response, text):
+    # Billed output tokens when the API reports them, otherwise a word count
+    billed_units = getattr(getattr(response, "meta", None), "billed_units", None)
+    output_tokens = getattr(billed_units, "output_tokens", None)
+    return int(output_tokens) if output_tokens is not None else len(text.split())
+
+
+def generate_text(prompt, max_tokens=None, temperature=None, model=None, template=None, api_key=None, deadline=None, sample=None):
+    """
+    Generate text for a prompt through the shared client, consulting the persistent cache first.
+
+    Transient failures are retried with backoff within the call's deadline, and slow requests
+    are hedged when enabled (see src/resilience.py).
+
+    Parameters:
+    - prompt (str): The fully rendered prompt.
+    - max_tokens (int): Maximum tokens to generate. None uses the API default.
+    - temperature (float): Sampling temperature. None uses the API default.
+    - model (str): Cohere model to use. None uses the API default.
+    - template (str): The template the prompt was rendered from, used as part of the cache key.
+    - api_key (str): Cohere API key. Defaults to the COHERE_API_KEY environment variable.
+    - deadline (float): Seconds the call may take across retries. None uses AUTOPROMPT_CALL_DEADLINE.
+    - sample (int): Index of this call among repeated samples of the same prompt, so that each
+      sample is cached under its own key when sampled calls are cached.
+
+    Returns:
+    - str: The generated text, stripped of surrounding whitespace.
+    """
+    with span("llm.generate", prompt_chars=len(prompt), max_tokens=max_tokens, temperature=temperature) as current:
+        if tracing_enabled():
+            current.set(caller=sys._getframe(1).f_code.co_name, template=template_id(template))
+
+        cache = get_cache()
+        key = None
+        if cache is not None and cache.should_cache(temperature):
+            key = cache.make_key(template, prompt, model, temperature, max_tokens, sample)
+            cached = cache.get(key)
+            if cached is not None:
+                current.set(cache_hit=True, output_chars=len(cached))
+                return cached
+
+        kwargs = {"prompt": prompt}
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        if model is not None:
+            kwargs["model"] = model
+        client = get_client(api_key)
+        attempts = [0]
+
+        def attempt(timeout):
+            attempts[0] += 1
+            # The request span isolates time on the network from cache and client overhead
+            with span("llm.request", attempt=attempts[0]):
+                # Retries are left to call_with_retries, which classifies them and honours the deadline
+                return client.generate(**kwargs, request_options={"timeout": timeout, "max_retries": 0})
+
+        retry_options = {"hedger": get_hedger(), "key": template_id(template), "description": "Generate call", "deadline": deadline}
+        controller = current_controller()
+        if controller is not None and not rate_limits_handled():
+            # Under `throttle_calls`, this call alone waits for the controller and is retried by it on a 429
+            response = controller.call(call_with_retries, attempt, **retry_options)
+        else:
+            response = call_with_retries(attempt, **retry_options)
+        text = response.generations[0].text.strip()
+        if tracing_enabled():
+            current.set(cache_hit=False, retries=attempts[0] - 1, output_chars=len(text),
+                        output_tokens=_output_tokens(response, text))
+
+        if key is not None:
+            cache.put(key, text)
+        return text
+
+
+def forget_text(prompt, max_tokens=None, temperature=None, model=None, template=None, sample=None):
+    """
+    Drop the cached generation for a call, so the next identical call asks the API again.
+
+    Callers use this when a response turns out to be unusable (e.g. a judge answer that does not
+    parse); otherwise every retry would replay the same cached answer. Takes the same parameters
+    as `generate_text`.
+    """
+    cache = get_cache()
+    if cache is not None and cache.should_cache(temperature):
+        cache.delete(cache.make_key(template, prompt, model, temperature, max_tokens, sample))
+
+
+def stream_text(prompt, max_tokens=None, temperature=None, model=None, template=None, api_key=None, deadline=None, sample=None):
+    """
+    Stream a generation segment by segment through the shared client.
+
+    Takes the same parameters as `generate_text`. A cache hit is yielded as a single segment;
+    otherwise segments are yielded as the API produces them and the full text is cached once
+    the stream completes.
+
+    Returns:
+    - iterator: Text segments which, joined, form the (unstripped) generation.
+    """
+    with span("llm.stream", prompt_chars=len(prompt), max_tokens=max_tokens, temperature=temperature) as current:
+        if tracing_enabled():
+            current.set(caller=sys._getframe(1).f_code.co_name, template=template_id(template))
+
+        cache = get_cache()
+        key = None
+        if cache is not None and cache.should_cache(temperature):
+            key = cache.make_key(template, prompt, model, temperature, max_tokens, sample)
+            cached = cache.get(key)
+            if cached is not None:
+                current.set(cache_hit=True, output_chars=len(cached))
+                yield cached
+                return
+
+        kwargs = {"prompt": prompt}
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        if model is not None:
+            kwargs["model"] = model
+
+        segments = []
+        start_time = time.perf_counter()
+        policy = get_retry_policy()
+        deadline_at = time.monotonic() + (policy.deadline if deadline is None else deadline)
+        attempt = 0
+        while True:
+            try:
+                request_options = {"timeout": max(0.0, deadline_at - time.monotonic()), "max_retries": 0}
+                for event in get_client(api_key).generate_stream(**kwargs, request_options=request_options):
+                    if event.event_type == "text-generation":
+                        if not segments:
+                            current.set(time_to_first_token_ms=(time.perf_counter() - start_time) * 1000)
+                        segments.append(event.text)
+                        yield event.text
+                    elif event.event_type == "stream-error":
+                        raise RuntimeError(f"Generation stream failed: {event.err}")
+                break
+            except Exception as e:
+                # Once text has been sent on, a retry would repeat it; only failures before the first segment are retried
+                delay = None if segments else policy.retry_delay(e, attempt, deadline_at)
+                if delay is None:
+                    raise
+                attempt += 1
+                current.set(retries=attempt)
+                print(f"Generate stream failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+        text = "".join(segments).strip()
+        current.set(cache_hit=False, output_chars=len(text), output_tokens=len(segments))
+        if key is not None:
+            cache.put(key, text)
@@ -0,0 +1,334 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Metric names and descriptions used by the story judges, so answers here track the real schema
+from src.judge_protocol import STORY_METRICS
+
+WORDS = (
+    "the a an old young quiet restless city forest river village storm letter door secret "
+    "journey promise shadow light memory stranger friend sister captain machine garden winter "
+    "summer night morning voice map key window train bridge island mountain kingdom signal "
+    "discovers hides remembers follows breaks opens chooses loses finds waits returns escapes "
+    "slowly suddenly finally carefully again never always together alone beyond before after"
+).split()
+
+
+def parse_distribution(spec):
+    """
+    Parse a latency distribution spec into a sampler returning seconds.
+
+    Supported specs (values in milliseconds):
+    - "fixed:200"
+    - "uniform:100,400"
+    - "normal:300,50" (mean, standard deviation; clipped at 0)
+    - "lognormal:300,0.5" (median, sigma of the underlying normal)
+    - "exp:300" (mean)
+    """
+    kind, _, values = spec.partition(":")
+    params = [float(value) for value in values.split(",")] if values else []
+    # Everything is in milliseconds except the lognormal sigma
+    params = [value if kind == "lognormal" and i == 1 else value / 1000 for i, value in enumerate(params)]
+    samplers = {
+        "fixed": lambda rng: params[0],
+        "uniform": lambda rng: rng.uniform(params[0], params[1]),
+        "normal": lambda rng: max(0.0, rng.gauss(params[0], params[1])),
+        "lognormal": lambda rng: params[0] * rng.lognormvariate(0, params[1]),
+        "exp": lambda rng: rng.expovariate(1 / params[0]) if params[0] > 0 else 0.0,
+    }
+    expected_params = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exp": 1}
+    if kind not in samplers or len(params) != expected_params[kind]:
+        raise ValueError(f"Invalid latency distribution '{spec}'.")
+    return samplers[kind]
+
+
+def _sentence(rng, length):
+    words = [rng.choice(WORDS) for _ in range(length)]
+    return " ".join(words).capitalize() + "."
+
+
+def _text(rng, num_words):
+    sentences = []
+    while num_words > 0:
+        length = min(num_words, rng.randint(6, 14))
+        sentences.append(_sentence(rng, length))
+        num_words -= length
+    return " ".join(sentences)
+
+
+def canned_output(prompt, max_tokens, seed=0):
+    """
+    Return a deterministic generation for a prompt, in the format the repo's parsers expect.
+
+    The same prompt (and seed) always gets the same output, so cache and ranking behaviour is
+    reproducible. Judge prompts get scores, prompt generation templates get a branching
+    structure and anything else gets prose, all capped at roughly `max_tokens` words.
+    """
+    digest = hashlib.sha256(f"{seed}:{prompt}".encode("utf-8")).digest()
+    rng = random.Random(int.from_bytes(digest[:8], "little"))
+
+    # Batched candidate judge (BATCH_EVALUATION_TEMPLATE): a JSON object keyed by candidate number
+    if "JSON object keyed by candidate number" in prompt:
+        candidates = sorted({int(number) for number in re.findall(r"Candidate (\d+):", prompt)}) or [1]
+        return json.dumps({str(i): {"Relevance": rng.randint(0, 5), "Diversity": rng.randint(0, 5)} for i in candidates})
+
+    # JSON judges (src/judge_protocol.py): a JSON object scoring each metric listed after "Metrics:"
+    if "JSON object mapping each metric name" in prompt:
+        metrics = re.findall(r"^\s*([A-Z][A-Za-z]+): ", prompt.rpartition("Metrics:")[2], re.MULTILINE)
+        high = 5 if "scale: 0 to 5" in prompt else 1
+        return json.dumps({metric: rng.randint(0, high) for metric in metrics})
+
+    # Single candidate judge (EVALUATION_TEMPLATE): one "Metric: score" line per metric
+    if "Candidate Prompt" in prompt and "Relevance:" in prompt and "Diversity:" in prompt:
+        return f"Relevance: {rng.randint(0, 5)}\nDiversity: {rng.randint(0, 5)}"
+
+    # Story judges: a 0/1 score per metric, one per line
+    if all(f"{metric}:" in prompt for metric in STORY_METRICS.keys()):
+        return "\n".join(f"{metric}: {rng.randint(0, 1)}" for metric in STORY_METRICS.keys())
+
+    budget = max(1, max_tokens or 500)
+
+    # Story generation (generate_story_with_cohere): prose
+    if prompt.startswith("Choose branches from the following prompt structure"):
+        return _text(rng, min(budget, 500))
+
+    # Tree/graph/chain of thought prompt generation: a layered structure with branches
+    if "prompt creator" in prompt.lower() or "of thought" in prompt.lower():
+        sections = ["Character Development", "Setting", "Conflict/Problem", "Resolution/Action", "Conclusion"]
+        lines = []
+        for section in sections:
+            lines.append(f"**{section}**:")
+            lines.append(f"   - {_sentence(rng, 8)}")
+            for branch in range(1, 4):
+                lines.append(f"     - Branch {branch}: {_sentence(rng, 12)}")
+        return "\n".join(lines[:max(2, budget // 10)])
+
+    return _text(rng, min(budget, 200))
+
+
+class LocalLLMServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Cohere generate endpoint (POST /v1/generate), for load testing
+    without network access or API quota.
+
+    Latency is modelled as a sampled time to first token plus the output length divided by
+    `tokens_per_second`. Rate limiting (429) and server errors (500) can be injected at random,
+    and `requests_per_minute` enforces a real limit the clients' rate controllers can adapt to.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, ttft="fixed:50", tokens_per_second=0.0, rate_limit_rate=0.0,
+                 error_rate=0.0, requests_per_minute=None, seed=0):
+        """
+        Parameters:
+        - address (tuple): (host, port) to listen on; port 0 picks a free port.
+        - ttft (str): Distribution of the time to first token, see `parse_distribution`.
+        - tokens_per_second (float): Output rate after the first token; 0 returns everything at once.
+        - rate_limit_rate (float): Fraction of requests answered with 429.
+        - error_rate (float): Fraction of requests answered with 500.
+        - requests_per_minute (float): Upstream limit; requests beyond it get 429. None disables it.
+        - seed (int): Seed for the outputs, latencies and injected failures.
+        """
+        super().__init__(address, _Handler)
+        self.sample_ttft = parse_distribution(ttft)
+        self.tokens_per_second = tokens_per_second
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.allowance = max(requests_per_minute / 60, 1.0) if requests_per_minute else 0.0
+        self.last_refill = time.monotonic()
+        self.counters = {"requests": 0, "streamed": 0, "rate_limited": 0, "errors": 0, "tokens": 0}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def admit(self):
+        """
+        Decide how to answer the next request and sample its time to first token.
+
+        Returns:
+        - tuple: (status, ttft_seconds), with status 200, 429 or 500.
+        """
+        with self.lock:
+            self.counters["requests"] += 1
+            roll = self.rng.random()
+            ttft = self.sample_ttft(self.rng)
+
+            limited = False
+            if self.requests_per_minute:
+                # Token bucket holding at most one second of requests
+                now = time.monotonic()
+                rate = self.requests_per_minute / 60
+                self.allowance = min(max(rate, 1.0), self.allowance + (now - self.last_refill) * rate)
+                self.last_refill = now
+                if self.allowance < 1:
+                    limited = True
+                else:
+                    self.allowance -= 1
+
+            if limited or roll < self.rate_limit_rate:
+                self.counters["rate_limited"] += 1
+                return 429, ttft
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.counters["errors"] += 1
+                return 500, ttft
+            return 200, ttft
+
+    def record_tokens(self, count, streamed):
+        with self.lock:
+            self.counters["tokens"] += count
+            self.counters["streamed"] += int(streamed)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, as with the real API
+
+    def log_message(self, format, *args):
+        pass  # Keep load tests quiet
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(200, self.server.stats())
+        else:
+            self._send_json(404, {"message": "Not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"message": "Invalid JSON body"})
+            return
+        if self.path.rstrip("/") != "/v1/generate":
+            self._send_json(404, {"message": "Not found"})
+            return
+        if not body.get("prompt"):
+            self._send_json(400, {"message": "prompt is required"})
+            return
+
+        server = self.server
+        status, ttft = server.admit()
+        if status == 429:
+            self._send_json(429, {"message": "You are using a Trial key, which is limited. (stand-in)"}, {"Retry-After": "1"})
+            return
+        if status == 500:
+            time.sleep(ttft)
+            self._send_json(500, {"message": "Internal server error (stand-in)"})
+            return
+
+        text = canned_output(body["prompt"], body.get("max_tokens"), server.seed)
+        tokens = re.findall(r"\S+\s*", text)
+        server.record_tokens(len(tokens), bool(body.get("stream")))
+        generation_id = str(uuid.uuid4())
+        response = {
+            "id": str(uuid.uuid4()),
+            "generations": [{"id": generation_id, "text": text, "finish_reason": "COMPLETE"}],
+            "prompt": body["prompt"],
+            "meta": {"api_version": {"version": "1"}, "billed_units": {"input_tokens": len(body["prompt"].split()), "output_tokens": len(tokens)}},
+        }
+        token_delay = 1 / server.tokens_per_second if server.tokens_per_second > 0 else 0.0
+
+        if not body.get("stream"):
+            time.sleep(ttft + token_delay * len(tokens))
+            self._send_json(200, response)
+            return
+
+        # Streamed responses are newline-delimited JSON events, as the SDK's generate_stream expects
+        self.send_response(200)
+        self.send_header("Content-Type", "application/stream+json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_event(event):
+            data = (json.dumps(event) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        time.sleep(ttft)
+        for index, token in enumerate(tokens):
+            if index:
+                time.sleep(token_delay)
+            write_event({"event_type": "text-generation", "text": token, "is_finished": False})
+        del response["meta"]
+        write_event({"event_type": "stream-end", "is_finished": True, "finish_reason": "COMPLETE", "response": response})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_server(host="127.0.0.1", port=0, **options):
+    """
+    Start a LocalLLMServer in a background thread.
+
+    Parameters:
+    - host (str), port (int): Address to listen on; port 0 picks a free port.
+    - options: Keyword arguments for LocalLLMServer (ttft, tokens_per_second, ...).
+
+    Returns:
+    - LocalLLMServer: The running server; point clients at it with COHERE_BASE_URL=server.url
+      and stop it with `server.shutdown()`.
+    """
+    server = LocalLLMServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="local-llm-server", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Cohere generate API for offline load testing.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=8089, help="Port to listen on.")
+    parser.add_argument("--ttft", type=str, default="lognormal:400,0.5", help="Time-to-first-token distribution in ms: fixed:MS, uniform:LO,HI, normal:MEAN,STD, lognormal:MEDIAN,SIGMA or exp:MEAN.")
+    parser.add_argument("--tokens_per_second", type=float, default=60.0, help="Output tokens per second after the first; 0 returns the whole generation at once.")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="Fraction of requests answered with 429 at random.")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of requests answered with 500 at random.")
+    parser.add_argument("--requests_per_minute", type=float, default=None, help="Enforced request limit; requests beyond it get 429.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for outputs, latencies and injected failures.")
+    args = parser.parse_args()
+
+    server = LocalLLMServer(
+        (args.host, args.port),
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate,
+        requests_per_minute=args.requests_per_minute,
+        seed=args.seed,
+    )
+    print(f"Local LLM stand-in listening on {server.url}")
+    print(f"Point the clients at it with: export COHERE_BASE_URL={server.url} COHERE_API_KEY=local")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served: {server.stats()}")
+        server.server_close()
@@ -0,0 +1,344 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import queue
+import threading
+import time
+
+from src.checkpoint import CheckpointWriter, row_key
+from src.llm_cache import get_cache
+from src.llm_client import generate_text, get_api_key
+from src.prompt_generation.data_loader import iter_prompt_story_pairs
+from src.rate_control import RateController, throttle_calls
+from src.tracing import span
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a pipeline: a function applied to every record by a pool of worker threads.
+    """
+
+    def __init__(self, name, fn, concurrency=1):
+        """
+        Parameters:
+        - name (str): Name used in progress messages and stats.
+        - fn: Function taking a record (dict) and returning the updated record. Exceptions fail
+          the record; later stages skip it.
+        - concurrency (int): Number of records this stage works on at once.
+        """
+        self.name = name
+        self.fn = fn
+        self.concurrency = concurrency
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def stats(self, wall_seconds):
+        """
+        Return counters and utilisation (busy time over available worker time) for this stage.
+        """
+        with self.lock:
+            return {
+                "processed": self.processed,
+                "errors": self.errors,
+                "average_latency": self.busy_seconds / max(1, self.processed + self.errors),
+                "utilisation": self.busy_seconds / (wall_seconds * self.concurrency) if wall_seconds > 0 else 0.0,
+            }
+
+
+def _run_stage(stage, inbox, outbox):
+    # Start the stage's workers; the last one to see the end marker passes it downstream
+    remaining = [stage.concurrency]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                inbox.put(_DONE)  # Let sibling workers see it too
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        outbox.put(_DONE)
+                return
+
+            index, record, error = item
+            if error is None:
+                start_time = time.time()
+                try:
+                    with span("pipeline.stage", stage=stage.name, row=index):
+                        record = stage.fn(record)
+                except Exception as e:
+                    error = f"{stage.name}: {e}"
+                elapsed = time.time() - start_time
+                with stage.lock:
+                    stage.busy_seconds += elapsed
+                    if error is None:
+                        stage.processed += 1
+                    else:
+                        stage.errors += 1
+                        print(f"[{stage.name}] Error processing row {index}: {error}")
+            outbox.put((index, record, error))
+
+    for _ in range(stage.concurrency):
+        threading.Thread(target=worker, name=f"pipeline-{stage.name}", daemon=True).start()
+
+
+def run_pipeline(records, stages, sink, queue_size=8, on_error=None):
+    """
+    Stream records through a chain of stages running concurrently.
+
+    Each stage has its own worker threads and hands records to the next stage through a queue
+    holding at most `queue_size` records, so a slow stage applies backpressure upstream instead
+    of letting work pile up in memory. While one record is in the last stage, the next ones are
+    already in the earlier stages. Records finished ahead of a slow earlier one wait to be
+    released in order; once `queue_size` of them are waiting, no new records are fed in.
+
+    Parameters:
+    - records: Iterable of records (dicts), consumed lazily.
+    - stages: List of Stage objects applied in order.
+    - sink: Function called with each successful final record, in input order.
+    - queue_size (int): Capacity of each queue between stages.
+    - on_error: Optional function `on_error(index, record, error)` for failed records.
+
+    Returns:
+    - dict: Wall time, row counts, rows per second and per-stage stats.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    for stage, inbox, outbox in zip(stages, queues, queues[1:]):
+        _run_stage(stage, inbox, outbox)
+
+    start_time = time.time()
+
+    # Records can finish out of order when a stage has several workers; they are held here and
+    # released in order
+    pending = {}
+    released = threading.Condition()
+
+    def feed():
+        for index, record in enumerate(records):
+            # Stop feeding while the records held back behind a slow one fill the buffer
+            with released:
+                while len(pending) >= queue_size:
+                    released.wait()
+            queues[0].put((index, record, None))
+        queues[0].put(_DONE)
+
+    threading.Thread(target=feed, name="pipeline-source", daemon=True).start()
+
+    next_index = 0
+    succeeded = failed = 0
+    while True:
+        item = queues[-1].get()
+        if item is _DONE:
+            break
+        with released:
+            pending[item[0]] = item
+        while next_index in pending:
+            with released:
+                index, record, error = pending.pop(next_index)
+                released.notify()
+            if error is None:
+                sink(record)
+                succeeded += 1
+            else:
+                failed += 1
+                if on_error is not None:
+                    on_error(index, record, error)
+            next_index += 1
+
+    wall_seconds = time.time() - start_time
+    return {
+        "wall_seconds": wall_seconds,
+        "rows": succeeded,
+        "failed_rows": failed,
+        "rows_per_second": succeeded / wall_seconds if wall_seconds > 0 else 0.0,
+        "stages": {stage.name: stage.stats(wall_seconds) for stage in stages},
+    }
+
+
+def make_generate_stage(technique="tot", num_calls=3, max_tokens=1000, temperature=0.7):
+    """
+    Return a stage function adding `num_calls` candidate prompts ("Response 1", ...) to a record.
+    """
+    from src.prompt_generation.prompt_template import GOT_TEMPLATE, TEMPLATE_TOT
+
+    template = {"tot": TEMPLATE_TOT, "got": GOT_TEMPLATE}[technique]
+
+    def generate(record):
+        formatted_prompt = template.format(input_text="'" + record["Prompt"] + "'")
+        for i in range(num_calls):
+            record[f"Response {i+1}"] = generate_text(
+                formatted_prompt, max_tokens=max_tokens, temperature=temperature, template=template,
+                sample=i  # Each candidate is its own sample, not a cached copy of the first
+            )
+        return record
+
+    return generate
+
+
+def make_rank_stage(ranker="pre", cohere_api_key=None, num_calls=3, embedding_store=None,
+                    cascade_tiers=("embedding", "pre"), cascade_margins=None):
+    """
+    Return a stage function adding "Best Prompt" and "Best Prompt Score" to a record, using the
+    same ranking as rank_pre_generation.py, rank_post_generation.py, rank_manual_metrics.py or rank_cascade.py.
+    `cascade_tiers` and `cascade_margins` are passed to the cascade (see rank_cascade.escalate);
+    the default margins are those of rank_cascade.py.
+    """
+    def candidates(record):
+        return [record[f"Response {i+1}"] for i in range(num_calls)]
+
+    if ranker == "pre":
+        from src.prompt_ranking.rank_pre_generation import rank_prompts_with_cohere
+
+        def rank(record):
+            ranked_prompts = rank_prompts_with_cohere(record["Prompt"], candidates(record))
+            record["Best Prompt"], record["Best Prompt Score"] = max(ranked_prompts, key=lambda ranked: ranked[1])[:2]
+            return record
+    elif ranker == "post":
+        from src.prompt_ranking.rank_post_generation import rank_prompts_post_generation_LLM
+
+        def rank(record):
+            _, best_prompt = rank_prompts_post_generation_LLM(
+                record["Prompt"], candidates(record), record["Human Story"], cohere_api_key
+            )
+            record["Best Prompt"], record["Best Prompt Score"] = best_prompt["prompt"], best_prompt["average_score"]
+            return record
+    elif ranker == "manual":
+        from src.prompt_ranking.rank_manual_metrics import rank_prompts_using_eval_metrics
+
+        def rank(record):
+            ranked_prompts = rank_prompts_using_eval_metrics(record["Prompt"], candidates(record), embedding_store=embedding_store)
+            record["Best Prompt"], record["Best Prompt Score"] = ranked_prompts[0][0], float(ranked_prompts[0][1])
+            return record
+    elif ranker == "cascade":
+        from src.prompt_ranking.rank_cascade import rank_prompts_cascade
+
+        def rank(record):
+            record["Best Prompt"], record["Best Prompt Score"], _, _ = rank_prompts_cascade(
+                record["Prompt"], candidates(record), record["Human Story"], tiers=cascade_tiers,
+                margins=cascade_margins or {"embedding": 0.02, "pre": 0.5}, cohere_api_key=cohere_api_key,
+                embedding_store=embedding_store
+            )
+            return record
+    else:
+        raise ValueError(f"Unknown ranker '{ranker}'.")
+
+    return rank
+
+
+def make_evaluate_stage(cohere_api_key=None):
+    """
+    Return a stage function generating a story from the best prompt and scoring it against the
+    human story, as in the story_evaluation_post_ranking scripts.
+    """
+    from src.utils import calculate_average_scores, generate_story_with_cohere
+
+    def evaluate(record):
+        generated_story = generate_story_with_cohere(record["Best Prompt"], cohere_api_key)
+        scores = calculate_average_scores(record["Prompt"], record["Human Story"], generated_story, cohere_api_key)
+        record["Generated Story"] = generated_story
+        record["Human Story Score"] = scores["average_scores_story_1"]
+        record["Generated Story Score"] = scores["average_scores_story_2"]
+        return record
+
+    return evaluate
+
+
+def throttled(fn, rate_controller):
+    """
+    Wrap a stage function so each upstream call it makes goes through a shared rate controller.
+
+    Calls are throttled and retried one by one, so a rate-limited call does not rerun the
+    stage's earlier calls, and cache hits cost nothing.
+    """
+    def wrapper(record):
+        with throttle_calls(rate_controller):
+            return fn(record)
+    return wrapper
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate, rank and evaluate prompts for every entry in train.json as one streaming pipeline.")
+    parser.add_argument("--input_file", type=str, default=os.path.expanduser("~/AutoPromptGenie/data/train.json"), help="Input JSON object ({prompt: story}) or JSONL file.")
+    parser.add_argument("--output_csv", type=str, required=True, help="Output CSV with the candidates, best prompt and story scores per entry.")
+    parser.add_argument("--technique", choices=["tot", "got"], default="tot", help="Prompting technique used to generate the candidates.")
+    parser.add_argument("--ranker", choices=["pre", "post", "manual", "cascade"], default="pre", help="Ranking used to pick the best candidate.")
+    parser.add_argument("--cascade_tiers", type=str, default="embedding,pre", help="Cascade ranker: comma-separated tiers, cheapest first (see rank_cascade.py).")
+    parser.add_argument("--cascade_margin", type=float, default=0.02, help="Cascade ranker: embedding score margin below which a row is escalated.")
+    parser.add_argument("--cascade_pre_margin", type=float, default=0.5, help="Cascade ranker: pre-generation judge margin (0-5 scale) below which a row is escalated to 'post'.")
+    parser.add_argument("--start", type=int, default=0, help="Number of entries to skip from the beginning of the input.")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of entries to process.")
+    parser.add_argument("--generate_concurrency", type=int, default=4, help="Entries generating candidates at once.")
+    parser.add_argument("--rank_concurrency", type=int, default=4, help="Entries being ranked at once.")
+    parser.add_argument("--evaluate_concurrency", type=int, default=4, help="Entries being evaluated at once.")
+    parser.add_argument("--queue_size", type=int, default=8, help="Entries buffered between two stages before the earlier one waits.")
+    parser.add_argument("--requests_per_minute", type=float, default=None, help="Throttle all stages through one adaptive rate controller starting at this rate.")
+    parser.add_argument("--max_requests_per_minute", type=float, default=600, help="Ceiling for the adapted request rate; set it to your upstream quota.")
+    parser.add_argument("--resume", action="store_true", help="Skip entries already completed in the output's .partial checkpoint file.")
+    parser.add_argument("--overwrite", action="store_true", help="Discard an existing .partial checkpoint file instead of refusing to start.")
+    args = parser.parse_args()
+
+    cohere_api_key = get_api_key()
+    num_calls = 3
+
+    embedding_store = None
+    if args.ranker in ("manual", "cascade"):
+        from src.prompt_ranking.rank_manual_metrics import DEFAULT_EMBEDDING_STORE, open_embedding_store
+        embedding_store = open_embedding_store(DEFAULT_EMBEDDING_STORE)
+
+    stages = [
+        Stage("generate", make_generate_stage(args.technique, num_calls), args.generate_concurrency),
+        Stage(f"rank_{args.ranker}", make_rank_stage(args.ranker, cohere_api_key, num_calls, embedding_store,
+                                                     cascade_tiers=args.cascade_tiers.split(","),
+                                                     cascade_margins={"embedding": args.cascade_margin, "pre": args.cascade_pre_margin}),
+              args.rank_concurrency),
+        Stage("evaluate", make_evaluate_stage(cohere_api_key), args.evaluate_concurrency),
+    ]
+
+    rate_controller = None
+    if args.requests_per_minute is not None:
+        rate_controller = RateController(
+            requests_per_minute=args.requests_per_minute,
+            max_requests_per_minute=args.max_requests_per_minute,
+            max_concurrency=sum(stage.concurrency for stage in stages),
+        )
+        for stage in stages:
+            stage.fn = throttled(stage.fn, rate_controller)
+
+    header = (['Prompt', 'Human Story'] + [f'Response {i+1}' for i in range(num_calls)] +
+              ['Best Prompt', 'Best Prompt Score', 'Generated Story', 'Human Story Score', 'Generated Story Score'])
+    writer = CheckpointWriter(args.output_csv, header, resume=args.resume, overwrite=args.overwrite)
+
+    def pending_records():
+        pairs = iter_prompt_story_pairs(args.input_file, start=args.start, limit=args.limit)
+        for index, (prompt, story) in enumerate(pairs, start=args.start):
+            key = row_key(index, prompt)
+            if not writer.is_done(key):
+                yield {"Key": key, "Prompt": prompt, "Human Story": story}
+
+    def write_record(record):
+        writer.write(record["Key"], [record[column] for column in header])
+        print(f"Completed: {record['Prompt'][:60]}")
+
+    print(f"Starting pipeline: generate ({args.technique}) -> rank ({args.ranker}) -> evaluate...")
+    stats = run_pipeline(pending_records(), stages, write_record, queue_size=args.queue_size)
+    writer.finalize()
+
+    print("\n=== Pipeline Summary ===")
+    print(f"Rows: {stats['rows']} completed, {stats['failed_rows']} failed")
+    print(f"Total Time: {stats['wall_seconds']:.2f} seconds")
+    print(f"Throughput: {stats['rows_per_second']:.3f} rows/second")
+    for name, stage_stats in stats["stages"].items():
+        print(f"  {name}: {stage_stats['processed']} ok, {stage_stats['errors']} failed, "
+              f"{stage_stats['average_latency']:.2f}s/row, utilisation {stage_stats['utilisation']:.0%}")
+    if rate_controller is not None:
+        print(f"Rate controller: {rate_controller.stats()}")
+    if get_cache() is not None:
+        print(f"LLM cache: {get_cache().stats()}")
+    print(f"Results saved to '{args.output_csv}'.")
@@ -1,19 +1,28 @@
+import argparse
+import csv
 import json
 import os
-import pandas as pd
+from src.prompt_generation.data_loader import iter_prompt_story_pairs
 
 
 
 if __name__ == "__main__":
-    input_file = os.path.expanduser("~/AutoPromptGenie/data/train.json")      # Input JSON file
-    output_file = os.path.expanduser("~/AutoPromptGenie/results/generated_promptsCoT.csv")  # Output file for results
-    with open(input_file, "r") as train_file:
-        train_data = json.load(train_file)
-    prompts  = list(train_data.keys())
-    stories = list(train_data.values())
-    df = pd.DataFrame([prompts, stories], columns=['Prompt', 'Human Story'])
-    df['CotPrompt'] = "Please think step by step and generate a story for the following prompt:" + df['Prompt']
-    df.to_csv(output_file, index=False)
+    parser = argparse.ArgumentParser(description="Build Chain-of-Thought prompts for every entry in train.json.")
+    parser.add_argument("--input_file", type=str, default=os.path.expanduser("~/AutoPromptGenie/data/train.json"), help="Input JSON object ({prompt: story}) or JSONL file.")
+    parser.add_argument("--output_file", type=str, default=os.path.expanduser("~/AutoPromptGenie/results/generated_promptsCoT.csv"), help="Output CSV file for the CoT prompts.")
+    parser.add_argument("--start", type=int, default=0, help="Number of entries to skip from the beginning of the input.")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of entries to process.")
+    args = parser.parse_args()
+
+    input_file = args.input_file      # Input JSON file
+    output_file = args.output_file  # Output file for results
+
+    # Stream pairs straight from the input to the output CSV, one row at a time
+    with open(output_file, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(['Prompt', 'Human Story', 'CotPrompt'])
+        for prompt, story in iter_prompt_story_pairs(input_file, start=args.start, limit=args.limit):
+            writer.writerow([prompt, story, "Please think step by step and generate a story for the following prompt:" + prompt])
     print("Prompts saved..")
                                                    
 
@@ -0,0 +1,130 @@
+import itertools
+import json
+import re
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+# Characters that may still follow in a number the decoder has stopped on ("1." or "1e")
+_NUMBER_TAIL = re.compile(r"[0-9.eE+\-]*")
+
+
+def _iter_json_object_items(file, chunk_size=1 << 16):
+    """
+    Yield (key, value) pairs of a top-level JSON object without loading the whole file.
+
+    The file is read in chunks and each key and value is decoded as soon as it is complete,
+    so memory use is bounded by the largest single entry rather than the file size.
+    """
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = file.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def next_char():
+        # Skip whitespace and return the next significant character (without consuming it)
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if eof:
+                return ""
+            fill()
+
+    def decode():
+        # Decode one JSON value, reading more data until it is complete
+        nonlocal position
+        while True:
+            next_char()
+            try:
+                value, end = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            # A number at the end of the buffer may continue in the next chunk, also when the chunk
+            # ends inside its fraction or exponent and the decoder stopped before it
+            if not eof and (end == len(buffer) or (isinstance(value, (int, float)) and not isinstance(value, bool)
+                                                   and _NUMBER_TAIL.match(buffer, end).end() == len(buffer))):
+                fill()
+                continue
+            position = end
+            return value
+
+    if next_char() != "{":
+        raise ValueError("Expected a JSON object at the top level.")
+    position += 1
+    if next_char() == "}":
+        return
+
+    while True:
+        key = decode()
+        if next_char() != ":":
+            raise ValueError(f"Expected ':' after key {key!r}.")
+        position += 1
+        value = decode()
+        yield key, value
+
+        separator = next_char()
+        position += 1
+        if separator == "}":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or '}}' after the value for key {key!r}.")
+
+
+def _iter_jsonl_pairs(file):
+    """
+    Yield (prompt, story) pairs from a JSONL file.
+
+    Each line may be {"prompt": ..., "story": ...}, a [prompt, story] list, or a
+    single-entry {prompt: story} object as in train.json.
+    """
+    for line_number, line in enumerate(file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if isinstance(record, list) and len(record) == 2:
+            yield record[0], record[1]
+        elif isinstance(record, dict) and "prompt" in record and "story" in record:
+            yield record["prompt"], record["story"]
+        elif isinstance(record, dict) and len(record) == 1:
+            yield next(iter(record.items()))
+        else:
+            raise ValueError(f"Unrecognised record on line {line_number}.")
+
+
+def iter_prompt_story_pairs(path, start=0, limit=None, num_shards=1, shard_index=0):
+    """
+    Lazily yield (prompt, story) pairs from a JSON object file or a JSONL file.
+
+    Parameters:
+    - path (str): Path to train.json ({prompt: story, ...}) or a .jsonl file.
+    - start (int): Number of pairs to skip from the beginning of the file.
+    - limit (int): Maximum number of pairs to yield. None yields all remaining pairs.
+    - num_shards (int): Split the file into this many interleaved shards.
+    - shard_index (int): Which shard to yield (0-based), for running several workers in parallel.
+
+    Returns:
+    - iterator: (prompt, story) tuples, read incrementally from disk.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        if path.endswith(".jsonl"):
+            pairs = _iter_jsonl_pairs(file)
+        else:
+            pairs = _iter_json_object_items(file)
+
+        if num_shards > 1:
+            pairs = (pair for i, pair in enumerate(pairs) if i % num_shards == shard_index)
+        stop = None if limit is None else start + limit
+        yield from itertools.islice(pairs, start, stop)
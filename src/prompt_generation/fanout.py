@@ -0,0 +1,89 @@
+import itertools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def _timed_call(call, job):
+    start_time = time.time()
+    try:
+        result = call(job)
+    except Exception as e:
+        return None, None, e
+    return result, time.time() - start_time, None
+
+
+def run_fanout(call, jobs, concurrency=1, on_complete=None):
+    """
+    Run `call(job)` for every job with at most `concurrency` calls in flight.
+
+    Parameters:
+    - call: Function issuing a single API call for one job and returning its result.
+    - jobs: List of jobs to process.
+    - concurrency (int): Maximum number of calls in flight. 1 runs the jobs inline, one after another.
+    - on_complete: Optional callback `on_complete(index, job, result, latency, error)` invoked as each call finishes.
+
+    Returns:
+    - list: One `(result, latency, error)` tuple per job, in the same order as `jobs`.
+      Failed calls have `result=None`, `latency=None` and the raised exception as `error`.
+    """
+    outcomes = [None] * len(jobs)
+
+    def record(index, outcome):
+        outcomes[index] = outcome
+        if on_complete is not None:
+            on_complete(index, jobs[index], *outcome)
+
+    if concurrency <= 1:
+        for index, job in enumerate(jobs):
+            record(index, _timed_call(call, job))
+        return outcomes
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(_timed_call, call, job): index for index, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            record(futures[future], future.result())
+
+    return outcomes
+
+
+def iter_fanout(call, jobs, concurrency=1, window=None):
+    """
+    Lazily run `call(job)` over an iterable of jobs, yielding outcomes in job order.
+
+    Unlike `run_fanout`, jobs are only drawn from `jobs` as room frees up, so a long input
+    keeps `concurrency` calls in flight from start to end without being materialised.
+
+    Parameters:
+    - call: Function issuing a single API call for one job and returning its result.
+    - jobs: Iterable of jobs; read lazily.
+    - concurrency (int): Maximum number of calls in flight. 1 runs the jobs inline, one after another.
+    - window (int): Maximum number of jobs submitted but not yet yielded (default 4 * concurrency).
+      Jobs that finish behind a slow one wait in this window, so it bounds memory and how far
+      the calls can run ahead of the consumer.
+
+    Yields:
+    - tuple: (index, job, result, latency, error) per job, in job order, with the same
+      failure convention as `run_fanout`.
+    """
+    if concurrency <= 1:
+        for index, job in enumerate(jobs):
+            yield (index, job, *_timed_call(call, job))
+        return
+
+    window = max(window or 4 * concurrency, concurrency)
+    indexed = enumerate(jobs)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            while True:
+                for index, job in itertools.islice(indexed, window - len(pending)):
+                    pending.append((index, job, executor.submit(_timed_call, call, job)))
+                if not pending:
+                    return
+                index, job, future = pending.popleft()
+                yield (index, job, *future.result())
+        finally:
+            # A consumer that stops early should not wait for calls whose results it will not read
+            for _, _, future in pending:
+                future.cancel()
@@ -1,125 +1,146 @@
-import pandas as pd
-import cohere
 import json
 import os
 import time
 import re
+import argparse
 
 
-from dotenv import load_dotenv
+from src.llm_client import generate_text
+from src.prompt_generation.fanout import iter_fanout
+from src.prompt_generation.data_loader import iter_prompt_story_pairs
 from src.prompt_generation.prompt_template import GOT_TEMPLATE
 
 got_template = GOT_TEMPLATE
-# Load environment variables from .env file
-load_dotenv()
 
-# Initialize the Cohere client with the API key from env.
-cohere_api_key = os.getenv("COHERE_API_KEY")
-co = cohere.Client(cohere_api_key)
 
-
-def generate_responses_with_metrics(prompts, stories, num_calls=3, max_tokens=1000, temperature=0.7):
+def iter_responses(pairs, num_calls=3, max_tokens=1000, temperature=0.7, concurrency=1, total=None):
     """
-    Process prompts, generate responses, and add metrics along with human-provided stories.
+    Lazily generate `num_calls` responses for each (prompt, story) pair.
+
+    All calls of the input share one bounded window (see `iter_fanout`), so concurrency stays
+    at `concurrency` across the whole input instead of draining at fixed batch boundaries.
 
     Args:
-    - prompts: List of prompts (GoT-generated prompts).
-    - stories: List of human-written stories corresponding to prompts.
+    - pairs: Iterable of (prompt, human story) pairs; read lazily.
     - num_calls: Number of API calls for each prompt.
-    - model: Cohere model to use.
     - max_tokens: Maximum tokens for each response.
     - temperature: Sampling temperature for the API.
+    - concurrency: Maximum number of API calls in flight at once (1 = sequential).
+    - total: Number of pairs, if known, for the progress lines.
 
-    Returns:
-    - metrics_df: DataFrame containing prompts, human stories, responses, and metrics.
-    - throughput: Throughput in API calls per second.
-    - total_time: Total time for all API calls.
+    Yields:
+    - tuple: (prompt, human_story, responses, latencies) per pair, in input order. Failed calls
+      leave NaN as the response (empty in the CSV) and None as the latency.
     """
-    results = []  # Store results
-    latencies = []  # Store latencies for each API call
-    throughput_start = time.time()  # Start time to calculate throughput
-
-    # Total epochs to iterate (defined by number of prompts)
-    total_epochs = len(prompts)
-
-    print("Starting prompt generation...")
-
-    for epoch, (prompt, story) in enumerate(zip(prompts, stories), start=1):
-        print(f"\n[Epoch {epoch}/{total_epochs}] Processing prompt {epoch}...")
-
-        human_story = story  # Corresponding human-written story
-        prompt_responses = []  # Responses for this prompt
-        prompt_latencies = []  # Latencies for this prompt's calls
-
-        for i in range(num_calls):
-            try:
-                start_time = time.time()  # Start timing the API call
-                prompt = got_template.format(input_text="'" + prompt+ "'")
-                #print(prompt)
-
-                # Generate text using Cohere API
-                response = co.generate(
-                    prompt=prompt,
-                    max_tokens=max_tokens,
-                    temperature=temperature
-                )
-
-                end_time = time.time()  # End timing the API call
-                latency = end_time - start_time  # Calculate latency for this call
-                prompt_latencies.append(latency)  # Store latency
-
-                # Store the response
-                response_text = response.generations[0].text.strip()
-                #print(response_text)
-                prompt_responses.append(response_text)
-                print(f"   [Call {i+1}/{num_calls}] Response generated. Latency: {latency:.2f}s")
-
-            except Exception as e:
-                # Handle exceptions and append an error message
-                prompt_responses.append(f"Error during API call {i+1}: {str(e)}")
-                prompt_latencies.append(None)  # No latency for failed calls
-                print(f"   [Call {i+1}/{num_calls}] Error occurred: {e}")
-
-        # Add human story, prompt, responses, and latencies as a row in the results
-        results.append([prompt, human_story] + prompt_responses)
-
-        latencies.append(prompt_latencies)
-
-        # Intermediate progress update after each epoch
-        print(f"\n[Epoch {epoch}/{total_epochs}] Completed. Prompt processed with {len(prompt_responses)} responses.")
-
-    # Calculate throughput
-    throughput_end = time.time()
-    total_time = throughput_end - throughput_start
-    total_calls = len(prompts) * num_calls
-    throughput = total_calls / total_time  # API calls per second
+    def jobs():
+        for epoch, (prompt, human_story) in enumerate(pairs, start=1):
+            for i in range(num_calls):
+                yield epoch, i, prompt, human_story
+
+    def call_api(job):
+        epoch, i, prompt, human_story = job
+        formatted_prompt = got_template.format(input_text="'" + prompt + "'")
+
+        # Generate text using Cohere API (through the shared, traced client)
+        return generate_text(
+            formatted_prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            template=got_template,
+            sample=i  # Each call is its own sample, not a cached copy of the first
+        )
+
+    responses, latencies = [], []
+    for index, (epoch, i, prompt, human_story), response_text, latency, error in iter_fanout(call_api, jobs(), concurrency=concurrency):
+        progress = f"Epoch {epoch}/{total}" if total else f"Epoch {epoch}"
+        if error is None:
+            print(f"   [{progress}, Call {i+1}/{num_calls}] Response generated. Latency: {latency:.2f}s")
+            responses.append(response_text)
+        else:
+            print(f"   [{progress}, Call {i+1}/{num_calls}] Error occurred: {error}")
+            # Left empty (NaN in the CSV) rather than storing the error text as a candidate prompt
+            responses.append(float("nan"))
+        latencies.append(latency)  # None for failed calls
+        if i == num_calls - 1:
+            yield prompt, human_story, responses, latencies
+            responses, latencies = [], []
+
+
+def responses_to_frame(rows, num_calls=3):
+    """
+    Build the output DataFrame (prompt, human story, responses, latencies) from `iter_responses` rows.
+    """
+    import pandas as pd  # Deferred so importing this module (e.g. for --help) stays fast
 
-    # Create a DataFrame
     response_columns = [f'Response {i+1}' for i in range(num_calls)]
     latency_columns = [f'Latency {i+1} (s)' for i in range(num_calls)]
-    df = pd.DataFrame(results, columns=['Prompt', 'Human Story'] + response_columns)
-    latency_df = pd.DataFrame(latencies, columns=latency_columns)
-    metrics_df = pd.concat([df, latency_df], axis=1)
+    df = pd.DataFrame([[prompt, human_story] + responses for prompt, human_story, responses, _ in rows],
+                      columns=['Prompt', 'Human Story'] + response_columns)
+    latency_df = pd.DataFrame([latencies for _, _, _, latencies in rows], columns=latency_columns)
+    return pd.concat([df, latency_df], axis=1)
+
 
-    # Print metrics summary
+def print_summary(total_calls, concurrency, total_time, latencies):
+    """
+    Print the metrics summary for a run and return its throughput in API calls per second.
+    """
+    throughput = total_calls / total_time if total_time > 0 else 0.0  # API calls per second
+    successful = [latency for latency in latencies if latency is not None]
     print("\n=== Metrics Summary ===")
     print(f"Total API Calls: {total_calls}")
+    print(f"Concurrency: {concurrency}")
     print(f"Total Time: {total_time:.2f} seconds")
     print(f"Throughput: {throughput:.2f} API calls/second")
-    print(f"Average Latency per API call: {pd.DataFrame(latencies).mean().mean():.2f} seconds")
+    print(f"Average Latency per API call: {sum(successful) / len(successful) if successful else float('nan'):.2f} seconds")
+    return throughput
+
 
+def generate_responses_with_metrics(prompts, stories, num_calls=3, max_tokens=1000, temperature=0.7, concurrency=1):
+    """
+    Process prompts, generate responses, and add metrics along with human-provided stories.
+
+    Args:
+    - prompts: List of prompts (GoT-generated prompts).
+    - stories: List of human-written stories corresponding to prompts.
+    - num_calls: Number of API calls for each prompt.
+    - max_tokens: Maximum tokens for each response.
+    - temperature: Sampling temperature for the API.
+    - concurrency: Maximum number of API calls in flight at once (1 = sequential).
+
+    Returns:
+    - metrics_df: DataFrame containing prompts, human stories, responses, and metrics.
+    - throughput: Throughput in API calls per second, measured on wall-clock time.
+    - total_time: Total wall-clock time for all API calls.
+    """
+    throughput_start = time.time()  # Start time to calculate throughput
+    print(f"Starting prompt generation with concurrency {concurrency}...")
+
+    rows = list(iter_responses(zip(prompts, stories), num_calls=num_calls, max_tokens=max_tokens,
+                               temperature=temperature, concurrency=concurrency, total=len(prompts)))
+    metrics_df = responses_to_frame(rows, num_calls)
+
+    total_time = time.time() - throughput_start
+    throughput = print_summary(len(prompts) * num_calls, concurrency, total_time,
+                               [latency for _, _, _, latencies in rows for latency in latencies])
     return metrics_df, throughput, total_time
 
 # Main execution
 if __name__ == "__main__":
-    input_file = os.path.expanduser("~/AutoPromptGenie/data/train.json")      # Input JSON file
-    output_file = os.path.expanduser("~/AutoPromptGenie/results/generated_promptsGoT.csv")  # Output file for results
-    with open(input_file, "r") as train_file:
-        train_data = json.load(train_file)
-    prompts  = list(train_data.keys())
-    stories = list(train_data.values()) 
-
-    
+    parser = argparse.ArgumentParser(description="Generate Graph-of-Thought candidate prompts for every entry in train.json.")
+    parser.add_argument("--input_file", type=str, default=os.path.expanduser("~/AutoPromptGenie/data/train.json"), help="Input JSON object ({prompt: story}) or JSONL file.")
+    parser.add_argument("--output_file", type=str, default=os.path.expanduser("~/AutoPromptGenie/results/generated_promptsGoT.csv"), help="Output CSV file for the generated prompts.")
+    parser.add_argument("--start", type=int, default=0, help="Number of entries to skip from the beginning of the input.")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of entries to process.")
+    parser.add_argument("--batch_size", type=int, default=50, help="Number of finished entries appended to the output at a time; API calls keep running across appends.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of API calls in flight at once.")
+    args = parser.parse_args()
+
+    input_file = args.input_file      # Input JSON file
+    output_file = args.output_file  # Output file for results
+
+    # Pairs are read lazily, so the first API calls start before the whole file is parsed
+    pairs = iter_prompt_story_pairs(input_file, start=args.start, limit=args.limit)
+
     # Uncomment if the data is in the format [WP]....
     # count = 0
     # prompt_list = []
@@ -143,15 +164,27 @@ if __name__ == "__main__":
     #         count +=1
     # Wp -> Writing prompts, TT -> Though provoking Themes, Realistic fiction
 
-    metrics_df, throughput, total_time = generate_responses_with_metrics(prompts, stories)
-    metrics_df = metrics_df.iloc[:, 1:]  # Drop the first column by selecting all others
-
-    # Insert the prompts list as the first column
-    metrics_df.insert(0, "Prompt", prompts)
-
-    # Display the updated DataFrame
-    print(metrics_df)
-
-    metrics_df.to_csv(output_file, index=False)
+    # One window of API calls runs over the whole input; finished rows are appended every --batch_size
+    # rows so memory stays flat, and the header is written with the first append only
+    start_time = time.time()
+    print(f"Starting prompt generation with concurrency {args.concurrency}...")
+    total_rows = 0
+    pending_rows = []
+    latencies = []
+
+    def append_rows(rows):
+        responses_to_frame(rows).to_csv(output_file, mode='w' if total_rows == 0 else 'a', header=total_rows == 0, index=False)
+        print(f"Saved {total_rows + len(rows)} rows to {output_file}")
+        return total_rows + len(rows)
+
+    for row in iter_responses(pairs, concurrency=args.concurrency, total=args.limit):
+        pending_rows.append(row)
+        latencies.extend(row[3])
+        if len(pending_rows) >= args.batch_size:
+            total_rows = append_rows(pending_rows)
+            pending_rows = []
+    if pending_rows:
+        total_rows = append_rows(pending_rows)
+
+    print_summary(len(latencies), args.concurrency, time.time() - start_time, latencies)
     print("Prompts saved..")
-
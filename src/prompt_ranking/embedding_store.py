@@ -0,0 +1,193 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from src.tracing import span
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks, so keep to one writing process per store
+    fcntl = None
+
+
+def text_hash(text):
+    """
+    Return a 64-bit content hash of a text, used as its key in the store.
+    """
+    digest = hashlib.blake2b(str(text).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class EmbeddingStore:
+    """
+    Persistent, append-only store of sentence embeddings backed by memory-mapped files.
+
+    Vectors live in `<path>.vectors` (rows x dim, float16 or float32) and their 64-bit text
+    hashes in `<path>.keys`, both read through `np.memmap` so only the rows that are used get
+    paged in. The in-memory index is a sorted array of hashes (16 bytes per entry), which keeps
+    lookups fast and memory bounded for millions of texts.
+
+    Several processes may share a store: appends hold an exclusive lock on `<path>.lock`, and
+    each writer first picks up the rows other processes appended since it last looked.
+    """
+
+    # Number of new entries kept in a dict before they are merged into the sorted index
+    MERGE_THRESHOLD = 65536
+
+    def __init__(self, path, dim, dtype="float16", model_name=None):
+        """
+        Parameters:
+        - path (str): Path prefix of the store files.
+        - dim (int): Embedding dimension.
+        - dtype (str): Storage dtype, "float16" (half the disk and page cache) or "float32".
+        - model_name (str): Name of the encoder, recorded so a store is never mixed across models.
+        """
+        self.path = os.path.expanduser(path)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.model_name = model_name
+        self.vectors_path = self.path + ".vectors"
+        self.keys_path = self.path + ".keys"
+        self.meta_path = self.path + ".json"
+        self.lock_path = self.path + ".lock"
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._check_meta()
+        with self._file_lock():
+            self._open()
+
+    def _check_meta(self):
+        meta = {"dim": self.dim, "dtype": self.dtype.name, "model": self.model_name}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as file:
+                existing = json.load(file)
+            if existing != meta:
+                raise ValueError(f"Embedding store '{self.path}' was built with {existing}, not {meta}.")
+        else:
+            with open(self.meta_path, "w") as file:
+                json.dump(meta, file)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        # Held while the files are truncated or appended to, so writers in other processes never interleave
+        with open(self.lock_path, "a") as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    def _rows_on_disk(self):
+        row_bytes = self.dim * self.dtype.itemsize
+        vector_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        key_rows = os.path.getsize(self.keys_path) // 8 if os.path.exists(self.keys_path) else 0
+        return min(vector_rows, key_rows)
+
+    def _open(self):
+        row_bytes = self.dim * self.dtype.itemsize
+        self.count = self._rows_on_disk()
+
+        # Drop anything past the last complete entry, e.g. after a crash between the two appends
+        for file_path, size in ((self.vectors_path, self.count * row_bytes), (self.keys_path, self.count * 8)):
+            with open(file_path, "ab") as file:
+                file.truncate(size)
+
+        keys = np.fromfile(self.keys_path, dtype=np.uint64, count=self.count)
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+        self.recent = {}
+        self.vectors = None
+        self.mapped_rows = 0
+
+    def _map_vectors(self):
+        if self.mapped_rows != self.count:
+            self.vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(self.count, self.dim)) if self.count else None
+            self.mapped_rows = self.count
+
+    def _lookup(self, hashes):
+        rows = np.full(len(hashes), -1, dtype=np.int64)
+        if len(self.sorted_keys):
+            positions = np.minimum(np.searchsorted(self.sorted_keys, hashes), len(self.sorted_keys) - 1)
+            found = self.sorted_keys[positions] == hashes
+            rows[found] = self.order[positions[found]]
+        for i in np.nonzero(rows < 0)[0]:
+            rows[i] = self.recent.get(int(hashes[i]), -1)
+        return rows
+
+    def _sync(self):
+        # Index the rows other processes appended since this store last read the files (file lock held)
+        rows = self._rows_on_disk()
+        if rows > self.count:
+            keys = np.fromfile(self.keys_path, dtype=np.uint64, count=rows - self.count, offset=self.count * 8)
+            for offset, h in enumerate(keys):
+                self.recent.setdefault(int(h), self.count + offset)
+            self.count = rows
+
+    def _append(self, hashes, embeddings):
+        with open(self.vectors_path, "ab") as file:
+            np.ascontiguousarray(embeddings, dtype=self.dtype).tofile(file)
+        with open(self.keys_path, "ab") as file:
+            np.asarray(hashes, dtype=np.uint64).tofile(file)
+        for offset, h in enumerate(hashes):
+            self.recent[int(h)] = self.count + offset
+        self.count += len(hashes)
+
+        if len(self.recent) >= self.MERGE_THRESHOLD:
+            keys = np.fromfile(self.keys_path, dtype=np.uint64, count=self.count)
+            self.order = np.argsort(keys, kind="stable")
+            self.sorted_keys = keys[self.order]
+            self.recent = {}
+
+    def get_embeddings(self, texts, encode):
+        """
+        Return embeddings for `texts`, encoding and storing only the ones not seen before.
+
+        Parameters:
+        - texts (list): Texts to embed.
+        - encode: Function mapping a list of texts to a (len(texts), dim) array, e.g. `model.encode`.
+
+        Returns:
+        - np.ndarray: float32 array of shape (len(texts), dim), in the order of `texts`.
+        """
+        texts = [str(text) for text in texts]
+        hashes = np.array([text_hash(text) for text in texts], dtype=np.uint64)
+
+        with self.lock, span("embedding.store", texts=len(texts)) as current:
+            rows = self._lookup(hashes)
+            missing = np.nonzero(rows < 0)[0]
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            current.set(cache_hits=len(texts) - len(missing), cache_misses=len(missing))
+
+            if len(missing):
+                # Encode each distinct missing text once, even if it repeats within the batch
+                unique_hashes, first = np.unique(hashes[missing], return_index=True)
+                new_texts = [texts[missing[i]] for i in first]
+                new_embeddings = np.asarray(encode(new_texts), dtype=np.float32).reshape(len(new_texts), self.dim)
+                with self._file_lock():
+                    self._sync()
+                    # Another process may have stored some of these texts while they were encoded
+                    new = self._lookup(unique_hashes) < 0
+                    self._append(unique_hashes[new], new_embeddings[new])
+                rows = self._lookup(hashes)
+
+            self._map_vectors()
+            return np.asarray(self.vectors[rows], dtype=np.float32)
+
+    def stats(self):
+        """
+        Return hit/miss counters and the number of stored embeddings.
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": self.count}
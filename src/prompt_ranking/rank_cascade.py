@@ -0,0 +1,185 @@
+import argparse
+import os
+import time
+from collections import Counter
+
+import numpy as np
+
+from src.checkpoint import CheckpointWriter, row_key
+from src.llm_cache import get_cache
+from src.llm_client import get_api_key
+from src.prompt_ranking.rank_manual_metrics import (
+    DEFAULT_EMBEDDING_STORE,
+    open_embedding_store,
+    rank_prompts_bulk,
+    rank_prompts_using_eval_metrics,
+)
+
+# Ranking tiers, cheapest first: embedding similarity, the pre-generation LLM judge, and story-based judging
+TIERS = ["embedding", "pre", "post"]
+
+
+def escalate(starting_prompt, human_story, embedding_ranked, tiers=("embedding", "pre"), margins=None, cohere_api_key=None):
+    """
+    Settle a row's ranking, calling the LLM judges only if the cheaper tiers leave it a close call.
+
+    After each tier, the candidates whose score is within that tier's margin of the top score
+    stay in contention. If only one remains the row is decided; otherwise those candidates go
+    to the next tier. The last tier in `tiers` always decides.
+
+    Parameters:
+    - starting_prompt (str): The original prompt.
+    - human_story (str): The reference human story, needed by the "post" tier.
+    - embedding_ranked (list): The row's embedding ranking, as returned by `rank_prompts_using_eval_metrics`.
+    - tiers (list): Tiers to use, in order; must start with "embedding".
+    - margins (dict): Score margin per tier below which a row is escalated (0 never escalates).
+    - cohere_api_key (str): Your Cohere API key.
+
+    Returns:
+    - tuple: (best_prompt, best_score, decided_by, embedding_margin). The score is on the deciding tier's scale.
+    """
+    margins = margins or {}
+    scored = [(prompt, float(score)) for prompt, score, *_ in embedding_ranked]
+    embedding_margin = scored[0][1] - scored[1][1] if len(scored) > 1 else float("inf")
+    decided_by = "embedding"
+
+    for previous, tier in zip(tiers, tiers[1:]):
+        top_score = scored[0][1]
+        contenders = [prompt for prompt, score in scored if top_score - score < margins.get(previous, 0.0)]
+        if len(contenders) < 2:
+            break
+        if tier == "pre":
+            from src.prompt_ranking.rank_pre_generation import rank_prompts_with_cohere
+            scored = [(prompt, float(score)) for prompt, score, *_ in rank_prompts_with_cohere(starting_prompt, contenders)]
+        elif tier == "post":
+            from src.prompt_ranking.rank_post_generation import rank_prompts_post_generation_LLM
+            ranked, _ = rank_prompts_post_generation_LLM(starting_prompt, contenders, human_story, cohere_api_key)
+            scored = [(entry["prompt"], float(entry["average_score"])) for entry in ranked]
+        else:
+            raise ValueError(f"Unknown tier '{tier}'. Expected one of {TIERS}.")
+        decided_by = tier
+
+    return scored[0][0], scored[0][1], decided_by, embedding_margin
+
+
+def rank_prompts_cascade(starting_prompt, generated_prompts, human_story=None, tiers=("embedding", "pre"), margins=None,
+                         cohere_api_key=None, embedding_store=None):
+    """
+    Rank one row with the cascade: embedding scores first, LLM judges only for close calls.
+
+    Takes the same `tiers` and `margins` as `escalate`, and returns the same tuple.
+    """
+    embedding_ranked = rank_prompts_using_eval_metrics(starting_prompt, generated_prompts, embedding_store=embedding_store)
+    return escalate(starting_prompt, human_story, embedding_ranked, tiers, margins, cohere_api_key)
+
+
+def process_and_rank_prompts(input_csv, output_csv, cohere_api_key=None, tiers=("embedding", "pre"), margin=0.02,
+                             pre_margin=0.5, escalation_rate=None, embedding_store=None, chunk_size=1024, resume=False,
+                             overwrite=False):
+    """
+    Rank every row of a generated-prompts CSV with the cascade and save the best prompt per row.
+
+    All rows are scored by the embedding tier in bulk first; rows are then escalated one by one.
+
+    Parameters:
+    - input_csv (str): CSV with Prompt, Human Story and Response 1-3 columns.
+    - output_csv (str): Output CSV, usable as input to the story_evaluation_post_ranking scripts.
+    - cohere_api_key (str): Your Cohere API key.
+    - tiers (list): Tiers to use, in order; must start with "embedding".
+    - margin (float): Embedding score margin below which a row is escalated.
+    - pre_margin (float): Pre-generation judge score margin (0-5 scale) below which a row goes on to "post".
+    - escalation_rate (float): If set, overrides `margin` so this fraction of the rows is escalated.
+    - embedding_store: Optional EmbeddingStore consulted before encoding.
+    - chunk_size (int): Rows embedded at a time.
+    - resume (bool): Skip input rows already completed by an interrupted run.
+    - overwrite (bool): Discard an interrupted run's partial file instead of refusing to start.
+    """
+    import pandas as pd  # Deferred so importing this module (e.g. for --help) stays fast
+
+    if tiers[0] != "embedding":
+        raise ValueError("The cascade must start with the embedding tier.")
+
+    df = pd.read_csv(input_csv)
+    header = ['Starting Prompt', 'Human Story', 'Best Prompt', 'Best Prompt Score', 'Decided By',
+              'Embedding Margin', 'Latency']
+    writer = CheckpointWriter(output_csv, header, resume=resume, overwrite=overwrite)
+
+    # Tier 1 for every pending row, so a target escalation rate can be turned into a margin
+    pending = []
+    for index, row in df.iterrows():
+        generated_prompts = [row['Response 1'], row['Response 2'], row['Response 3']]
+        key = row_key(index, row['Prompt'], *generated_prompts)
+        if writer.is_done(key):
+            continue
+        if any(pd.isna(candidate) for candidate in generated_prompts):
+            print(f"Skipping row {index}: a candidate prompt is missing (its generation failed)")
+            continue
+        pending.append((index, key, row['Prompt'], row['Human Story'], generated_prompts))
+
+    embedding_ranked = []
+    embedding_latencies = []
+    for chunk_start in range(0, len(pending), chunk_size):
+        chunk = pending[chunk_start:chunk_start + chunk_size]
+        start_time = time.time()
+        embedding_ranked.extend(rank_prompts_bulk([entry[2] for entry in chunk], [entry[4] for entry in chunk],
+                                                  embedding_store=embedding_store))
+        embedding_latencies.extend([(time.time() - start_time) / len(chunk)] * len(chunk))
+
+    if escalation_rate is not None and embedding_ranked:
+        row_margins = [ranked[0][1] - ranked[1][1] for ranked in embedding_ranked]
+        margin = float(np.quantile(row_margins, escalation_rate)) if escalation_rate > 0 else 0.0
+        print(f"Embedding margin for a {escalation_rate:.0%} escalation rate: {margin:.4f}")
+    margins = {"embedding": margin, "pre": pre_margin}
+
+    decided = Counter()
+    for (index, key, starting_prompt, human_story, _), ranked, embedding_latency in zip(pending, embedding_ranked, embedding_latencies):
+        start_time = time.time()
+        try:
+            best_prompt, best_score, decided_by, embedding_margin = escalate(
+                starting_prompt, human_story, ranked, tiers, margins, cohere_api_key
+            )
+        except Exception as e:
+            print(f"Error processing row {index}: {e}")
+            continue
+        latency = embedding_latency + time.time() - start_time
+        decided[decided_by] += 1
+        writer.write(key, [starting_prompt, human_story, best_prompt, best_score, decided_by, embedding_margin, latency])
+
+    writer.finalize()
+
+    total = sum(decided.values())
+    print("\n=== Cascade Summary ===")
+    print(f"Rows: {total}")
+    for tier in tiers:
+        print(f"Decided by {tier}: {decided[tier]} ({decided[tier] / total:.1%})" if total else f"Decided by {tier}: 0")
+    if embedding_store is not None:
+        print(f"Embedding store: {embedding_store.stats()}")
+    if get_cache() is not None:
+        print(f"LLM cache: {get_cache().stats()}")
+    print(f"Results saved to {output_csv}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank prompts with embedding scores, asking the LLM judges only about close calls.")
+    parser.add_argument("--input_csv", type=str, required=True, help="Path to the input CSV file containing prompts.")
+    parser.add_argument("--output_csv", type=str, required=True, help="Path to the output CSV file to save results.")
+    parser.add_argument("--tiers", type=str, default="embedding,pre", help=f"Comma-separated tiers, cheapest first, from: {', '.join(TIERS)}.")
+    parser.add_argument("--margin", type=float, default=0.02, help="Embedding score margin between the top candidates below which a row is escalated.")
+    parser.add_argument("--pre_margin", type=float, default=0.5, help="Pre-generation judge margin (0-5 scale) below which a row is escalated to 'post'.")
+    parser.add_argument("--escalation_rate", type=float, default=None, help="Escalate this fraction of the rows instead of using --margin.")
+    parser.add_argument("--embedding_store", type=str, default=DEFAULT_EMBEDDING_STORE, help="Path prefix of the persistent embedding store.")
+    parser.add_argument("--no_embedding_store", action="store_true", help="Re-encode every text instead of using the persistent embedding store.")
+    parser.add_argument("--chunk_size", type=int, default=1024, help="Rows embedded at a time.")
+    parser.add_argument("--resume", action="store_true", help="Skip input rows already completed in the output's .partial checkpoint file.")
+    parser.add_argument("--overwrite", action="store_true", help="Discard an existing .partial checkpoint file instead of refusing to start.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input_csv):
+        print(f"Error: Input file '{args.input_csv}' does not exist.")
+        exit(1)
+
+    embedding_store = None if args.no_embedding_store else open_embedding_store(args.embedding_store)
+    process_and_rank_prompts(args.input_csv, args.output_csv, get_api_key(), tiers=args.tiers.split(","),
+                             margin=args.margin, pre_margin=args.pre_margin, escalation_rate=args.escalation_rate,
+                             embedding_store=embedding_store, chunk_size=args.chunk_size, resume=args.resume,
+                             overwrite=args.overwrite)
@@ -1,15 +1,62 @@
 import numpy as np
-from sentence_transformers import util
-from sentence_transformers import SentenceTransformer, util
-import pandas as pd
+import threading
 import time
 import csv
 import argparse
 import os
+from src.checkpoint import CheckpointWriter, row_key
+from src.prompt_ranking.embedding_store import EmbeddingStore
+from src.tracing import span
 
-model = SentenceTransformer('all-MiniLM-L6-v2')  # Lightweight and fast sentence embedding technique
+MODEL_NAME = 'all-MiniLM-L6-v2'  # Lightweight and fast sentence embedding technique
 
-def rank_prompts_using_eval_metrics(starting_prompt, generated_prompts, alpha=0.8, beta=0.2):
+_model = None
+_model_lock = threading.Lock()
+
+DEFAULT_EMBEDDING_STORE = os.path.expanduser(f"~/.cache/autopromptgenie/embeddings/{MODEL_NAME}")
+
+
+def get_embedding_model():
+    """
+    Return the sentence embedding model, loading it on first use.
+
+    sentence_transformers (and torch) are imported here rather than at module import,
+    so importing this module for --help, a test or a worker fork stays fast.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(MODEL_NAME)
+    return _model
+
+
+def encode_with_model(model, texts, **kwargs):
+    """
+    Run `model.encode` on a list of texts inside a tracing span.
+    """
+    with span("embedding.encode", model=MODEL_NAME, texts=len(texts), chars=sum(len(str(text)) for text in texts)):
+        return model.encode(texts, **kwargs)
+
+
+def open_embedding_store(path=DEFAULT_EMBEDDING_STORE, dtype="float16"):
+    """
+    Open (or create) the persistent embedding store for the ranking model.
+    """
+    return EmbeddingStore(path, dim=get_embedding_model().get_sentence_embedding_dimension(), dtype=dtype, model_name=MODEL_NAME)
+
+
+def encode_texts(texts, embedding_store=None):
+    """
+    Embed a list of texts, consulting the persistent store first when one is given.
+    """
+    model = get_embedding_model()
+    if embedding_store is None:
+        return encode_with_model(model, texts, convert_to_tensor=True)
+    return embedding_store.get_embeddings(texts, lambda missing: encode_with_model(model, missing))
+
+def rank_prompts_using_eval_metrics(starting_prompt, generated_prompts, alpha=0.8, beta=0.2, embedding_store=None):
     """
     Rank generated prompts based on relevance and diversity scores.
 
@@ -18,6 +65,7 @@ def rank_prompts_using_eval_metrics(starting_prompt, generated_prompts, alpha=0.
     - generated_prompts: List of generated prompts to evaluate.
     - alpha: Weight for relevance score (default=0.8).
     - beta: Weight for diversity score (default=0.2).
+    - embedding_store: Optional EmbeddingStore; texts embedded on a previous run are not re-encoded.
 
     Returns:
     - ranked_prompts: List of tuples (prompt, score) sorted by the final score.
@@ -26,9 +74,11 @@ def rank_prompts_using_eval_metrics(starting_prompt, generated_prompts, alpha=0.
     if not starting_prompt or not generated_prompts:
         raise ValueError("Starting prompt or generated prompts are empty.")
 
+    from sentence_transformers import util
+
     # Encode starting prompt and generated prompts
-    starting_embedding = model.encode(starting_prompt, convert_to_tensor=True)
-    generated_embeddings = model.encode(generated_prompts, convert_to_tensor=True)
+    starting_embedding = encode_texts([starting_prompt], embedding_store)[0]
+    generated_embeddings = encode_texts(generated_prompts, embedding_store)
 
     # Compute relevance scores (cosine similarity with the starting prompt)
     relevance_scores = util.cos_sim(starting_embedding, generated_embeddings)[0].cpu().numpy()
@@ -50,58 +100,152 @@ def rank_prompts_using_eval_metrics(starting_prompt, generated_prompts, alpha=0.
 
     return ranked_prompts
 
-def process_and_rank_prompts(input_csv, output_csv, model):
+def rank_prompts_bulk(starting_prompts, generated_prompts_rows, alpha=0.8, beta=0.2, embedding_store=None, batch_size=256):
+    """
+    Rank the generated prompts of many rows at once.
+
+    All starting prompts and candidates are encoded in large batches, then relevance, pairwise
+    diversity and final scores are computed as (rows x candidates) array operations. Scores match
+    `rank_prompts_using_eval_metrics` row by row.
+
+    Parameters:
+    - starting_prompts: List of starting prompts, one per row.
+    - generated_prompts_rows: List of candidate lists, one per row; every row has the same number of candidates.
+    - alpha: Weight for relevance score (default=0.8).
+    - beta: Weight for diversity score (default=0.2).
+    - embedding_store: Optional EmbeddingStore consulted before encoding.
+    - batch_size: Encoder batch size.
+
+    Returns:
+    - list: For each row, a list of tuples (prompt, final_score, relevance_score, diversity_score) sorted by final score.
+    """
+    num_rows = len(starting_prompts)
+    num_candidates = len(generated_prompts_rows[0])
+    flat_prompts = [prompt for row in generated_prompts_rows for prompt in row]
+
+    model = get_embedding_model()
+
+    def encode(texts):
+        if embedding_store is None:
+            return np.asarray(encode_with_model(model, texts, batch_size=batch_size), dtype=np.float32)
+        return embedding_store.get_embeddings(texts, lambda missing: encode_with_model(model, missing, batch_size=batch_size))
+
+    starting_embeddings = encode(list(starting_prompts))
+    generated_embeddings = encode(flat_prompts).reshape(num_rows, num_candidates, -1)
+
+    # Normalise once so every cosine similarity is a plain dot product
+    starting_embeddings /= np.maximum(np.linalg.norm(starting_embeddings, axis=-1, keepdims=True), 1e-8)
+    generated_embeddings /= np.maximum(np.linalg.norm(generated_embeddings, axis=-1, keepdims=True), 1e-8)
+
+    relevance_scores = np.einsum('rd,rcd->rc', starting_embeddings, generated_embeddings)
+    pairwise_similarities = np.einsum('rcd,rkd->rck', generated_embeddings, generated_embeddings)
+    diversity_scores = 1 - pairwise_similarities.mean(axis=2)
+    final_scores = alpha * relevance_scores + beta * diversity_scores
+
+    ranked_indices = np.argsort(-final_scores, axis=1, kind='stable')  # Sort each row in descending order
+    return [
+        [(generated_prompts_rows[r][i], final_scores[r, i], relevance_scores[r, i], diversity_scores[r, i]) for i in ranked_indices[r]]
+        for r in range(num_rows)
+    ]
+
+def build_output_row(starting_prompt, human_story, ranked_prompts, latency):
+    """
+    Flatten a row's ranked prompts into the output CSV layout.
+    """
+    row_data = [starting_prompt]
+    row_data.append(human_story)
+    
+    best_prompt = None
+    best_score = float('-inf')
+
+    # Add each prompt's score and the latency
+    for prompt, final_score, relevance, diversity in ranked_prompts:
+        row_data.append(prompt)
+        row_data.append(relevance)
+        row_data.append(diversity)
+        row_data.append(final_score)
+        
+        if final_score > best_score:
+            best_score = final_score
+            best_prompt = prompt
+
+    row_data.append(best_prompt)
+    row_data.append(best_score)
+
+    row_data.append(latency)
+    return row_data
+
+def process_and_rank_prompts(input_csv, output_csv, model=None, resume=False, embedding_store=None, bulk=False, chunk_size=1024,
+                             overwrite=False):
     """
     Read starting prompt and generated prompts (prompt1, prompt2, prompt3) from a CSV,
     calculate relevance, diversity scores, and latency, and store the results in an output CSV.
+    With `resume`, input rows already completed by an interrupted run are skipped; with
+    `overwrite`, that run's partial file is discarded instead.
+    With an `embedding_store`, only texts missing from the store are sent to the encoder.
+    `model` is accepted for backwards compatibility; the shared model from `get_embedding_model` is used.
+    With `bulk`, rows are ranked `chunk_size` at a time by `rank_prompts_bulk`; the latency
+    column then holds each row's share of its chunk's time.
     """
-    df = pd.read_csv(input_csv)
+    import pandas as pd  # Deferred so importing this module (e.g. for --help) stays fast
 
-    output_data = []
+    df = pd.read_csv(input_csv)
 
-    # Iterate through each row in the CSV
-    for index, row in df.iterrows():
-        starting_prompt = row['Prompt']
-        human_story = row['Human Story']
-        generated_prompts = [row['Response 1'], row['Response 2'], row['Response 3']]  # Get prompts from columns prompt1, prompt2, prompt3
+    header = ['Starting Prompt', 'Human Story', 'Prompt 1', 'Relevance Score 1', 'Diversity Score 1', 'Final Score 1', 
+              'Prompt 2', 'Relevance Score 2', 'Diversity Score 2', 'Final Score 2', 
+              'Prompt 3', 'Relevance Score 3', 'Diversity Score 3', 'Final Score 3', 
+              'Best Prompt', 'Best Prompt Score', 'Latency']
 
-        start_time = time.time()
-        ranked_prompts = rank_prompts_using_eval_metrics(starting_prompt, generated_prompts)
-        latency = time.time() - start_time
+    # Rows are appended to a partial file as they complete, so a crash loses at most the row in flight
+    writer = CheckpointWriter(output_csv, header, resume=resume, overwrite=overwrite)
 
-        row_data = [starting_prompt]
-        row_data.append(human_story)
-        
-        best_prompt = None
-        best_score = float('-inf')
+    if bulk:
+        for chunk_start in range(0, len(df), chunk_size):
+            chunk = df.iloc[chunk_start:chunk_start + chunk_size]
+            starting_prompts = chunk['Prompt'].tolist()
+            human_stories = chunk['Human Story'].tolist()
+            generated_prompts_rows = chunk[['Response 1', 'Response 2', 'Response 3']].values.tolist()
+            keys = [row_key(index, starting_prompt, *generated_prompts)
+                    for index, starting_prompt, generated_prompts in zip(chunk.index, starting_prompts, generated_prompts_rows)]
+            pending = [i for i, key in enumerate(keys)
+                       if not writer.is_done(key) and not any(pd.isna(candidate) for candidate in generated_prompts_rows[i])]
+            if not pending:
+                continue
 
-        # Add each prompt's score and the latency
-        for prompt, relevance, diversity, final_score in ranked_prompts:
-            row_data.append(prompt)
-            row_data.append(relevance)
-            row_data.append(diversity)
-            row_data.append(final_score)
-            
-            if final_score > best_score:
-                best_score = final_score
-                best_prompt = prompt
+            start_time = time.time()
+            ranked_rows = rank_prompts_bulk(
+                [starting_prompts[i] for i in pending],
+                [generated_prompts_rows[i] for i in pending],
+                embedding_store=embedding_store
+            )
+            latency = (time.time() - start_time) / len(pending)
 
-        row_data.append(best_prompt)
-        row_data.append(best_score)
+            for i, ranked_prompts in zip(pending, ranked_rows):
+                writer.write(keys[i], build_output_row(starting_prompts[i], human_stories[i], ranked_prompts, latency))
+            print(f"Ranked rows {chunk_start}-{chunk_start + len(chunk) - 1}")
+    else:
+        # Iterate through each row in the CSV
+        for index, row in df.iterrows():
+            starting_prompt = row['Prompt']
+            human_story = row['Human Story']
+            generated_prompts = [row['Response 1'], row['Response 2'], row['Response 3']]  # Get prompts from columns prompt1, prompt2, prompt3
+            key = row_key(index, starting_prompt, *generated_prompts)
+            if writer.is_done(key):
+                continue
+            if any(pd.isna(candidate) for candidate in generated_prompts):
+                print(f"Skipping row {index}: a candidate prompt is missing (its generation failed)")
+                continue
 
-        row_data.append(latency)
+            start_time = time.time()
+            ranked_prompts = rank_prompts_using_eval_metrics(starting_prompt, generated_prompts, embedding_store=embedding_store)
+            latency = time.time() - start_time
 
-        output_data.append(row_data)
+            writer.write(key, build_output_row(starting_prompt, human_story, ranked_prompts, latency))
 
-    with open(output_csv, mode='w', newline='') as file:
-        writer = csv.writer(file)
+    writer.finalize()
 
-        header = ['Starting Prompt', 'Human Story', 'Prompt 1', 'Relevance Score 1', 'Diversity Score 1', 'Final Score 1', 
-                  'Prompt 2', 'Relevance Score 2', 'Diversity Score 2', 'Final Score 2', 
-                  'Prompt 3', 'Relevance Score 3', 'Diversity Score 3', 'Final Score 3', 
-                  'Best Prompt', 'Best Prompt Score', 'Latency']
-        writer.writerow(header)
-        writer.writerows(output_data)
+    if embedding_store is not None:
+        print(f"Embedding store: {embedding_store.stats()}")
 
     print(f"Results saved to {output_csv}")
 
@@ -110,6 +254,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Rank prompts using manual metrics like relevance.")
     parser.add_argument("--input_csv", type=str, required=True, help="Path to the input CSV file containing prompts.")
     parser.add_argument("--output_csv", type=str, required=True, help="Path to the output CSV file to save results.")
+    parser.add_argument("--embedding_store", type=str, default=DEFAULT_EMBEDDING_STORE, help="Path prefix of the persistent embedding store.")
+    parser.add_argument("--embedding_dtype", type=str, default="float16", choices=["float16", "float32"], help="Storage dtype for new embedding stores.")
+    parser.add_argument("--no_embedding_store", action="store_true", help="Re-encode every text instead of using the persistent embedding store.")
+    parser.add_argument("--bulk", action="store_true", help="Encode and score whole chunks of rows at once instead of row by row.")
+    parser.add_argument("--chunk_size", type=int, default=1024, help="Number of rows per chunk in bulk mode.")
+    parser.add_argument("--resume", action="store_true", help="Skip input rows already completed in the output's .partial checkpoint file.")
+    parser.add_argument("--overwrite", action="store_true", help="Discard an existing .partial checkpoint file instead of refusing to start.")
 
     args = parser.parse_args()
 
@@ -123,7 +274,9 @@ if __name__ == "__main__":
 
     try:
         print("Starting the prompt ranking process...")
-        process_and_rank_prompts(input_csv, output_csv, model)
+        embedding_store = None if args.no_embedding_store else open_embedding_store(args.embedding_store, args.embedding_dtype)
+        process_and_rank_prompts(input_csv, output_csv, resume=args.resume, embedding_store=embedding_store,
+                                 bulk=args.bulk, chunk_size=args.chunk_size, overwrite=args.overwrite)
         print(f"Processing completed. Results saved to '{output_csv}'.")
     except Exception as e:
         print(f"An error occurred during processing: {e}")
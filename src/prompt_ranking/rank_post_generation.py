@@ -1,39 +1,20 @@
 import argparse
 import os
 import numpy as np
-import cohere
 from typing import List, Tuple, Dict
-import pandas as pd
 from src.utils import generate_story_with_cohere, calculate_average_scores
+from src.judge_protocol import STORY_SCHEMA, judge, stats as judge_stats
+from src.llm_client import generate_text, get_api_key
+from src.llm_cache import get_cache
+from src.checkpoint import CheckpointWriter, row_key
 import time
 import csv
 
-from dotenv import load_dotenv
-# Load environment variables from .env file
-load_dotenv()
-
-# Initialize the Cohere client with the API key from env.
-cohere_api_key = os.getenv("COHERE_API_KEY")
-
-def evaluate_with_cohere_story_from_prompt(prompt: str, story: str, template_story: str, cohere_api_key: str) -> Dict[str, int]:
-    """
-    Evaluate a submission based on predefined metrics using Cohere's API.
-    
-    Parameters:
-    - prompt (str): The prompt given for the story.
-    - story (str): The story submission to evaluate.
-    - cohere_api_key (str): Your Cohere API key.
-    
-    Returns:
-    - dict: A dictionary containing evaluation scores for each metric.
-    """
-    co = cohere.Client(cohere_api_key)
-    
-    # Define the evaluation template
-    template = """
+# Comparative story judge: 1 per metric if the submission beats the template story, else 0
+COMPARISON_JUDGE_TEMPLATE = """
     You are an evaluator. I will provide you with a prompt , a template story and a submission. 
     I will also provide a question for each of those metrics, and you will return 1 if the submission is better than the template story, 
-    0 if template story is better than submission, as a score for that metric. Just answer with the name of the metric and the score, nothing else.
+    0 if template story is better than submission, as a score for that metric. {instruction}
     
     Prompt: 
     {prompt}
@@ -45,36 +26,28 @@ def evaluate_with_cohere_story_from_prompt(prompt: str, story: str, template_sto
     {story}
     
     Metrics:
-    Helpfulness: Does the story contribute to the plot, character development, or themes?
-    Directness: Does the story stay focused and move the plot forward?
-    Grammaticality: Is the story grammatically correct and easy to read?
-    Relevance: Does the story stay on-topic and relevant to its theme or prompt?
-    Edge: Does the story include unique or surprising elements?
-    Supposition: Does the story explore hypothetical situations or provoke analysis?
-    Creativity: How original and imaginative is the story?
-    Coherence: Is the language in the story coherent for the reader?
+{metrics}
     """
+
+def evaluate_with_cohere_story_from_prompt(prompt: str, story: str, template_story: str, cohere_api_key: str) -> Dict[str, int]:
+    """
+    Evaluate a submission based on predefined metrics using Cohere's API.
     
-    # Format the template with the actual prompt and stories
-    formatted_prompt = template.format(prompt=prompt, story=story, template_story=template_story)
-    
-    # Generate the evaluation using Cohere
-    response = co.generate(
-        prompt=formatted_prompt,
-        max_tokens=500,  # Enough tokens to evaluate all metrics
-        temperature=0.01
-    )
-    
-    # The response will contain the evaluation output
-    evaluation = response.generations[0].text.strip()
-    
-    # Parse the response into a dictionary (assuming it's in a structured format)
-    scores = {}
-    for line in evaluation.split('\n'):
-        metric, score = line.split(": ")
-        scores[metric] = int(score)
+    Parameters:
+    - prompt (str): The prompt given for the story.
+    - story (str): The story submission to evaluate.
+    - cohere_api_key (str): Your Cohere API key.
     
-    return scores
+    Returns:
+    - dict: A dictionary containing evaluation scores for each metric; NaN for a metric the
+      judge did not score even when asked again.
+    """
+    # Format the template with the actual prompt and stories, and parse the JSON judgement
+    # (cached, as the judge is effectively deterministic)
+    return judge(COMPARISON_JUDGE_TEMPLATE, {"prompt": prompt, "story": story, "template_story": template_story},
+                 STORY_SCHEMA,
+                 max_tokens=500,  # Enough tokens to evaluate all metrics
+                 api_key=cohere_api_key)
 
 def rank_prompts_post_generation_LLM(input_prompt: str, candidate_prompts: List[str], human_story: str, api_key: str) -> Tuple[List[Dict], Dict]:
     """
@@ -92,9 +65,9 @@ def rank_prompts_post_generation_LLM(input_prompt: str, candidate_prompts: List[
     prompt_ranking = []
     
     for prompt in candidate_prompts:
-        story = generate_story_with_cohere(prompt, cohere_api_key)
+        story = generate_story_with_cohere(prompt, api_key)
         scores_generated = evaluate_with_cohere_story_from_prompt(input_prompt, story, human_story, api_key)
-        avg_score_generated = np.mean(np.array(list(scores_generated.values())))
+        avg_score_generated = np.nanmean(np.array(list(scores_generated.values())))
         
         # Add the prompt, individual scores, and average score to the ranking list
         prompt_ranking.append({
@@ -111,7 +84,141 @@ def rank_prompts_post_generation_LLM(input_prompt: str, candidate_prompts: List[
 
     return ranked_prompts, best_prompt
 
-def process_and_rank_prompts(input_csv: str, output_csv: str, cohere_api_key: str):
+def generate_story_preview(input_prompt: str, cohere_api_key: str, words: int = 120, temperature: float = 0.2) -> str:
+    """
+    Generate a short story from a prompt: a cheap stand-in for `generate_story_with_cohere`
+    used to screen candidates before writing full stories.
+
+    Parameters:
+    - input_prompt (str): The candidate prompt.
+    - cohere_api_key (str): Your Cohere API key.
+    - words (int): Target length of the preview in words.
+    - temperature (float): Sampling temperature, the same as for full stories by default.
+
+    Returns:
+    - str: The preview story.
+    """
+    final_prompt = "Choose branches from the following prompt structure to create an interesting story: " + input_prompt + f"The result should include the final story and not the structure. The final story should be around {words} words"
+    return generate_text(final_prompt, max_tokens=int(1.5 * words), temperature=temperature, api_key=cohere_api_key)
+
+# Screening signals for successive halving, cheapest first
+HALVING_SIGNALS = ["pre", "preview"]
+
+def rank_prompts_successive_halving(input_prompt: str, candidate_prompts: List[str], human_story: str, api_key: str,
+                                    signals: List[str] = ("pre",), keep_fraction: float = 0.5,
+                                    audit: bool = False) -> Tuple[List[Dict], Dict, Dict]:
+    """
+    Rank prompts like `rank_prompts_post_generation_LLM`, but only write and judge full stories
+    for the candidates that survive cheaper screening rounds.
+
+    Each signal in `signals` scores the remaining candidates and keeps the best `keep_fraction`
+    of them (at least one); the survivors of the last round get the full story and judge call.
+    - "pre": one batched pre-generation judge call scoring every candidate's relevance and diversity.
+    - "preview": a short story per candidate, judged against the human story like a full one.
+
+    Parameters:
+    - input_prompt (str): The initial input prompt.
+    - candidate_prompts (list): List of candidate prompts to evaluate.
+    - human_story (str): The reference human-written story.
+    - api_key (str): Your Cohere API key.
+    - signals (list): Screening rounds to run, in order.
+    - keep_fraction (float): Fraction of candidates kept after each screening round.
+    - audit (bool): Also fully evaluate the eliminated candidates, to check the pick against exhaustive ranking.
+
+    Returns:
+    - tuple: The ranked prompts (fully evaluated ones first, by score; eliminated ones after, by the
+      round they reached; their "average_score" is NaN), the best prompt, and a report with the calls
+      and story words used, the fraction of each saved against exhaustive ranking (negative when
+      screening cost more) and, when audited, whether the pick agrees with exhaustive ranking.
+    """
+    from src.prompt_ranking.rank_pre_generation import rank_prompts_with_cohere
+
+    usage = {"calls": 0, "story_words": 0}
+    full_results = {}
+
+    def evaluate_full(index):
+        if index not in full_results:
+            story = generate_story_with_cohere(candidate_prompts[index], api_key)
+            scores = evaluate_with_cohere_story_from_prompt(input_prompt, story, human_story, api_key)
+            usage["calls"] += 2
+            usage["story_words"] += len(story.split())
+            full_results[index] = (scores, float(np.nanmean(np.array(list(scores.values())))), len(story.split()))
+        return full_results[index]
+
+    def screen(signal, indices):
+        if signal == "pre":
+            # Counts the batched call, and the per-candidate calls if it has to fall back to them
+            ranked = rank_prompts_with_cohere(input_prompt, [candidate_prompts[i] for i in indices], usage=usage)
+            # Candidates can repeat, so scores are matched by position rather than by text
+            final_scores = {}
+            for prompt, final_score, _, _ in ranked:
+                position = next(i for i in indices if candidate_prompts[i] == prompt and i not in final_scores)
+                final_scores[position] = final_score
+            return final_scores
+        if signal == "preview":
+            scores = {}
+            for i in indices:
+                preview = generate_story_preview(candidate_prompts[i], api_key)
+                usage["calls"] += 2
+                usage["story_words"] += len(preview.split())
+                preview_scores = evaluate_with_cohere_story_from_prompt(input_prompt, preview, human_story, api_key)
+                scores[i] = float(np.nanmean(np.array(list(preview_scores.values()))))
+            return scores
+        raise ValueError(f"Unknown signal '{signal}'. Expected one of {HALVING_SIGNALS}.")
+
+    survivors = list(range(len(candidate_prompts)))
+    reached = {i: (0, float("-inf")) for i in survivors}  # Round reached and the score it got there
+    for round_number, signal in enumerate(signals, start=1):
+        if len(survivors) <= 1:
+            break
+        scores = screen(signal, survivors)
+        for i in survivors:
+            reached[i] = (round_number, scores[i])
+        survivors = sorted(survivors, key=lambda i: scores[i], reverse=True)[:max(1, int(np.ceil(len(survivors) * keep_fraction)))]
+
+    final_round = len(signals) + 1
+    for i in survivors:
+        reached[i] = (final_round, evaluate_full(i)[1])
+    words_per_story = float(np.mean([words for _, _, words in full_results.values()]))
+
+    prompt_ranking = []
+    for i in sorted(reached, key=lambda i: reached[i], reverse=True):
+        full = full_results.get(i)
+        prompt_ranking.append({
+            "prompt": candidate_prompts[i],
+            "evaluation_scores": full[0] if full else {},
+            "average_score": full[1] if full else float("nan")
+        })
+    best_prompt = prompt_ranking[0]
+
+    # Compared with exhaustive ranking: one full story and judge call per candidate, no screening.
+    # Calls and story words are reported separately, as screening calls write no story.
+    exhaustive_words = words_per_story * len(candidate_prompts)
+    report = {
+        "calls": usage["calls"],
+        "exhaustive_calls": 2 * len(candidate_prompts),
+        "story_words": usage["story_words"],
+        "exhaustive_story_words": exhaustive_words,
+        "agrees_with_exhaustive": None,
+    }
+
+    if audit:
+        # The audit's own calls are left out of the report; its full stories replace the estimate
+        for i in range(len(candidate_prompts)):
+            evaluate_full(i)
+        exhaustive_best = max(range(len(candidate_prompts)), key=lambda i: full_results[i][1])
+        report["agrees_with_exhaustive"] = candidate_prompts[exhaustive_best] == best_prompt["prompt"]
+        report["exhaustive_story_words"] = float(sum(words for _, _, words in full_results.values()))
+
+    report["calls_saved"] = 1 - report["calls"] / report["exhaustive_calls"]
+    report["story_words_saved"] = (1 - report["story_words"] / report["exhaustive_story_words"]
+                                   if report["exhaustive_story_words"] else 0.0)
+
+    return prompt_ranking, best_prompt, report
+
+def process_and_rank_prompts(input_csv: str, output_csv: str, cohere_api_key: str, resume: bool = False,
+                             mode: str = "exhaustive", signals: List[str] = ("pre",), keep_fraction: float = 0.5,
+                             audit_rate: float = 0.0, overwrite: bool = False):
     """
     Process prompts from a CSV file, evaluate them, and save the ranked results to an output CSV.
 
@@ -119,7 +226,18 @@ def process_and_rank_prompts(input_csv: str, output_csv: str, cohere_api_key: st
     - input_csv (str): Path to the input CSV file.
     - output_csv (str): Path to the output CSV file to save results.
     - cohere_api_key (str): API key for Cohere's service.
+    - resume (bool): Skip input rows already completed by an interrupted run.
+    - overwrite (bool): Discard an interrupted run's partial file instead of refusing to start.
+    - mode (str): "exhaustive" fully evaluates every candidate; "halving" uses
+      `rank_prompts_successive_halving` and adds "Calls Saved" and "Story Words Saved" columns
+      (fractions of exhaustive ranking's; negative when screening cost more).
+    - signals (list): Screening rounds for "halving" mode.
+    - keep_fraction (float): Fraction of candidates kept after each screening round.
+    - audit_rate (float): Fraction of rows also ranked exhaustively in "halving" mode, to measure
+      how often the top-1 pick agrees.
     """
+    import pandas as pd  # Deferred so importing this module (e.g. for --help) stays fast
+
     try:
         df = pd.read_csv(input_csv)
     except Exception as e:
@@ -139,20 +257,40 @@ def process_and_rank_prompts(input_csv: str, output_csv: str, cohere_api_key: st
         'Prompt 3', 'Final Score 3', 
         'Best Prompt', 'Best Prompt Score', 'Latency'
     ]
+    if mode == "halving":
+        header.extend(['Calls Saved', 'Story Words Saved'])
+    reports = []
 
-    output_data = []
+    # Rows are appended to a partial file as they complete, so a crash loses at most the row in flight
+    writer = CheckpointWriter(output_csv, header, resume=resume, overwrite=overwrite)
+    failed_rows = 0
 
     for index, row in df.iterrows():
         starting_prompt = row['Prompt']
         human_story = row['Human Story']
         generated_prompts = [row['Response 1'], row['Response 2'], row['Response 3']]
+        key = row_key(index, starting_prompt, *generated_prompts)
+        if writer.is_done(key):
+            continue
+        if any(pd.isna(candidate) for candidate in generated_prompts):
+            print(f"Skipping row {index}: a candidate prompt is missing (its generation failed)")
+            failed_rows += 1
+            continue
 
         try:
             # Measure latency
             start_time = time.time()
-            ranked_prompts, best_prompt = rank_prompts_post_generation_LLM(
-                starting_prompt, generated_prompts, human_story, cohere_api_key
-            )
+            if mode == "halving":
+                # Audited rows are spread evenly through the file
+                audit = audit_rate > 0 and int(index * audit_rate) != int((index + 1) * audit_rate)
+                ranked_prompts, best_prompt, report = rank_prompts_successive_halving(
+                    starting_prompt, generated_prompts, human_story, cohere_api_key,
+                    signals=signals, keep_fraction=keep_fraction, audit=audit
+                )
+            else:
+                ranked_prompts, best_prompt = rank_prompts_post_generation_LLM(
+                    starting_prompt, generated_prompts, human_story, cohere_api_key
+                )
             latency = time.time() - start_time
 
             row_data = [
@@ -163,28 +301,60 @@ def process_and_rank_prompts(input_csv: str, output_csv: str, cohere_api_key: st
                 ranked_prompts[2]['prompt'], ranked_prompts[2]['average_score'],
                 best_prompt['prompt'], best_prompt['average_score'], latency
             ]
+            if mode == "halving":
+                row_data.extend([report['calls_saved'], report['story_words_saved']])
+                reports.append(report)
 
-            output_data.append(row_data)
+            writer.write(key, row_data)
 
         except Exception as e:
             print(f"Error processing row {index}: {e}")
+            failed_rows += 1
             continue
 
-    # Save to output CSV
+    if failed_rows:
+        # Failed rows are not checkpointed, so rerunning with --resume retries only those
+        print(f"{failed_rows} rows failed after retries; rerun with --resume to retry them.")
+
+    if reports:
+        audited = [report['agrees_with_exhaustive'] for report in reports if report['agrees_with_exhaustive'] is not None]
+        print("\n=== Successive Halving Summary ===")
+        print(f"Rows: {len(reports)}")
+        calls = sum(report['calls'] for report in reports)
+        exhaustive_calls = sum(report['exhaustive_calls'] for report in reports)
+        story_words = sum(report['story_words'] for report in reports)
+        exhaustive_words = sum(report['exhaustive_story_words'] for report in reports)
+        print(f"Calls: {calls} (exhaustive: {exhaustive_calls}), "
+              + (f"{1 - calls / exhaustive_calls:.1%} saved" if calls < exhaustive_calls
+                 else f"{calls - exhaustive_calls} more than exhaustive ranking"))
+        print(f"Story words: {story_words} (exhaustive: {exhaustive_words:.0f}), "
+              + (f"{1 - story_words / exhaustive_words:.1%} saved" if story_words < exhaustive_words
+                 else f"{story_words - exhaustive_words:.0f} more than exhaustive ranking"))
+        if audited:
+            print(f"Top-1 agreement with exhaustive ranking: {np.mean(audited):.1%} over {len(audited)} audited rows")
+
+    # Move the completed rows into the output CSV
     try:
-        with open(output_csv, mode='w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(header)  # Write the header
-            writer.writerows(output_data)  # Write all the data
+        writer.finalize()
         print(f"Results saved to '{output_csv}'.")
     except Exception as e:
         print(f"Error saving output CSV file: {e}")
 
+    print(f"Judge protocol: {judge_stats()}")
+    if get_cache() is not None:
+        print(f"LLM cache: {get_cache().stats()}")
+
 if __name__ == "__main__":
     # Set up argument parser
     parser = argparse.ArgumentParser(description="Rank prompts by generating stories using Cohere's API based on relevance and diversity.")
     parser.add_argument("--input_csv", type=str, required=True, help="Path to the input CSV file containing prompts.")
     parser.add_argument("--output_csv", type=str, required=True, help="Path to the output CSV file to save results.")
+    parser.add_argument("--resume", action="store_true", help="Skip input rows already completed in the output's .partial checkpoint file.")
+    parser.add_argument("--overwrite", action="store_true", help="Discard an existing .partial checkpoint file instead of refusing to start.")
+    parser.add_argument("--mode", type=str, default="exhaustive", choices=["exhaustive", "halving"], help="Fully evaluate every candidate, or screen them with successive halving first.")
+    parser.add_argument("--signals", type=str, default="pre", help=f"Comma-separated screening rounds for halving mode, from: {', '.join(HALVING_SIGNALS)}.")
+    parser.add_argument("--keep_fraction", type=float, default=0.5, help="Fraction of candidates kept after each screening round.")
+    parser.add_argument("--audit_rate", type=float, default=0.0, help="Fraction of rows also ranked exhaustively in halving mode, to measure top-1 agreement.")
 
     args = parser.parse_args()
 
@@ -198,7 +368,9 @@ if __name__ == "__main__":
 
     try:
         print("Starting the prompt ranking process...")
-        process_and_rank_prompts(input_csv, output_csv, cohere_api_key)
+        process_and_rank_prompts(input_csv, output_csv, get_api_key(), resume=args.resume, mode=args.mode,
+                                 signals=args.signals.split(","), keep_fraction=args.keep_fraction, audit_rate=args.audit_rate,
+                                 overwrite=args.overwrite)
         print("Processing completed.")
     except Exception as e:
         print(f"An error occurred during processing: {e}")
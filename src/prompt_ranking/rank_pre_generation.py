@@ -1,82 +1,188 @@
-import cohere
-import pandas as pd
 import time
 import numpy as np
 import csv
 import argparse
+import json
 
 
-from dotenv import load_dotenv
 import os
-# Load environment variables from .env file
-load_dotenv()
+from src.checkpoint import CheckpointWriter, row_key
+from src.llm_client import forget_text, generate_text
+from src.judge_protocol import JudgeSchema, judge, record as record_judge_outcome
+from src.llm_cache import get_cache
 
-# Initialize the Cohere client with the API key from env.
-cohere_api_key = os.getenv("COHERE_API_KEY")
-
-cohere_client = cohere.Client(cohere_api_key)
-
-def rank_prompts_with_cohere(starting_prompt, generated_prompts):
+EVALUATION_TEMPLATE = """
+    You are an expert evaluator tasked with scoring prompts based on their relevance and diversity compared to the starting prompt. 
+    I will provide you with a starting prompt and candidate prompt. I will also provide you with a metric name and a question for each of those on a scale of 0-5.
+    {instruction}
+    
+    Starting Prompt: {starting_prompt}
+    Candidate Prompt : {candidate_prompt}
+    
+    Metrics:
+{metrics}
     """
-    Rank prompts using Cohere's LLM as a judge for relevance and diversity.
 
-    Parameters:
-    - starting_prompt: The original prompt used to generate new prompts.
-    - generated_prompts: List of generated prompts to evaluate.
-
-    Returns:
-    - ranked_prompts: List of tuples (prompt, final_score, relevance_score, diversity_score) sorted by final score.
-    """
-    if not isinstance(generated_prompts, list) or not generated_prompts:
-        raise ValueError("Generated prompts should be a non-empty list.")
+# Relevance and diversity on a 0-5 scale, as scored by the single-candidate judge
+CANDIDATE_SCHEMA = JudgeSchema({
+    "Relevance": "How closely the prompt relates to the starting prompt (scale: 0 to 5).",
+    "Diversity": "How unique and distinct the prompt is compared to other prompts (scale: 0 to 5).",
+}, low=0, high=5)
 
-    evaluation_template = """
+# Scores every candidate of a row in a single judge call
+BATCH_EVALUATION_TEMPLATE = """
     You are an expert evaluator tasked with scoring prompts based on their relevance and diversity compared to the starting prompt. 
-    I will provide you with a starting prompt and candidate prompt. I will also provide you with a metric name and a question for each of those on a scale of 0-5.
-    Just answer with the name of the metric and the score, nothing else.
+    I will provide you with a starting prompt and {num_candidates} numbered candidate prompts. Score every candidate on each metric on a scale of 0-5.
+    Answer only with a JSON object keyed by candidate number, nothing else. For example:
+    {{"1": {{"Relevance": 4, "Diversity": 2}}, "2": {{"Relevance": 3, "Diversity": 5}}}}
     
     Starting Prompt: {starting_prompt}
-    Candidate Prompt : {candidate_prompt}
+    
+{candidates}
     
     Metrics:
     Relevance: How closely the prompt relates to the starting prompt (scale: 0 to 5).
-    Diversity: How unique and distinct the prompt is compared to other prompts (scale: 0 to 5).
+    Diversity: How unique and distinct the prompt is compared to the other candidate prompts (scale: 0 to 5).
     """
 
-    scored_prompts = []
 
-    for i, candidate_prompt in enumerate(generated_prompts):
-        formatted_prompt = evaluation_template.format(starting_prompt=starting_prompt, candidate_prompt=candidate_prompt)
+def score_candidate_with_cohere(starting_prompt, candidate_prompt, index):
+    """
+    Score a single candidate prompt with one judge call.
 
-        response = cohere_client.generate(
-            prompt=formatted_prompt,
+    Parameters:
+    - starting_prompt: The original prompt used to generate new prompts.
+    - candidate_prompt: The candidate prompt to score.
+    - index: Position of the candidate, used in log and error messages.
+
+    Returns:
+    - tuple: (relevance_score, diversity_score)
+    """
+    try:
+        scores = judge(
+            EVALUATION_TEMPLATE,
+            {"starting_prompt": starting_prompt, "candidate_prompt": candidate_prompt},
+            CANDIDATE_SCHEMA,
             max_tokens=200,
-            temperature=0.01  # Deterministic output
+            temperature=0.01,  # Deterministic output, so the judgement is cached
+            allow_partial=False
         )
-        
-        response_text = response.generations[0].text.strip()
-        
-        # Print the raw response for debugging
-        print(f"Response for prompt {i+1}: {response_text}")
-        
-        try:
-            # Safely parse the response manually (e.g., if it's in a structured text format)
-            lines = response_text.split("\n")
-            relevance_score = None
-            diversity_score = None
+    except ValueError as e:
+        raise ValueError(f"Error parsing Cohere's response for prompt {index+1}: {e}")
 
-            for line in lines:
-                if "Relevance" in line:
-                    relevance_score = int(line.split(":")[1].strip())
-                elif "Diversity" in line:
-                    diversity_score = int(line.split(":")[1].strip())
+    relevance_score, diversity_score = scores["Relevance"], scores["Diversity"]
+    print(f"Scores for prompt {index+1}: {scores}")
 
-            if relevance_score is None or diversity_score is None:
-                raise ValueError(f"Failed to extract scores from response: {response_text}")
+    return relevance_score, diversity_score
 
-        except Exception as e:
-            raise ValueError(f"Error parsing Cohere's response for prompt {i+1}: {e}")
 
+def parse_batch_scores(response_text, num_candidates):
+    """
+    Parse and validate a batched judge response.
+
+    Parameters:
+    - response_text: Raw judge output, expected to contain a JSON object keyed "1".."N".
+    - num_candidates: Number of candidates that were judged.
+
+    Returns:
+    - list: One (relevance_score, diversity_score) tuple per candidate, in candidate order.
+
+    Raises:
+    - ValueError: If the response is not valid JSON or any candidate or score is missing or out of range.
+    """
+    start, end = response_text.find("{"), response_text.rfind("}")
+    if start == -1 or end == -1:
+        raise ValueError(f"No JSON object in response: {response_text}")
+    try:
+        parsed = json.loads(response_text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON in response: {e}")
+    if not isinstance(parsed, dict):
+        raise ValueError(f"Expected a JSON object, got: {type(parsed).__name__}")
+
+    scores = []
+    for i in range(1, num_candidates + 1):
+        entry = parsed.get(str(i))
+        if not isinstance(entry, dict):
+            raise ValueError(f"Missing scores for candidate {i}")
+        candidate_scores = CANDIDATE_SCHEMA.validate(entry.items())
+        for metric in CANDIDATE_SCHEMA.metrics:
+            if metric not in candidate_scores:
+                raise ValueError(f"Invalid {metric.lower()} score for candidate {i}: {entry!r}")
+        scores.append((candidate_scores["Relevance"], candidate_scores["Diversity"]))
+    return scores
+
+
+def score_candidates_batched(starting_prompt, generated_prompts):
+    """
+    Score all candidate prompts of a row with a single judge call.
+
+    Returns:
+    - list: One (relevance_score, diversity_score) tuple per candidate, in candidate order.
+
+    Raises:
+    - ValueError: If the judge response cannot be parsed and validated.
+    """
+    candidates = "\n".join(
+        f"    Candidate {i}: {candidate_prompt}" for i, candidate_prompt in enumerate(generated_prompts, start=1)
+    )
+    formatted_prompt = BATCH_EVALUATION_TEMPLATE.format(
+        starting_prompt=starting_prompt, candidates=candidates, num_candidates=len(generated_prompts)
+    )
+
+    max_tokens = 100 + 40 * len(generated_prompts)  # Room for one small JSON entry per candidate
+    response_text = generate_text(
+        formatted_prompt,
+        max_tokens=max_tokens,
+        temperature=0.01,  # Deterministic output, so the judgement is cached
+        template=BATCH_EVALUATION_TEMPLATE
+    )
+    print(f"Batched response: {response_text}")
+
+    try:
+        return parse_batch_scores(response_text, len(generated_prompts))
+    except ValueError:
+        # Keep an unusable judgement out of the cache, so a later run asks again
+        forget_text(formatted_prompt, max_tokens=max_tokens, temperature=0.01, template=BATCH_EVALUATION_TEMPLATE)
+        raise
+
+
+def rank_prompts_with_cohere(starting_prompt, generated_prompts, batched=True, usage=None):
+    """
+    Rank prompts using Cohere's LLM as a judge for relevance and diversity.
+
+    Parameters:
+    - starting_prompt: The original prompt used to generate new prompts.
+    - generated_prompts: List of generated prompts to evaluate.
+    - batched: Score all candidates in one judge call, falling back to one call per
+      candidate only if the batched response cannot be parsed (default=True).
+    - usage: Optional dict whose "calls" entry is increased by the judge calls made.
+
+    Returns:
+    - ranked_prompts: List of tuples (prompt, final_score, relevance_score, diversity_score) sorted by final score.
+    """
+    if not isinstance(generated_prompts, list) or not generated_prompts:
+        raise ValueError("Generated prompts should be a non-empty list.")
+
+    usage = usage if usage is not None else {"calls": 0}
+    candidate_scores = None
+    if batched:
+        usage["calls"] += 1
+        try:
+            candidate_scores = score_candidates_batched(starting_prompt, generated_prompts)
+        except ValueError as e:
+            record_judge_outcome(parse_failures=1)
+            print(f"Batched judging failed, falling back to per-candidate calls: {e}")
+
+    if candidate_scores is None:
+        usage["calls"] += len(generated_prompts)
+        candidate_scores = [
+            score_candidate_with_cohere(starting_prompt, candidate_prompt, i)
+            for i, candidate_prompt in enumerate(generated_prompts)
+        ]
+
+    scored_prompts = []
+    for candidate_prompt, (relevance_score, diversity_score) in zip(generated_prompts, candidate_scores):
         final_score = 0.8 * relevance_score + 0.2 * diversity_score  # Weighted score
         scored_prompts.append((candidate_prompt, final_score, relevance_score, diversity_score))
 
@@ -85,14 +191,25 @@ def rank_prompts_with_cohere(starting_prompt, generated_prompts):
 
     return ranked_prompts
 
-def process_and_rank_prompts(input_csv, output_csv):
+def process_and_rank_prompts(input_csv, output_csv, batched=True, resume=False, overwrite=False):
     """
     Read starting prompt and generated prompts (Response 1, Response 2, Response 3) from a CSV,
     calculate relevance, diversity scores, and latency using Cohere, and store the results in an output CSV.
+    With `batched` set, each row costs a single judge call instead of one per candidate.
+    With `resume`, input rows already completed by an interrupted run are skipped; with
+    `overwrite`, that run's partial file is discarded instead.
     """
+    import pandas as pd  # Deferred so importing this module (e.g. for --help) stays fast
+
     df = pd.read_csv(input_csv)
 
-    output_data = []
+    header = ['Starting Prompt', 'Human Story', 'Prompt 1', 'Relevance Score 1', 'Diversity Score 1', 'Final Score 1', 
+              'Prompt 2', 'Relevance Score 2', 'Diversity Score 2', 'Final Score 2', 
+              'Prompt 3', 'Relevance Score 3', 'Diversity Score 3', 'Final Score 3', 
+              'Best Prompt', 'Best Prompt Score', 'Latency']
+
+    # Rows are appended to a partial file as they complete, so a crash loses at most the row in flight
+    writer = CheckpointWriter(output_csv, header, resume=resume, overwrite=overwrite)
 
     # Iterate through each row in the CSV
     for index, row in df.iterrows():
@@ -100,9 +217,15 @@ def process_and_rank_prompts(input_csv, output_csv):
         starting_prompt = row['Prompt']
         human_story = row['Human Story']
         generated_prompts = [row['Response 1'], row['Response 2'], row['Response 3']]
+        key = row_key(index, starting_prompt, *generated_prompts)
+        if writer.is_done(key):
+            continue
+        if any(pd.isna(candidate) for candidate in generated_prompts):
+            print(f"Skipping row {index}: a candidate prompt is missing (its generation failed)")
+            continue
         start_time = time.time()
         try:
-            ranked_prompts = rank_prompts_with_cohere(starting_prompt, generated_prompts)
+            ranked_prompts = rank_prompts_with_cohere(starting_prompt, generated_prompts, batched=batched)
         except Exception as e:
             print(f"Error processing row {index}: {e}")
             continue
@@ -129,25 +252,23 @@ def process_and_rank_prompts(input_csv, output_csv):
         row_data.append(best_score)
         row_data.append(latency)
 
-        output_data.append(row_data)
+        writer.write(key, row_data)
 
-    with open(output_csv, mode='w', newline='') as file:
-        writer = csv.writer(file)
-
-        header = ['Starting Prompt', 'Human Story', 'Prompt 1', 'Relevance Score 1', 'Diversity Score 1', 'Final Score 1', 
-                  'Prompt 2', 'Relevance Score 2', 'Diversity Score 2', 'Final Score 2', 
-                  'Prompt 3', 'Relevance Score 3', 'Diversity Score 3', 'Final Score 3', 
-                  'Best Prompt', 'Best Prompt Score', 'Latency']
-        writer.writerow(header)
-        writer.writerows(output_data)
+    writer.finalize()
 
     print(f"Results saved to {output_csv}")
 
+    if get_cache() is not None:
+        print(f"LLM cache: {get_cache().stats()}")
+
 if __name__ == "__main__":
     # Set up argument parser
     parser = argparse.ArgumentParser(description="Rank prompts using Cohere's API based on relevance and diversity.")
     parser.add_argument("--input_csv", type=str, required=True, help="Path to the input CSV file containing prompts.")
     parser.add_argument("--output_csv", type=str, required=True, help="Path to the output CSV file to save results.")
+    parser.add_argument("--resume", action="store_true", help="Skip input rows already completed in the output's .partial checkpoint file.")
+    parser.add_argument("--overwrite", action="store_true", help="Discard an existing .partial checkpoint file instead of refusing to start.")
+    parser.add_argument("--per_candidate", action="store_true", help="Judge each candidate with its own call instead of one batched call per row.")
 
     args = parser.parse_args()
 
@@ -161,7 +282,8 @@ if __name__ == "__main__":
 
     try:
         print("Starting the prompt ranking process...")
-        process_and_rank_prompts(input_csv, output_csv)
+        process_and_rank_prompts(input_csv, output_csv, batched=not args.per_candidate, resume=args.resume,
+                                 overwrite=args.overwrite)
         print(f"Processing completed. Results saved to '{output_csv}'.")
     except Exception as e:
         print(f"An error occurred during processing: {e}")
\ No newline at end of file
@@ -0,0 +1,236 @@
+import contextlib
+import threading
+import time
+
+from src.tracing import span
+
+# Depth of RateController.call frames, and the controller set by `throttle_calls`, on each thread
+_local = threading.local()
+
+
+def is_rate_limit_error(error):
+    """
+    Return True if the exception signals that the upstream rejected the call for rate limiting (HTTP 429).
+    """
+    if getattr(error, "status_code", None) == 429:
+        return True
+    if type(error).__name__ == "TooManyRequestsError":
+        return True
+    message = str(error).lower()
+    return "429" in message or "rate limit" in message or "too many requests" in message
+
+
+def rate_limits_handled():
+    """
+    Return True if the current thread is inside RateController.call, which retries rate-limited
+    calls itself; lower layers then raise 429s at once so the controller can adapt its rate.
+    """
+    return getattr(_local, "depth", 0) > 0
+
+
+@contextlib.contextmanager
+def throttle_calls(controller):
+    """
+    Route every generate call made on this thread through `controller` while the block runs.
+
+    Each call takes its own token and slot and is retried on its own when rate limited, so a
+    429 on the last of several calls does not repeat the ones before it.
+    """
+    previous = getattr(_local, "controller", None)
+    _local.controller = controller
+    try:
+        yield controller
+    finally:
+        _local.controller = previous
+
+
+def current_controller():
+    """
+    Return the controller set by `throttle_calls` on this thread, or None.
+    """
+    return getattr(_local, "controller", None)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate` tokens per second.
+
+    `clock` and `sleep` default to time.monotonic and time.sleep; tests pass a fake clock.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """
+        Block until `tokens` tokens are available, then take them.
+
+        Requests larger than the bucket only wait for a full bucket and leave it in debt.
+        """
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= min(tokens, self.capacity):
+                    self.tokens -= tokens
+                    return
+                wait = (min(tokens, self.capacity) - self.tokens) / self.rate
+            self.sleep(wait)
+
+    def drain(self, seconds):
+        """
+        Remove the tokens that would be produced over the next `seconds`, pausing new calls after a rejection.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens -= seconds * self.rate
+
+
+class RateController:
+    """
+    Shared throttle for upstream API calls: a token bucket caps the request rate and an
+    AIMD (additive increase, multiplicative decrease) limit caps the number of calls in flight.
+
+    Every successful call nudges the rate and concurrency limit upwards; every 429 halves
+    them, pauses the bucket and retries the call. Throughput therefore settles just under
+    the real upstream quota instead of a fixed worst-case delay. Other failures only release
+    their slot: an error or timeout says nothing about spare quota, so it must not speed the
+    controller up. The rate step grows with the rate, so recovering from a 429 takes a similar
+    number of calls at 20 or 2000 requests/minute.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=20,
+        max_requests_per_minute=600,
+        max_concurrency=8,
+        min_concurrency=1,
+        decrease_factor=0.5,
+        increase_fraction=0.01,
+        backoff_seconds=10,
+        max_retries=5,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        """
+        Parameters:
+        - requests_per_minute (float): Starting request rate.
+        - max_requests_per_minute (float): Ceiling the rate may probe up to.
+        - max_concurrency (int): Ceiling for the number of calls in flight.
+        - min_concurrency (int): Floor for the number of calls in flight.
+        - decrease_factor (float): Multiplier applied to rate and concurrency on a 429.
+        - increase_fraction (float): Rate step per success as a fraction of the current rate
+          (at least 1 request/minute).
+        - backoff_seconds (float): Pause applied to the bucket after a 429.
+        - max_retries (int): Retries for a call that keeps hitting rate limits.
+        - clock, sleep: Time source and sleep function for the token bucket (for tests).
+        """
+        if requests_per_minute > max_requests_per_minute:
+            print(f"Warning: starting rate {requests_per_minute:g}/min is above the ceiling of "
+                  f"{max_requests_per_minute:g}/min and is clamped to it; raise max_requests_per_minute to allow more")
+        self.min_rate = 1 / 60
+        self.max_rate = max_requests_per_minute / 60
+        self.bucket = TokenBucket(rate=min(requests_per_minute, max_requests_per_minute) / 60, capacity=max(1, min_concurrency),
+                                  clock=clock, sleep=sleep)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(max(min_concurrency, 1), max_concurrency))
+        self.decrease_factor = decrease_factor
+        self.increase_fraction = increase_fraction
+        self.backoff_seconds = backoff_seconds
+        self.max_retries = max_retries
+
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.successes = 0
+        self.rate_limited = 0
+        self.failures = 0
+
+    def _enter(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def _exit(self, outcome):
+        # outcome is "ok", "rate_limited" or "failed"; a failure only frees its slot
+        with self.condition:
+            self.in_flight -= 1
+            with self.bucket.lock:
+                self.bucket._refill()
+                if outcome == "rate_limited":
+                    self.rate_limited += 1
+                    self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+                    self.bucket.rate = max(self.min_rate, self.bucket.rate * self.decrease_factor)
+                elif outcome == "failed":
+                    self.failures += 1
+                else:
+                    self.successes += 1
+                    # Additive increase: max(1 request/minute, increase_fraction of the rate) per
+                    # success, +1 slot per window of `limit` successes
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                    step = max(1 / 60, self.bucket.rate * self.increase_fraction)
+                    self.bucket.rate = min(self.max_rate, self.bucket.rate + step)
+                self.bucket.capacity = max(1, int(self.limit))
+            self.condition.notify_all()
+
+    def call(self, fn, *args, cost=1, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` once a rate token and a concurrency slot are available.
+
+        Parameters:
+        - fn: Function issuing the upstream call(s).
+        - cost (int): Number of upstream requests `fn` makes, taken from the bucket up front.
+
+        Returns:
+        - The return value of `fn`. Non rate-limit exceptions are raised unchanged.
+        """
+        with span("rate_control.call", cost=cost) as current:
+            waited = 0.0
+            for attempt in range(self.max_retries + 1):
+                # Time spent waiting for a token and a slot is queueing, not upstream latency
+                wait_start = time.perf_counter()
+                self.bucket.acquire(cost)
+                self._enter()
+                waited += time.perf_counter() - wait_start
+                current.set(retries=attempt, queue_wait_ms=waited * 1000)
+                _local.depth = getattr(_local, "depth", 0) + 1
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    _local.depth -= 1
+                    rate_limited = is_rate_limit_error(e)
+                    self._exit("rate_limited" if rate_limited else "failed")
+                    if not rate_limited or attempt == self.max_retries:
+                        raise
+                    print(f"Rate limited, backing off (rate {self.bucket.rate * 60:.1f}/min, concurrency {int(self.limit)})")
+                    self.bucket.drain(self.backoff_seconds)
+                    continue
+                _local.depth -= 1
+                self._exit("ok")
+                return result
+
+    def stats(self):
+        """
+        Return the current rate, concurrency limit and call counters (`failures` counts calls
+        that failed for reasons other than rate limiting).
+        """
+        with self.condition:
+            return {
+                "requests_per_minute": self.bucket.rate * 60,
+                "concurrency_limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "successes": self.successes,
+                "rate_limited": self.rate_limited,
+                "failures": self.failures,
+            }
@@ -0,0 +1,371 @@
+import heapq
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from src.rate_control import is_rate_limit_error, rate_limits_handled
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server-side failures
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Exception class names (httpx, the Cohere SDK and builtins) raised for transient network failures
+TRANSIENT_ERRORS = {
+    "TimeoutException", "ConnectTimeout", "ReadTimeout", "WriteTimeout", "PoolTimeout",
+    "ConnectError", "ReadError", "WriteError", "RemoteProtocolError", "NetworkError",
+    "TimeoutError", "ConnectionError", "ConnectionResetError", "BrokenPipeError",
+    "InternalServerError", "ServiceUnavailableError", "GatewayTimeoutError",
+}
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a call and its retries did not finish within the call's deadline.
+    """
+
+
+def classify_error(error):
+    """
+    Classify an exception from an upstream call.
+
+    Returns:
+    - str: "rate_limit" (HTTP 429), "transient" (timeouts, dropped connections, 5xx) or
+      "fatal" (bad requests, authentication, parsing errors), which are never retried.
+    """
+    if is_rate_limit_error(error):
+        return "rate_limit"
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return "transient" if status_code in RETRYABLE_STATUS else "fatal"
+    if any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__):
+        return "transient"
+    return "fatal"
+
+
+def _retry_after(error):
+    # Seconds requested by the server's Retry-After header, if any
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Retries transient failures with jittered exponential backoff, bounded by a deadline
+    covering the whole call including its retries.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=30.0, deadline=300.0, clock=time.monotonic, sleep=time.sleep):
+        """
+        Parameters:
+        - max_attempts (int): Attempts per call, including the first.
+        - base_delay (float): Backoff ceiling in seconds after the first failure; doubles per attempt.
+        - max_delay (float): Largest backoff in seconds.
+        - deadline (float): Seconds a call may take across all attempts.
+        - clock, sleep: Time source and sleep function used for deadlines and backoff (for tests).
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.clock = clock
+        self.sleep = sleep
+
+    def backoff(self, attempt):
+        """
+        Return the delay before retry number `attempt + 1`: uniform between zero and the
+        exponential ceiling ("full jitter"), so clients failing together do not retry together.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def retry_delay(self, error, attempt, deadline_at):
+        """
+        Return how long to wait before retrying after `error`, or None if the error should be raised.
+
+        Parameters:
+        - error (Exception): The failure of attempt number `attempt` (0-based).
+        - attempt (int): Number of the failed attempt.
+        - deadline_at (float): Value of the policy's clock by which the call must finish.
+        """
+        kind = classify_error(error)
+        if kind == "fatal" or attempt + 1 >= self.max_attempts:
+            return None
+        # A RateController higher up the stack retries 429s itself and adapts its rate to them
+        if kind == "rate_limit" and rate_limits_handled():
+            return None
+        delay = self.backoff(attempt)
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if self.clock() + delay >= deadline_at:
+            return None
+        return delay
+
+
+class Hedger:
+    """
+    Starts a duplicate of a slow request once it has run longer than the recent p95 latency,
+    and falls back to the duplicate's result if the original fails.
+
+    The original runs on the calling thread, so it keeps the caller's thread-local context
+    (tracing span, rate controller) and the number of concurrent calls is not capped by this
+    class; only the duplicates run on its executor. When the original fails, typically a
+    stalled connection running into its timeout, the duplicate has already been running for a
+    while, which cuts the tail compared to a retry started from scratch. Only a small fraction
+    of calls are hedged, so the extra load stays bounded.
+    """
+
+    def __init__(self, quantile=0.95, min_delay=1.0, max_fraction=0.1, window=200, min_samples=20, max_workers=32,
+                 clock=time.monotonic):
+        """
+        Parameters:
+        - quantile (float): Latency quantile after which the duplicate is sent.
+        - min_delay (float): Smallest hedging delay in seconds.
+        - max_fraction (float): Largest fraction of calls that may be hedged.
+        - window (int): Number of recent latencies kept per key.
+        - min_samples (int): Latencies needed for a key before its calls are hedged.
+        - max_workers (int): Threads running duplicates; duplicates beyond it wait for a thread.
+        - clock: Time source for latencies and deadlines (for tests).
+        """
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.max_fraction = max_fraction
+        self.window = window
+        self.min_samples = min_samples
+        self.clock = clock
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self.latencies = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        # Duplicates due to start, as (due time, sequence, start function), run by one timer thread
+        self.timers = []
+        self.timer_sequence = 0
+        self.timer_condition = threading.Condition()
+        self.timer_thread = None
+
+    def record(self, key, seconds):
+        with self.lock:
+            latencies = self.latencies.get(key)
+            if latencies is None:
+                latencies = self.latencies[key] = deque(maxlen=self.window)
+            latencies.append(seconds)
+
+    def hedge_delay(self, key):
+        """
+        Return the delay after which a call for `key` is hedged, or None before enough samples are seen.
+        """
+        with self.lock:
+            latencies = self.latencies.get(key)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            ordered = sorted(latencies)
+        return max(self.min_delay, ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))])
+
+    def _schedule(self, delay, start):
+        # One timer thread serves every pending duplicate, so waiting calls hold no executor thread
+        with self.timer_condition:
+            self.timer_sequence += 1
+            heapq.heappush(self.timers, (time.monotonic() + delay, self.timer_sequence, start))
+            if self.timer_thread is None:
+                self.timer_thread = threading.Thread(target=self._run_timers, name="hedge-timer", daemon=True)
+                self.timer_thread.start()
+            self.timer_condition.notify()
+
+    def _run_timers(self):
+        while True:
+            with self.timer_condition:
+                while not self.timers or self.timers[0][0] > time.monotonic():
+                    self.timer_condition.wait(self.timers[0][0] - time.monotonic() if self.timers else None)
+                _, _, start = heapq.heappop(self.timers)
+            start()
+
+    def call(self, fn, timeout, key=None):
+        """
+        Run `fn(timeout)` on the calling thread, starting a duplicate on the executor if it is
+        slower than the hedging delay.
+
+        Parameters:
+        - fn: Function issuing the request; takes the seconds left before the deadline.
+        - timeout (float): Seconds the call may take.
+        - key: Latencies are tracked per key (e.g. per prompt template), since they differ widely.
+
+        Returns:
+        - The result of the original call, or of the duplicate if the original failed and the
+          duplicate succeeded. Otherwise the original's failure is raised.
+        """
+        deadline_at = self.clock() + timeout
+
+        def timed():
+            start_time = self.clock()
+            result = fn(max(0.0, deadline_at - start_time))
+            self.record(key, self.clock() - start_time)
+            return result
+
+        with self.lock:
+            self.calls += 1
+        delay = self.hedge_delay(key)
+        if delay is None or delay >= timeout:
+            return timed()
+
+        state = {"finished": False, "hedge": None}
+
+        def start_hedge():
+            with self.lock:
+                if state["finished"] or self.hedged >= self.max_fraction * self.calls:
+                    return
+                self.hedged += 1
+                state["hedge"] = self.executor.submit(timed)
+
+        self._schedule(delay, start_hedge)
+        try:
+            return timed()
+        except Exception as error:
+            primary_error = error
+        finally:
+            with self.lock:
+                state["finished"] = True
+
+        hedge = state["hedge"]
+        if hedge is None:
+            raise primary_error
+        try:
+            result = hedge.result(timeout=max(0.0, deadline_at - self.clock()))
+        except Exception:  # Includes the duplicate running past the deadline
+            raise primary_error
+        with self.lock:
+            self.hedge_wins += 1
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {"calls": self.calls, "hedged": self.hedged, "hedge_wins": self.hedge_wins}
+
+
+_stats = {"calls": 0, "retries": 0, "failures": 0, "deadline_exceeded": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(**increments):
+    with _stats_lock:
+        for name, value in increments.items():
+            _stats[name] += value
+
+
+def call_with_retries(fn, policy=None, hedger=None, key=None, description="API call", deadline=None):
+    """
+    Run an upstream call with classified retries, a deadline and optional hedging.
+
+    Parameters:
+    - fn: Function issuing one attempt; takes the seconds left before the deadline, to use as
+      its request timeout.
+    - policy (RetryPolicy): Defaults to the policy configured from the environment.
+    - hedger (Hedger): If given, slow attempts are hedged with a duplicate request.
+    - key: Latency-tracking key for the hedger.
+    - description (str): Name used in retry messages.
+    - deadline (float): Seconds the call may take across all attempts; defaults to the policy's.
+
+    Returns:
+    - The result of the first successful attempt. Fatal errors are raised at once; transient
+      ones after the last attempt or once the deadline would be exceeded.
+    """
+    policy = policy or get_retry_policy()
+    deadline = policy.deadline if deadline is None else deadline
+    deadline_at = policy.clock() + deadline
+    _count(calls=1)
+    attempt = 0
+    while True:
+        remaining = deadline_at - policy.clock()
+        if remaining <= 0:
+            _count(failures=1, deadline_exceeded=1)
+            raise DeadlineExceeded(f"{description} did not finish within {deadline:g}s")
+        try:
+            if hedger is not None:
+                return hedger.call(fn, remaining, key)
+            return fn(remaining)
+        except Exception as e:
+            delay = policy.retry_delay(e, attempt, deadline_at)
+            if delay is None:
+                _count(failures=1)
+                raise
+            attempt += 1
+            _count(retries=1)
+            print(f"{description} failed ({classify_error(e)}: {type(e).__name__}), "
+                  f"retrying in {delay:.1f}s (attempt {attempt + 1}/{policy.max_attempts})")
+            policy.sleep(delay)
+
+
+def stats():
+    """
+    Return process-wide counters for calls, retries, failures and hedging.
+    """
+    with _stats_lock:
+        counters = dict(_stats)
+    if _hedger is not None:
+        counters.update({f"hedge_{name}": value for name, value in _hedger.stats().items()})
+    return counters
+
+
+_policy = None
+_hedger = None
+_configured = False
+_lock = threading.Lock()
+
+
+def _hedge_workers():
+    # Duplicates are a fraction of the calls in flight, which the server bounds by its request
+    # threads plus the batch fan-out (the same settings that size its generation pool)
+    if os.getenv("AUTOPROMPT_HEDGE_WORKERS"):
+        return int(os.getenv("AUTOPROMPT_HEDGE_WORKERS"))
+    return 2 * (int(os.getenv("AUTOPROMPT_THREADS", "32")) + int(os.getenv("AUTOPROMPT_BATCH_CONCURRENCY", "8")))
+
+
+def _configure():
+    global _policy, _hedger, _configured
+    with _lock:
+        if not _configured:
+            from src.llm_client import load_env
+            load_env()
+            _policy = RetryPolicy(
+                max_attempts=int(os.getenv("AUTOPROMPT_RETRY_ATTEMPTS", "4")),
+                base_delay=float(os.getenv("AUTOPROMPT_RETRY_BASE_DELAY", "1")),
+                max_delay=float(os.getenv("AUTOPROMPT_RETRY_MAX_DELAY", "30")),
+                deadline=float(os.getenv("AUTOPROMPT_CALL_DEADLINE", "300")),
+            )
+            if os.getenv("AUTOPROMPT_HEDGE", "0") == "1":
+                _hedger = Hedger(
+                    quantile=float(os.getenv("AUTOPROMPT_HEDGE_QUANTILE", "0.95")),
+                    min_delay=float(os.getenv("AUTOPROMPT_HEDGE_MIN_DELAY", "1")),
+                    max_fraction=float(os.getenv("AUTOPROMPT_HEDGE_MAX_FRACTION", "0.1")),
+                    max_workers=_hedge_workers(),
+                )
+            _configured = True
+
+
+def get_retry_policy():
+    """
+    Return the process-wide retry policy, configured from the environment (or .env file) on first use:
+    - AUTOPROMPT_RETRY_ATTEMPTS: Attempts per call, including the first (default 4).
+    - AUTOPROMPT_RETRY_BASE_DELAY / AUTOPROMPT_RETRY_MAX_DELAY: Backoff bounds in seconds (default 1 and 30).
+    - AUTOPROMPT_CALL_DEADLINE: Seconds a call may take across all attempts (default 300).
+    """
+    if not _configured:
+        _configure()
+    return _policy
+
+
+def get_hedger():
+    """
+    Return the process-wide hedger, or None unless AUTOPROMPT_HEDGE=1. AUTOPROMPT_HEDGE_QUANTILE,
+    AUTOPROMPT_HEDGE_MIN_DELAY and AUTOPROMPT_HEDGE_MAX_FRACTION tune when and how often calls are hedged.
+    AUTOPROMPT_HEDGE_WORKERS sets the threads running duplicates (default 2 x (AUTOPROMPT_THREADS +
+    AUTOPROMPT_BATCH_CONCURRENCY), the size of the server's generation pool).
+    """
+    if not _configured:
+        _configure()
+    return _hedger
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from src.llm_cache import LLMCache
+
+
+class _Flight:
+    """
+    A computation in progress that concurrent requests for the same key wait on.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    """
+    In-memory TTL + LRU cache of JSON-serialisable responses with single-flight coalescing.
+
+    Entries expire `ttl_seconds` after they are stored and the least recently used ones are
+    evicted once either `max_entries` or `max_bytes` is exceeded. Concurrent misses for the
+    same key share one computation. With `disk_path`, entries are also written to an SQLite
+    file (see `LLMCache`) so several server processes can share them.
+    """
+
+    def __init__(self, ttl_seconds=3600, max_entries=1024, max_bytes=64 * 1024 * 1024, disk_path=None):
+        """
+        Parameters:
+        - ttl_seconds (float): Seconds an entry stays valid after it is stored.
+        - max_entries (int): Maximum number of entries kept in memory.
+        - max_bytes (int): Maximum total size of the serialised entries kept in memory.
+        - disk_path (str): Optional SQLite file shared between processes. None keeps entries in memory only.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_path = disk_path
+        self.entries = OrderedDict()  # key -> (expires_at, value, size)
+        self.total_bytes = 0
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.disk = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Hash the inputs that determine a response into a cache key.
+        """
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _get_disk(self):
+        # Opened on first use so constructing the cache (e.g. at server import) stays cheap; under
+        # the lock, so concurrent first requests share one SQLite handle instead of each opening one
+        if self.disk is None and self.disk_path:
+            with self.lock:
+                if self.disk is None:
+                    self.disk = LLMCache(self.disk_path, max_bytes=self.max_bytes * 8, cache_sampled=True)
+        return self.disk
+
+    def _store_locked(self, key, value, expires_at, size):
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.total_bytes -= previous[2]
+        self.entries[key] = (expires_at, value, size)
+        self.total_bytes += size
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.evictions += 1
+
+    def get(self, key):
+        """
+        Return the cached value for `key`, or None if it is missing or expired.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[key]
+                self.total_bytes -= entry[2]
+
+        disk = self._get_disk()
+        if disk is not None:
+            stored = disk.get(key)
+            if stored is not None:
+                record = json.loads(stored)
+                if record["expires_at"] > now:
+                    with self.lock:
+                        self._store_locked(key, record["value"], record["expires_at"], len(stored))
+                        self.disk_hits += 1
+                    return record["value"]
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Store a JSON-serialisable `value` under `key` for `ttl_seconds`.
+        """
+        expires_at = time.time() + self.ttl_seconds
+        serialised = json.dumps({"expires_at": expires_at, "value": value}, ensure_ascii=False)
+        with self.lock:
+            self._store_locked(key, value, expires_at, len(serialised))
+        disk = self._get_disk()
+        if disk is not None:
+            disk.put(key, serialised)
+
+    def get_or_compute(self, key, compute, cacheable=None):
+        """
+        Return the cached value for `key`, computing it at most once across concurrent callers.
+
+        Parameters:
+        - key (str): Cache key, e.g. from `make_key`.
+        - compute: Zero-argument function producing the value on a miss.
+        - cacheable: Optional predicate; values for which it returns False (e.g. partial
+          results) are returned to every waiting caller but not stored.
+
+        Returns:
+        - The cached or freshly computed value. If `compute` raises, the exception is
+          re-raised in the caller that ran it and in every caller that was waiting on it.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+            if cacheable is None or cacheable(flight.value):
+                self.put(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def stats(self):
+        """
+        Return hit/miss/coalescing counters and the current size of the in-memory cache.
+
+        `coalesced` counts the misses that waited on another caller's computation instead of
+        starting their own.
+        """
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "evictions": self.evictions,
+                "in_flight": len(self.flights),
+            }
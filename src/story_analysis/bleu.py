@@ -0,0 +1,282 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import argparse
+import math
+import multiprocessing
+
+import numpy as np
+
+MAX_ORDER = 4
+WEIGHTS = (0.25, 0.25, 0.25, 0.25)
+
+# Smoothing constant of NLTK's SmoothingFunction (k=5), used by method 4
+SMOOTHING_K = 5
+
+# Odd 64-bit multiplier for the polynomial n-gram hash (arithmetic wraps modulo 2**64)
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def tokenize(text):
+    """
+    Split a text into tokens the way the analysis notebook does (whitespace split).
+    """
+    return str(text).split()
+
+
+class NgramIndex:
+    """
+    Hashed n-gram counts for a corpus, tokenized once and stored as sparse matrices.
+
+    Every distinct n-gram becomes a column and every text a row. Clipped match counts between
+    two texts, sum(min(count_a, count_b)), are computed as sums of products of binary "count
+    is at least t" layers, so matches for many pairs at once are sparse matrix products.
+    """
+
+    def __init__(self, texts, max_order=MAX_ORDER):
+        """
+        Parameters:
+        - texts (list): Texts (str) or already tokenized texts (lists of tokens).
+        - max_order (int): Largest n-gram order.
+        """
+        from scipy import sparse
+
+        self.max_order = max_order
+        vocabulary = {}
+        token_ids = []
+        for text in texts:
+            tokens = text if isinstance(text, list) else tokenize(text)
+            token_ids.append(np.fromiter((vocabulary.setdefault(token, len(vocabulary)) for token in tokens),
+                                         dtype=np.uint64, count=len(tokens)))
+        self.lengths = np.array([len(ids) for ids in token_ids], dtype=np.int64)
+
+        # layers[n - 1] holds the binary matrices for n-gram order n, one per count threshold
+        self.layers = []
+        for n in range(1, max_order + 1):
+            rows, hashes = [], []
+            for row, ids in enumerate(token_ids):
+                if len(ids) < n:
+                    continue
+                # Polynomial hash of each window of n token ids
+                ngram_hashes = ids[:len(ids) - n + 1].copy()
+                for offset in range(1, n):
+                    ngram_hashes = ngram_hashes * _HASH_MULTIPLIER + ids[offset:len(ids) - n + 1 + offset]
+                rows.append(np.full(len(ngram_hashes), row, dtype=np.int64))
+                hashes.append(ngram_hashes)
+            if not hashes:
+                self.layers.append([])
+                continue
+            _, columns = np.unique(np.concatenate(hashes), return_inverse=True)
+            counts = sparse.csr_matrix(
+                (np.ones(len(columns), dtype=np.int32), (np.concatenate(rows), columns.ravel())),
+                shape=(len(token_ids), int(columns.max()) + 1),
+            )
+            counts.sum_duplicates()
+            layers = []
+            threshold = 1
+            while counts.nnz:
+                layers.append((counts >= threshold).astype(np.float32).tocsr())
+                counts = counts.multiply(counts > threshold).tocsr()
+                counts.eliminate_zeros()
+                threshold += 1
+            self.layers.append(layers)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def matches(self, hypotheses, references):
+        """
+        Return clipped n-gram matches for every (hypothesis, reference) combination.
+
+        Returns:
+        - np.ndarray: Shape (max_order, len(hypotheses), len(references)).
+        """
+        result = np.zeros((self.max_order, len(hypotheses), len(references)), dtype=np.float64)
+        for order, layers in enumerate(self.layers):
+            for layer in layers:
+                result[order] += (layer[hypotheses] @ layer[references].T).toarray()
+        return result
+
+    def paired_matches(self, hypotheses, references):
+        """
+        Return clipped n-gram matches for each (hypotheses[i], references[i]) pair.
+
+        Returns:
+        - np.ndarray: Shape (max_order, len(hypotheses)).
+        """
+        result = np.zeros((self.max_order, len(hypotheses)), dtype=np.float64)
+        for order, layers in enumerate(self.layers):
+            for layer in layers:
+                result[order] += np.asarray(layer[hypotheses].multiply(layer[references]).sum(axis=1)).ravel()
+        return result
+
+
+def bleu_from_counts(matches, hyp_lengths, ref_lengths, weights=WEIGHTS):
+    """
+    Sentence-level BLEU with NLTK's smoothing method 4, from clipped match counts.
+
+    Gives the same scores as `nltk.translate.bleu_score.sentence_bleu` with one reference and
+    `SmoothingFunction().method4`, for any number of pairs at once.
+
+    Parameters:
+    - matches (np.ndarray): Clipped matches per n-gram order, shape (orders, ...).
+    - hyp_lengths (np.ndarray): Hypothesis lengths, broadcastable to matches[0].
+    - ref_lengths (np.ndarray): Reference lengths, broadcastable to matches[0].
+
+    Returns:
+    - np.ndarray: BLEU scores, shaped like matches[0].
+    """
+    hyp_lengths = np.broadcast_to(np.asarray(hyp_lengths, dtype=np.float64), matches.shape[1:])
+    ref_lengths = np.broadcast_to(np.asarray(ref_lengths, dtype=np.float64), matches.shape[1:])
+    log_length = np.log(np.maximum(hyp_lengths, 1.0))
+    smoothable = hyp_lengths > 1
+
+    log_sum = np.zeros(matches.shape[1:])
+    zeros_so_far = np.zeros(matches.shape[1:])
+    for order, weight in enumerate(weights, start=1):
+        numerator = matches[order - 1]
+        denominator = np.maximum(1.0, hyp_lengths - order + 1)
+        is_zero = numerator == 0
+        # Method 4: the c-th zero precision becomes ln(hyp_len) / (2**c * k) / denominator
+        zeros_so_far = zeros_so_far + (is_zero & smoothable)
+        smoothed = log_length / (2.0 ** zeros_so_far * SMOOTHING_K) / denominator
+        precision = np.where(is_zero, np.where(smoothable, smoothed, 0.0), numerator / denominator)
+        # Precisions left at zero are skipped, as in NLTK
+        with np.errstate(divide="ignore"):
+            log_sum += np.where(precision > 0, weight * np.log(np.where(precision > 0, precision, 1.0)), 0.0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        brevity_penalty = np.where(hyp_lengths > ref_lengths, 1.0,
+                                   np.where(hyp_lengths == 0, 0.0, np.exp(1 - ref_lengths / np.maximum(hyp_lengths, 1.0))))
+    scores = brevity_penalty * np.exp(log_sum)
+    # No unigram match at all scores 0
+    return np.where(matches[0] == 0, 0.0, scores)
+
+
+def sentence_bleu(reference, hypothesis):
+    """
+    BLEU of one hypothesis against one reference, as the notebook's `compute_bleu(reference, candidate)`.
+    """
+    return float(paired_bleu([reference], [hypothesis])[0])
+
+
+def paired_bleu(references, hypotheses):
+    """
+    BLEU of each hypothesis against its own reference (e.g. each generated story against the human story).
+
+    Parameters:
+    - references (list): Reference texts.
+    - hypotheses (list): Hypothesis texts, one per reference.
+
+    Returns:
+    - np.ndarray: One BLEU score per pair.
+    """
+    if len(references) != len(hypotheses):
+        raise ValueError("References and hypotheses must have the same length.")
+    index = NgramIndex(list(hypotheses) + list(references))
+    hyp_rows = np.arange(len(hypotheses))
+    ref_rows = hyp_rows + len(hypotheses)
+    matches = index.paired_matches(hyp_rows, ref_rows)
+    return bleu_from_counts(matches, index.lengths[hyp_rows], index.lengths[ref_rows])
+
+
+_worker_index = None
+
+
+def _init_worker(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _self_bleu_block(bounds):
+    # Sum of BLEU over the pairs whose hypothesis (the later text) falls in rows [start, end)
+    start, end = bounds
+    index = _worker_index
+    hyp_rows = np.arange(start, end)
+    ref_rows = np.arange(0, end - 1)
+    if len(ref_rows) == 0:
+        return 0.0
+    scores = bleu_from_counts(index.matches(hyp_rows, ref_rows),
+                              index.lengths[hyp_rows][:, None], index.lengths[ref_rows][None, :])
+    # Only earlier texts are references, as in the notebook's pairs i < j
+    earlier = ref_rows[None, :] < hyp_rows[:, None]
+    return float(scores[earlier].sum())
+
+
+def self_bleu(texts, processes=1, block_size=256):
+    """
+    Exact self-BLEU: the mean BLEU over all pairs i < j, with text i as the reference and text j
+    as the hypothesis, as the notebook's `compute_self_bleu`.
+
+    Parameters:
+    - texts (list): Texts of the corpus.
+    - processes (int): Worker processes; rows are split into blocks shared between them.
+    - block_size (int): Hypotheses scored per block; memory grows with block_size x len(texts).
+
+    Returns:
+    - float: The mean BLEU, or NaN for fewer than two texts.
+    """
+    num_texts = len(texts)
+    if num_texts < 2:
+        return float("nan")
+    index = NgramIndex(texts)
+    blocks = [(start, min(start + block_size, num_texts)) for start in range(1, num_texts, block_size)]
+    if processes > 1:
+        with multiprocessing.get_context().Pool(processes, initializer=_init_worker, initargs=(index,)) as pool:
+            total = sum(pool.imap_unordered(_self_bleu_block, blocks))
+    else:
+        _init_worker(index)
+        total = sum(_self_bleu_block(block) for block in blocks)
+    return total / (num_texts * (num_texts - 1) / 2)
+
+
+def estimate_self_bleu(texts, num_pairs=100000, seed=0):
+    """
+    Estimate self-BLEU from a uniform sample of pairs, for corpora too large for `self_bleu`.
+
+    Returns:
+    - tuple: (estimate, standard_error). With at least as many pairs as exist, the exact value
+      and a standard error of 0.
+    """
+    num_texts = len(texts)
+    total_pairs = num_texts * (num_texts - 1) // 2
+    if num_texts < 2:
+        return float("nan"), float("nan")
+    if num_pairs >= total_pairs:
+        return self_bleu(texts), 0.0
+
+    rng = np.random.default_rng(seed)
+    first = rng.integers(0, num_texts, size=num_pairs)
+    second = rng.integers(0, num_texts - 1, size=num_pairs)
+    second += second >= first  # Uniform over ordered pairs of distinct texts
+    references, hypotheses = np.minimum(first, second), np.maximum(first, second)
+
+    index = NgramIndex(texts)
+    matches = index.paired_matches(hypotheses, references)
+    scores = bleu_from_counts(matches, index.lengths[hypotheses], index.lengths[references])
+    return float(scores.mean()), float(scores.std(ddof=1) / math.sqrt(num_pairs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute BLEU against a reference column and self-BLEU of generated stories in a CSV.")
+    parser.add_argument("--input_csv", type=str, required=True, help="CSV with the stories.")
+    parser.add_argument("--columns", type=str, required=True, help="Comma-separated columns of generated stories.")
+    parser.add_argument("--reference_column", type=str, default="Human Story", help="Column with the reference stories for BLEU.")
+    parser.add_argument("--sample_pairs", type=int, default=None, help="Estimate self-BLEU from this many sampled pairs instead of all pairs.")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes for exact self-BLEU.")
+    args = parser.parse_args()
+
+    import pandas as pd  # Deferred so --help stays fast
+
+    df = pd.read_csv(args.input_csv)
+    for column in args.columns.split(","):
+        rows = df[[args.reference_column, column]].dropna()
+        bleu_scores = paired_bleu(rows[args.reference_column].tolist(), rows[column].tolist())
+        stories = rows[column].tolist()
+        if args.sample_pairs:
+            score, standard_error = estimate_self_bleu(stories, args.sample_pairs)
+            self_bleu_text = f"{score:.4f} ± {1.96 * standard_error:.4f} (95% CI, {args.sample_pairs} pairs)"
+        else:
+            self_bleu_text = f"{self_bleu(stories, processes=args.processes):.4f}"
+        print(f"{column}: BLEU {bleu_scores.mean():.4f} over {len(bleu_scores)} rows, self-BLEU {self_bleu_text}")
@@ -0,0 +1,214 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import argparse
+import math
+import threading
+import time
+
+import numpy as np
+
+from src.llm_cache import LLMCache
+
+MODEL_NAME = "gpt2"
+DEFAULT_CACHE_PATH = os.path.expanduser("~/.cache/autopromptgenie/perplexity.sqlite")
+
+_models = {}
+_model_lock = threading.Lock()
+
+
+def get_model(model_name=MODEL_NAME):
+    """
+    Return (model, tokenizer) for a causal language model, loading them on first use.
+
+    torch and transformers are imported here rather than at module import, so importing this
+    module for --help or the cache stays fast.
+    """
+    if model_name not in _models:
+        with _model_lock:
+            if model_name not in _models:
+                from transformers import AutoModelForCausalLM, AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(model_name)
+                model = AutoModelForCausalLM.from_pretrained(model_name)
+                model.eval()
+                _models[model_name] = (model, tokenizer)
+    return _models[model_name]
+
+
+def _windows(num_tokens, max_length, stride):
+    """
+    Split a text of `num_tokens` tokens into (start, end, first_scored) windows.
+
+    Each window holds at most `max_length` tokens and scores only the tokens the previous
+    window did not, so every token after the first is predicted exactly once, with up to
+    `max_length - stride` tokens of context carried over from before the window. This needs
+    `stride < max_length`: a window's first token has no context inside it.
+    """
+    windows = []
+    previous_end = 0
+    for start in range(0, num_tokens, stride):
+        end = min(start + max_length, num_tokens)
+        # The first token of a window has no context inside it and cannot be scored there
+        windows.append((start, end, max(previous_end, start + 1)))
+        previous_end = end
+        if end == num_tokens:
+            break
+    return windows
+
+
+def token_perplexities(token_ids, model, max_length=None, stride=512, batch_tokens=2048, logits_rows=1024, pad_token_id=0):
+    """
+    Compute the perplexity of already tokenized texts with a causal language model.
+
+    Windows from all texts are sorted by length and packed into batches of about `batch_tokens`
+    padded tokens, so little work is spent on padding. Padding and context-only tokens are
+    masked out of the loss, and the output projection is only applied to the scored positions,
+    `logits_rows` at a time, which keeps memory bounded on CPU.
+
+    Parameters:
+    - token_ids (list): One list of token ids per text.
+    - model: A Hugging Face causal LM (e.g. GPT2LMHeadModel).
+    - max_length (int): Tokens per window; defaults to the model's context size.
+    - stride (int): Tokens between window starts; longer texts are scored with sliding windows.
+    - batch_tokens (int): Approximate padded tokens per forward pass.
+    - logits_rows (int): Positions projected to vocabulary logits at once.
+    - pad_token_id (int): Id used for padding; it is masked out, so any valid id works.
+
+    Returns:
+    - np.ndarray: Perplexity per text; NaN for texts with fewer than two tokens.
+    """
+    import torch
+    import torch.nn.functional as F
+
+    max_length = max_length or model.config.n_positions
+    # Consecutive windows overlap by at least one token, so no window starts on an unscored token
+    stride = max(1, min(stride, max_length - 1))
+    windows = [(text, start, end, first_scored)
+               for text, ids in enumerate(token_ids) if len(ids) > 1
+               for start, end, first_scored in _windows(len(ids), max_length, stride)]
+    windows.sort(key=lambda window: window[2] - window[1])
+
+    nll_sums = np.zeros(len(token_ids))
+    scored_counts = np.zeros(len(token_ids))
+    base_model = model.base_model
+    output_layer = model.get_output_embeddings()
+
+    with torch.inference_mode():
+        batch_start = 0
+        while batch_start < len(windows):
+            # Windows are sorted by length, so the last one in a batch sets its padded width
+            batch_end = batch_start + 1
+            while batch_end < len(windows) and (batch_end - batch_start + 1) * (windows[batch_end][2] - windows[batch_end][1]) <= batch_tokens:
+                batch_end += 1
+            batch = windows[batch_start:batch_end]
+            width = batch[-1][2] - batch[-1][1]
+
+            input_ids = torch.full((len(batch), width), pad_token_id, dtype=torch.long)
+            attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+            scored = torch.zeros((len(batch), width), dtype=torch.bool)
+            for row, (text, start, end, first_scored) in enumerate(batch):
+                input_ids[row, :end - start] = torch.as_tensor(token_ids[text][start:end], dtype=torch.long)
+                attention_mask[row, :end - start] = 1
+                scored[row, first_scored - start:end - start] = True
+
+            hidden = base_model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+            # The token at position t is predicted from the hidden state at t - 1
+            rows, positions = scored[:, 1:].nonzero(as_tuple=True)
+            targets = input_ids[rows, positions + 1]
+            predictors = hidden[rows, positions]
+            nll = torch.cat([
+                F.cross_entropy(output_layer(predictors[i:i + logits_rows]).float(), targets[i:i + logits_rows], reduction="none")
+                for i in range(0, len(targets), logits_rows)
+            ]) if len(targets) else torch.zeros(0)
+
+            owners = torch.as_tensor([text for text, _, _, _ in batch])[rows].numpy()
+            np.add.at(nll_sums, owners, nll.double().numpy())
+            np.add.at(scored_counts, owners, 1)
+            batch_start = batch_end
+
+    with np.errstate(invalid="ignore"):
+        return np.where(scored_counts > 0, np.exp(nll_sums / np.maximum(scored_counts, 1)), np.nan)
+
+
+class PerplexityScorer:
+    """
+    Scores texts with a causal language model, consulting a persistent per-text cache first.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, stride=512, batch_tokens=2048, cache_path=DEFAULT_CACHE_PATH):
+        """
+        Parameters:
+        - model_name (str): Hugging Face model name.
+        - stride (int): Sliding window stride for texts longer than the model's context.
+        - batch_tokens (int): Approximate padded tokens per forward pass.
+        - cache_path (str): SQLite file caching scores across runs; None disables the cache.
+        """
+        self.model_name = model_name
+        self.stride = stride
+        self.batch_tokens = batch_tokens
+        self.cache = LLMCache(cache_path) if cache_path else None
+
+    def _key(self, text, max_length):
+        return LLMCache.make_key(f"perplexity:stride={self.stride}", text, self.model_name, None, max_length)
+
+    def score(self, texts):
+        """
+        Return the perplexity of each text (NaN for missing texts or texts shorter than two tokens).
+        """
+        results = np.full(len(texts), np.nan)
+        model, tokenizer = get_model(self.model_name)
+        max_length = model.config.n_positions
+
+        # Each distinct text is scored once, and only if the cache does not have it
+        pending = {}
+        for i, text in enumerate(texts):
+            if not isinstance(text, str):
+                continue
+            cached = self.cache.get(self._key(text, max_length)) if self.cache is not None else None
+            if cached is not None:
+                results[i] = float(cached)
+            else:
+                pending.setdefault(text, []).append(i)
+
+        if pending:
+            unique_texts = list(pending)
+            token_ids = tokenizer(unique_texts)["input_ids"]
+            pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+            scores = token_perplexities(token_ids, model, max_length=max_length, stride=self.stride,
+                                        batch_tokens=self.batch_tokens, pad_token_id=pad_token_id or 0)
+            for text, score in zip(unique_texts, scores):
+                results[pending[text]] = score
+                if self.cache is not None and not math.isnan(score):
+                    self.cache.put(self._key(text, max_length), repr(float(score)))
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add perplexity columns for the story columns of a result CSV.")
+    parser.add_argument("--input_csv", type=str, required=True, help="CSV with the stories.")
+    parser.add_argument("--columns", type=str, required=True, help="Comma-separated story columns, e.g. \"Human Story,Generated Story\".")
+    parser.add_argument("--output_csv", type=str, default=None, help="Output CSV with a '<column>_perplexity' column per story column (default: overwrite the input).")
+    parser.add_argument("--model", type=str, default=MODEL_NAME, help="Hugging Face causal language model.")
+    parser.add_argument("--stride", type=int, default=512, help="Sliding window stride for stories longer than the model's context.")
+    parser.add_argument("--batch_tokens", type=int, default=2048, help="Approximate padded tokens per forward pass.")
+    parser.add_argument("--cache_path", type=str, default=DEFAULT_CACHE_PATH, help="SQLite file caching scores across runs.")
+    parser.add_argument("--no_cache", action="store_true", help="Score every story again instead of using the cache.")
+    args = parser.parse_args()
+
+    import pandas as pd  # Deferred so --help stays fast
+
+    df = pd.read_csv(args.input_csv)
+    scorer = PerplexityScorer(args.model, stride=args.stride, batch_tokens=args.batch_tokens,
+                              cache_path=None if args.no_cache else args.cache_path)
+    for column in args.columns.split(","):
+        start_time = time.time()
+        df[f"{column}_perplexity"] = scorer.score(df[column].tolist())
+        print(f"{column}: mean perplexity {df[f'{column}_perplexity'].mean():.2f} over {df[column].notna().sum()} stories "
+              f"in {time.time() - start_time:.1f}s")
+
+    output_csv = args.output_csv or args.input_csv
+    df.to_csv(output_csv, index=False)
+    if scorer.cache is not None:
+        print(f"Perplexity cache: {scorer.cache.stats()}")
+    print(f"Results saved to '{output_csv}'.")
@@ -3,17 +3,11 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import argparse
-import pandas as pd
 from typing import List
 import time
-from src.utils import generate_story_with_cohere, calculate_average_scores
-
-from dotenv import load_dotenv
-# Load environment variables from .env file
-load_dotenv()
-
-# Initialize the Cohere client with the API key from env.
-cohere_api_key = os.getenv("COHERE_API_KEY")
+from src.utils import evaluate_story_rows
+from src.rate_control import RateController
+from src.llm_client import get_api_key
 
 
 
@@ -21,6 +15,9 @@ def evaluate_stories(
     input_csv: str,
     output_csv: str,
     cohere_api_key: str,
+    requests_per_minute: float = 20,
+    max_concurrency: int = 4,
+    max_requests_per_minute: float = 600,
 ):
     """
     Evaluates stories from a CSV file by generating stories using a prompt, scoring them, and saving the results.
@@ -29,37 +26,31 @@ def evaluate_stories(
         input_csv (str): Path to the input CSV containing prompts and human stories.
         output_csv (str): Path to save the output CSV.
         cohere_api_key (str): API key for the Cohere service.
+        requests_per_minute (float): Starting request rate; the rate controller probes upwards from here.
+        max_concurrency (int): Maximum number of rows evaluated concurrently.
+        max_requests_per_minute (float): Ceiling the rate controller may probe up to.
 
     Returns:
         None
     """
+    import pandas as pd  # Deferred so importing this module (e.g. for --help) stays fast
+
     # Read the input CSVs
     df = pd.read_csv(input_csv)
 
-    # Initialize output lists
-    output_scores_human = []
-    output_scores_gen = []
-    generated_stories = []
-    latencies = []
-
-    # Iterate through each row in the CSV
-    for index, row in df.iterrows():
-        # Generate stories and calculate scores
-        start_time = time.time()
-        prompt = row['Starting Prompt']
-        human_story = row['Human Story']
-        generated_story = generate_story_with_cohere(row['Best Prompt'], cohere_api_key) # Generated prompt is the best ranked prompt
-        scores = calculate_average_scores(prompt, human_story, generated_story, cohere_api_key)
-        latency = time.time() - start_time
-
-        # Append results
-        generated_stories.append(generated_story)
-        output_scores_human.append(scores['average_scores_story_1'])
-        output_scores_gen.append(scores['average_scores_story_2'])
-        latencies.append(latency)
-
-        # Optional delay to avoid API rate limits
-        time.sleep(30)
+    # Shared throttle replacing the fixed per-row delay; it adapts to the upstream rate limit
+    rate_controller = RateController(requests_per_minute=requests_per_minute, max_requests_per_minute=max_requests_per_minute,
+                                     max_concurrency=max_concurrency)
+
+    # Generate stories and calculate scores for every row
+    rows = zip(df['Starting Prompt'], df['Human Story'], df['Best Prompt'])
+    results = evaluate_story_rows(rows, cohere_api_key, rate_controller)
+    print(f"Rate controller: {rate_controller.stats()}")
+
+    generated_stories = [generated_story for generated_story, _, _ in results]
+    output_scores_human = [scores['average_scores_story_1'] for _, scores, _ in results]
+    output_scores_gen = [scores['average_scores_story_2'] for _, scores, _ in results]
+    latencies = [latency for _, _, latency in results]
 
     # Update the DataFrame with results
     df["Human Story Score"] = output_scores_human
@@ -76,6 +67,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate and evaluate stories based on best prompt using ranking post generation.")
     parser.add_argument("--input_csv", type=str, required=True, help="Path to the input CSV file containing prompts.")
     parser.add_argument("--output_csv", type=str, required=True, help="Path to the output CSV file to save results.")
+    parser.add_argument("--requests_per_minute", type=float, default=20, help="Starting API request rate; adapted to the upstream limit at runtime.")
+    parser.add_argument("--max_concurrency", type=int, default=4, help="Maximum number of rows evaluated concurrently.")
+    parser.add_argument("--max_requests_per_minute", type=float, default=600, help="Ceiling for the adapted request rate; set it to your upstream quota.")
 
     args = parser.parse_args()
 
@@ -89,7 +83,8 @@ if __name__ == "__main__":
 
     try:
         print("Starting to evaluate generated stories...")
-        evaluate_stories(input_csv, output_csv, cohere_api_key)
+        evaluate_stories(input_csv, output_csv, get_api_key(), args.requests_per_minute, args.max_concurrency,
+                         args.max_requests_per_minute)
         print(f"Evaluation completed. Results saved to '{output_csv}'.")
     except Exception as e:
         print(f"An error occurred during evaluation: {e}")
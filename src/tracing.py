@@ -0,0 +1,197 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+# Spans buffered before the sink is written to
+FLUSH_EVERY = 256
+
+
+class _NoopSpan:
+    """
+    Span returned while tracing is disabled; every operation is a no-op.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    A timed operation with attributes, written to the trace sink when it ends.
+
+    Spans opened inside another span on the same thread become its children and inherit its
+    trace id and "stage" attribute.
+    """
+
+    __slots__ = ("tracer", "name", "attributes", "trace_id", "span_id", "parent", "stack", "start_ns", "start_perf")
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        stack = self.stack = self.tracer.stack()
+        self.parent = stack[-1] if stack else None
+        self.span_id = os.urandom(8).hex()
+        if self.parent is not None:
+            self.trace_id = self.parent.trace_id
+            if "stage" in self.parent.attributes:
+                self.attributes.setdefault("stage", self.parent.attributes["stage"])
+        else:
+            self.trace_id = os.urandom(16).hex()
+        stack.append(self)
+        self.start_ns = time.time_ns()
+        self.start_perf = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ns = time.perf_counter_ns() - self.start_perf
+        # A span held open by a generator can be closed from another thread or out of order
+        if self.stack and self.stack[-1] is self:
+            self.stack.pop()
+        elif self in self.stack:
+            self.stack.remove(self)
+        record = {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent.span_id if self.parent is not None else None,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.start_ns + duration_ns,
+            "duration_ms": duration_ns / 1e6,
+            "status": "ERROR" if exc_type is not None else "OK",
+            "attributes": self.attributes,
+        }
+        if exc_type is not None:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer.emit(record)
+        return False
+
+    def set(self, **attributes):
+        """
+        Add or update attributes, e.g. results only known once the operation has finished.
+        """
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """
+    Writes finished spans as JSON lines. The records use OpenTelemetry's span field names
+    (trace_id, span_id, parent_span_id, start/end_time_unix_nano, status, attributes), so they
+    can be converted or loaded into OTLP tooling as they are.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        atexit.register(self.flush)
+
+    def stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def emit(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self.lock:
+            self.buffer.append(line)
+            if len(self.buffer) >= FLUSH_EVERY:
+                self._write()
+
+    def _write(self):
+        if self.buffer:
+            self.file.write("\n".join(self.buffer) + "\n")
+            self.file.flush()
+            self.buffer = []
+
+    def flush(self):
+        """
+        Write any buffered spans to the sink.
+        """
+        with self.lock:
+            self._write()
+
+
+_tracer = None
+_configured = False
+_lock = threading.Lock()
+
+
+def get_tracer():
+    """
+    Return the process-wide tracer, or None if tracing is disabled.
+
+    Tracing is enabled by setting AUTOPROMPT_TRACE to the path of a JSONL file (the .env file
+    is honoured too); spans from every run are appended to it.
+    """
+    global _tracer, _configured
+    if not _configured:
+        with _lock:
+            if not _configured:
+                from src.llm_client import load_env
+                load_env()
+                path = os.getenv("AUTOPROMPT_TRACE")
+                if path:
+                    _tracer = Tracer(os.path.expanduser(path))
+                _configured = True
+    return _tracer
+
+
+def span(name, **attributes):
+    """
+    Open a span around an operation:
+
+        with span("llm.generate", caller="evaluate_with_cohere") as current:
+            ...
+            current.set(output_tokens=n)
+
+    Returns a shared no-op span when tracing is disabled, so the cost is one function call.
+    """
+    tracer = _tracer if _configured else get_tracer()
+    if tracer is None:
+        return _NOOP_SPAN
+    return Span(tracer, name, attributes)
+
+
+_template_ids = {}
+
+
+def template_id(template):
+    """
+    Return a short, stable identifier for a prompt template (None for untemplated calls).
+    """
+    if template is None:
+        return None
+    identifier = _template_ids.get(template)
+    if identifier is None:
+        import hashlib
+        identifier = _template_ids[template] = hashlib.sha1(template.encode("utf-8")).hexdigest()[:8]
+    return identifier
+
+
+def enabled():
+    """
+    Return True if spans are being recorded, for skipping work that only feeds attributes.
+    """
+    return (_tracer if _configured else get_tracer()) is not None
@@ -1,12 +1,9 @@
-import cohere
-from dotenv import load_dotenv
 import os
 import numpy as np
-# Load environment variables from .env file
-load_dotenv()
-
-# Initialize the Cohere client with the API key from env.
-cohere_api_key = os.getenv("COHERE_API_KEY")
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.llm_client import generate_text
+from src.judge_protocol import STORY_SCHEMA, judge, stats as judge_stats
 
 
 def generate_story_with_cohere(input_prompt, cohere_api_key, temperature=0.2):
@@ -22,39 +19,18 @@ def generate_story_with_cohere(input_prompt, cohere_api_key, temperature=0.2):
     Returns:
     - str: The generated story based on the input prompt.
     """
-    co = cohere.Client(cohere_api_key)
     final_prompt = "Choose branches from the following prompt structure to create an interesting story: " + input_prompt+ "The result should include the final story and not the structure. The final story should be around 500 words"
      
-    # Generate the story
-    response = co.generate(
-        prompt=final_prompt,
-        temperature=temperature,
-    )
-    
-    # Extract the generated story from the response
-    generated_story = response.generations[0].text.strip()
+    # Generate the story (served from the cache only if sampled calls are opted in)
+    generated_story = generate_text(final_prompt, temperature=temperature, api_key=cohere_api_key)
     
     return generated_story
 
-def evaluate_with_cohere(prompt, story, cohere_api_key):
-    """
-    Evaluate a submission based on predefined metrics using Cohere's API.
-    
-    Parameters:
-    - prompt (str): The prompt given for the story.
-    - story (str): The story submission to evaluate.
-    - cohere_api_key (str): Your Cohere API key.
-    
-    Returns:
-    - dict: A dictionary containing evaluation scores for each metric.
-    """
-    co = cohere.Client(cohere_api_key)
-    
-    # Define the evaluation template
-    template = """
+# Story judge: a 0/1 score per metric for a single submission
+STORY_JUDGE_TEMPLATE = """
     You are an evaluator. I will provide you with a prompt and a submission. 
     I will also provide a question for each of those metrics, and you will return 1 if the answer is positive, 
-    0 if negative, as a score for that metric. Just answer with the name of the metric and the score, nothing else.
+    0 if negative, as a score for that metric. {instruction}
     
     Prompt: 
     {prompt}
@@ -63,49 +39,27 @@ def evaluate_with_cohere(prompt, story, cohere_api_key):
     {story}
     
     Metrics:
-    Helpfulness: Does the story contribute to the plot, character development, or themes?
-    Directness: Does the story stay focused and move the plot forward?
-    Grammaticality: Is the story grammatically correct and easy to read?
-    Relevance: Does the story stay on-topic and relevant to its theme or prompt?
-    Edge: Does the story include unique or surprising elements?
-    Supposition: Does the story explore hypothetical situations or provoke analysis?
-    Creativity: How original and imaginative is the story?
-    Coherence: Is the language in the story coherent for the reader?
+{metrics}
     """
-    
-    # Format the template with the actual prompt and stories
-    formatted_prompt = template.format(prompt=prompt, story=story)
-    
-    # Generate the evaluation using Cohere
-    response = co.generate(
-        prompt=formatted_prompt,
-        max_tokens=500,  # Enough tokens to evaluate all metrics
-        temperature=0.01
-    )
-    
-    evaluation = response.generations[0].text.strip()
-    
-    # Parse the response into a dictionary (assuming it's in a structured format)
-    # Example expected output:
-    # Helpfulness: 1
-    # Directness: 0
-    # Grammaticality: 1
-    # Relevance: 1
-    # Edge: 0
-    # Supposition: 1
-    # Creativity: 0
-    # Coherence: 1
-    scores = {}
-    try:
-        for line in evaluation.split('\n'):
-            metric, score = line.split(": ")
-            scores[metric] = int(score)
-    except ValueError as e:
-        print(f"Error parsing line: {line} | Exception: {e}")
-        scores[line] = None  # Insert None for lines that don't match the expected format
 
+def evaluate_with_cohere(prompt, story, cohere_api_key):
+    """
+    Evaluate a submission based on predefined metrics using Cohere's API.
+    
+    Parameters:
+    - prompt (str): The prompt given for the story.
+    - story (str): The story submission to evaluate.
+    - cohere_api_key (str): Your Cohere API key.
     
-    return scores
+    Returns:
+    - dict: A dictionary containing evaluation scores for each metric; NaN for a metric the
+      judge did not score even when asked again.
+    """
+    # Format the template with the actual prompt and story, and parse the JSON judgement
+    # (cached, as the judge is effectively deterministic)
+    return judge(STORY_JUDGE_TEMPLATE, {"prompt": prompt, "story": story}, STORY_SCHEMA,
+                 max_tokens=500,  # Enough tokens to evaluate all metrics
+                 api_key=cohere_api_key)
 
 
 """
@@ -118,9 +72,9 @@ def calculate_average_scores(prompt, story_1, story_2, cohere_api_key):
     story_1_scores_array = np.array(list(story_1_scores.values()))
     story_2_scores_array = np.array(list(story_2_scores.values()))
     
-    # Calculate average scores for each story
-    avg_scores_story_1 = np.mean(story_1_scores_array)
-    avg_scores_story_2 = np.mean(story_2_scores_array)
+    # Calculate average scores for each story, ignoring metrics the judge left unscored
+    avg_scores_story_1 = np.nanmean(story_1_scores_array)
+    avg_scores_story_2 = np.nanmean(story_2_scores_array)
     
     return {
         "story_1_scores": story_1_scores,
@@ -128,3 +82,43 @@ def calculate_average_scores(prompt, story_1, story_2, cohere_api_key):
         "average_scores_story_1": avg_scores_story_1,
         "average_scores_story_2": avg_scores_story_2
     }
+
+
+def evaluate_story_rows(rows, cohere_api_key, rate_controller):
+    """
+    Generate a story for each row and score it against the human story, throttled by a shared rate controller.
+
+    Rows are processed concurrently, up to the controller's maximum concurrency; the controller
+    decides how many calls are actually in flight and how fast new ones start.
+
+    Parameters:
+    - rows: Iterable of (prompt, human_story, story_prompt) tuples.
+    - cohere_api_key (str): Your Cohere API key.
+    - rate_controller (RateController): Shared throttle for the upstream calls.
+
+    Returns:
+    - list: One (generated_story, scores, latency) tuple per row, in input order. The latency
+      covers the API calls only, not the time spent waiting for the rate controller.
+    """
+    def timed(fn):
+        def wrapper(*args, **kwargs):
+            start_time = time.time()
+            result = fn(*args, **kwargs)
+            return result, time.time() - start_time
+        return wrapper
+
+    def evaluate_row(row):
+        prompt, human_story, story_prompt = row
+        generated_story, generation_latency = rate_controller.call(
+            timed(generate_story_with_cohere), story_prompt, cohere_api_key
+        )
+        # Scoring makes two judge calls, one per story
+        scores, scoring_latency = rate_controller.call(
+            timed(calculate_average_scores), prompt, human_story, generated_story, cohere_api_key, cost=2
+        )
+        return generated_story, scores, generation_latency + scoring_latency
+
+    with ThreadPoolExecutor(max_workers=rate_controller.max_concurrency) as executor:
+        results = list(executor.map(evaluate_row, rows))
+    print(f"Judge protocol: {judge_stats()}")
+    return results
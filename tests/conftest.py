@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the project the way its scripts do, as the `src` and `app` packages
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,59 @@
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+nltk_bleu = pytest.importorskip('nltk.translate.bleu_score')
+
+from src.story_analysis.bleu import estimate_self_bleu, paired_bleu, self_bleu, sentence_bleu
+
+VOCABULARY = 'the a dragon knight castle ran slept over under quietly red old sea storm'.split()
+
+
+def random_texts(count, seed, min_words=1, max_words=30):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(min_words, max_words))) for _ in range(count)]
+
+
+def reference_bleu(reference, hypothesis):
+    # The analysis notebook's score: NLTK sentence BLEU with smoothing method 4
+    return nltk_bleu.sentence_bleu([reference.split()], hypothesis.split(),
+                                   smoothing_function=nltk_bleu.SmoothingFunction().method4)
+
+
+def test_paired_bleu_matches_nltk_method4():
+    references = random_texts(60, seed=1)
+    hypotheses = random_texts(60, seed=2)
+    expected = [reference_bleu(reference, hypothesis) for reference, hypothesis in zip(references, hypotheses)]
+    np.testing.assert_allclose(paired_bleu(references, hypotheses), expected, rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize('reference, hypothesis', [
+    ('the old knight slept under the red castle', 'the old knight slept under the red castle'),
+    ('the old knight slept', 'a dragon ran over the sea'),
+    ('the dragon ran over the old castle quietly', 'dragon'),
+    ('dragon', 'the dragon ran over the old castle quietly'),
+    ('the dragon ran', 'the dragon ran over'),
+])
+def test_sentence_bleu_edge_cases_match_nltk(reference, hypothesis):
+    assert sentence_bleu(reference, hypothesis) == pytest.approx(reference_bleu(reference, hypothesis), abs=1e-12)
+
+
+def test_self_bleu_matches_pairwise_nltk():
+    texts = random_texts(25, seed=3, min_words=5)
+    expected = np.mean([reference_bleu(texts[i], texts[j]) for i, j in itertools.combinations(range(len(texts)), 2)])
+    assert self_bleu(texts, block_size=7) == pytest.approx(expected, rel=1e-9)
+    assert self_bleu(texts, processes=2, block_size=7) == pytest.approx(expected, rel=1e-9)
+
+
+def test_estimate_self_bleu_is_exact_when_sampling_every_pair():
+    texts = random_texts(10, seed=4, min_words=5)
+    estimate, standard_error = estimate_self_bleu(texts, num_pairs=45)
+    assert estimate == pytest.approx(self_bleu(texts))
+    assert standard_error == 0.0
+
+
+def test_paired_bleu_rejects_mismatched_lengths():
+    with pytest.raises(ValueError):
+        paired_bleu(['a b'], [])
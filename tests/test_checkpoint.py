@@ -0,0 +1,80 @@
+import csv
+
+import pytest
+
+from src.checkpoint import CheckpointWriter, row_key
+
+HEADER = ['Prompt', 'Score']
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as file:
+        return list(csv.reader(file))
+
+
+def interrupted_run(output_csv, rows):
+    # Write rows without finalizing, as a crashed run leaves them
+    writer = CheckpointWriter(output_csv, HEADER)
+    for prompt, score in rows:
+        writer.write(row_key(prompt), [prompt, score])
+    writer.file.close()
+    return writer.partial_csv
+
+
+def test_row_key_is_stable_and_distinguishes_rows():
+    assert row_key(0, 'a', 'b') == row_key(0, 'a', 'b')
+    assert row_key(0, 'a', 'b') != row_key(1, 'a', 'b')
+
+
+def test_finalize_writes_output_without_key_column(tmp_path):
+    output_csv = str(tmp_path / 'out.csv')
+    writer = CheckpointWriter(output_csv, HEADER)
+    writer.write(row_key('a'), ['a', 1])
+    writer.write(row_key('b'), ['b', 2])
+    writer.finalize()
+
+    assert read_csv(output_csv) == [HEADER, ['a', '1'], ['b', '2']]
+    assert not (tmp_path / 'out.csv.partial').exists()
+
+
+def test_resume_skips_completed_rows_and_drops_a_truncated_last_row(tmp_path):
+    output_csv = str(tmp_path / 'out.csv')
+    partial_csv = interrupted_run(output_csv, [('a', 1), ('b', 2)])
+    with open(partial_csv, 'a', encoding='utf-8') as file:
+        file.write(f'{row_key("c")},"c unterminated')
+
+    writer = CheckpointWriter(output_csv, HEADER, resume=True)
+    assert writer.is_done(row_key('a')) and writer.is_done(row_key('b'))
+    assert not writer.is_done(row_key('c'))
+    writer.write(row_key('c'), ['c', 3])
+    writer.finalize()
+
+    assert read_csv(output_csv) == [HEADER, ['a', '1'], ['b', '2'], ['c', '3']]
+
+
+def test_resume_rejects_a_partial_file_with_another_header(tmp_path):
+    output_csv = str(tmp_path / 'out.csv')
+    interrupted_run(output_csv, [('a', 1)])
+    with pytest.raises(ValueError, match='different header'):
+        CheckpointWriter(output_csv, HEADER + ['Latency'], resume=True)
+
+
+def test_existing_partial_file_is_not_truncated_without_resume(tmp_path):
+    output_csv = str(tmp_path / 'out.csv')
+    partial_csv = interrupted_run(output_csv, [('a', 1)])
+    before = read_csv(partial_csv)
+
+    with pytest.raises(FileExistsError, match='--resume'):
+        CheckpointWriter(output_csv, HEADER)
+    assert read_csv(partial_csv) == before
+
+
+def test_overwrite_discards_the_partial_file(tmp_path):
+    output_csv = str(tmp_path / 'out.csv')
+    interrupted_run(output_csv, [('a', 1)])
+
+    writer = CheckpointWriter(output_csv, HEADER, overwrite=True)
+    assert not writer.is_done(row_key('a'))
+    writer.write(row_key('b'), ['b', 2])
+    writer.finalize()
+    assert read_csv(output_csv) == [HEADER, ['b', '2']]
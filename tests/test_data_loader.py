@@ -0,0 +1,62 @@
+import io
+import json
+
+import pytest
+
+from src.prompt_generation.data_loader import _iter_json_object_items, iter_prompt_story_pairs
+
+DOCUMENT = (
+    '{\n  "A dragon \\"wakes\\"": "It was\\nlate. \\u00e9t\\u00e9 \\ud83d\\udc09 🐉",'
+    '"numbers"  :  12345.678e-2 , "neg":-7,"flags": [true, false, null],'
+    '\t"nested": {"a": [1, {"b": "}"}], "c": "{\\\\"}, "ünïcode ключ": "値", "last": 0\n}\n'
+)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 7, 16, 1 << 16])
+def test_object_items_survive_every_chunk_boundary(chunk_size):
+    items = list(_iter_json_object_items(io.StringIO(DOCUMENT), chunk_size=chunk_size))
+    assert items == list(json.loads(DOCUMENT).items())
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 1 << 16])
+def test_empty_object_yields_nothing(chunk_size):
+    assert list(_iter_json_object_items(io.StringIO(' { \n } '), chunk_size=chunk_size)) == []
+
+
+@pytest.mark.parametrize('document', ['["a", "b"]', '{"a" "b"}', '{"a": "b" "c": "d"}', '{"a": "b",', '{"a": tru}'])
+def test_malformed_documents_raise(document):
+    with pytest.raises(ValueError):
+        list(_iter_json_object_items(io.StringIO(document), chunk_size=2))
+
+
+def test_items_are_yielded_before_the_file_is_read_to_the_end():
+    class CountingFile(io.StringIO):
+        reads = 0
+
+        def read(self, size=-1):
+            self.reads += 1
+            return super().read(size)
+
+    document = '{' + ','.join(f'"prompt {i}": "story {i}"' for i in range(1000)) + '}'
+    file = CountingFile(document)
+    items = _iter_json_object_items(file, chunk_size=64)
+    assert next(items) == ('prompt 0', 'story 0')
+    assert file.reads * 64 < len(document) // 10
+
+
+def test_prompt_story_pairs_from_json_and_jsonl(tmp_path):
+    pairs = [(f'prompt {i}', f'story {i}') for i in range(10)]
+    json_path = tmp_path / 'train.json'
+    json_path.write_text(json.dumps(dict(pairs)), encoding='utf-8')
+    jsonl_path = tmp_path / 'train.jsonl'
+    jsonl_path.write_text('\n'.join([
+        json.dumps({'prompt': 'prompt 0', 'story': 'story 0'}),
+        json.dumps(['prompt 1', 'story 1']),
+        '',
+        json.dumps({'prompt 2': 'story 2'}),
+    ]), encoding='utf-8')
+
+    assert list(iter_prompt_story_pairs(str(json_path))) == pairs
+    assert list(iter_prompt_story_pairs(str(json_path), start=2, limit=3)) == pairs[2:5]
+    assert list(iter_prompt_story_pairs(str(json_path), num_shards=3, shard_index=1)) == pairs[1::3]
+    assert list(iter_prompt_story_pairs(str(jsonl_path))) == pairs[:3]
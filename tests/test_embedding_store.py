@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from src.prompt_ranking.embedding_store import EmbeddingStore
+
+DIM = 4
+
+
+class CountingEncoder:
+    """Deterministic fake encoder that records which texts it was asked to encode."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def __call__(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[len(text), sum(map(ord, text)) % 97, i % 3, 1.0] for i, text in enumerate(texts)])
+
+    def expected(self, texts):
+        return np.array([[len(text), sum(map(ord, text)) % 97] for text in texts], dtype=np.float32)
+
+
+def open_store(tmp_path):
+    return EmbeddingStore(str(tmp_path / 'store' / 'embeddings'), dim=DIM, dtype='float32', model_name='fake')
+
+
+def test_round_trip_encodes_each_text_once(tmp_path):
+    store = open_store(tmp_path)
+    encode = CountingEncoder()
+    texts = ['a dragon', 'a lighthouse', 'a dragon']
+
+    first = store.get_embeddings(texts, encode)
+    assert sorted(encode.encoded) == ['a dragon', 'a lighthouse']
+    assert first.shape == (3, DIM) and first.dtype == np.float32
+    np.testing.assert_array_equal(first[:, :2], encode.expected(texts))
+    np.testing.assert_array_equal(first[0], first[2])
+
+    again = store.get_embeddings(['a lighthouse', 'a dragon'], encode)
+    assert len(encode.encoded) == 2
+    np.testing.assert_array_equal(again, first[[1, 0]])
+    assert store.stats() == {'hits': 2, 'misses': 3, 'entries': 2}
+
+
+def test_lookup_through_the_sorted_index(tmp_path, monkeypatch):
+    # Merge every append into the sorted hash index instead of the dict of recent entries
+    monkeypatch.setattr(EmbeddingStore, 'MERGE_THRESHOLD', 1)
+    store = open_store(tmp_path)
+    encode = CountingEncoder()
+    texts = [f'prompt {i}' for i in range(50)]
+    for start in range(0, 50, 10):
+        store.get_embeddings(texts[start:start + 10], encode)
+    assert store.recent == {} and len(store.sorted_keys) == 50
+
+    shuffled = texts[::-1] + ['a new prompt']
+    embeddings = store.get_embeddings(shuffled, encode)
+    np.testing.assert_array_equal(embeddings[:, :2], encode.expected(shuffled))
+    assert encode.encoded[50:] == ['a new prompt']
+
+
+def test_reopen_and_append(tmp_path):
+    encode = CountingEncoder()
+    store = open_store(tmp_path)
+    first = store.get_embeddings(['one', 'two'], encode)
+
+    reopened = open_store(tmp_path)
+    assert reopened.stats()['entries'] == 2
+    both = reopened.get_embeddings(['two', 'three', 'one'], encode)
+    assert encode.encoded[2:] == ['three']
+    np.testing.assert_array_equal(both[[2, 0]], first)
+    assert open_store(tmp_path).stats()['entries'] == 3
+
+
+def test_reopen_drops_a_partly_written_entry(tmp_path):
+    store = open_store(tmp_path)
+    store.get_embeddings(['one', 'two'], CountingEncoder())
+    with open(store.vectors_path, 'ab') as file:
+        np.zeros(DIM, dtype=np.float32).tofile(file)  # A vector whose key was never written
+
+    reopened = open_store(tmp_path)
+    assert reopened.stats()['entries'] == 2
+    encode = CountingEncoder()
+    reopened.get_embeddings(['three'], encode)
+    assert encode.encoded == ['three']
+    np.testing.assert_array_equal(open_store(tmp_path).get_embeddings(['three'], CountingEncoder())[:, :2],
+                                  encode.expected(['three']))
+
+
+def test_writers_sharing_a_path_see_each_others_rows(tmp_path):
+    # Two store objects on one path stand in for two processes appending to the same files
+    first, second = open_store(tmp_path), open_store(tmp_path)
+    encode = CountingEncoder()
+    first.get_embeddings(['one', 'two'], encode)
+    second.get_embeddings(['two', 'three'], encode)
+    first.get_embeddings(['four'], encode)
+
+    # 'two' was encoded by both, but stored once; every row still matches its own text
+    assert open_store(tmp_path).stats()['entries'] == 4
+    texts = ['one', 'two', 'three', 'four']
+    for store in (first, second, open_store(tmp_path)):
+        np.testing.assert_array_equal(store.get_embeddings(texts, encode)[:, :2], encode.expected(texts))
+
+
+def test_store_refuses_another_model(tmp_path):
+    open_store(tmp_path)
+    with pytest.raises(ValueError, match='was built with'):
+        EmbeddingStore(str(tmp_path / 'store' / 'embeddings'), dim=DIM, dtype='float32', model_name='other')
@@ -0,0 +1,58 @@
+import threading
+import time
+
+from src.prompt_generation.fanout import iter_fanout, run_fanout
+
+
+def test_run_fanout_returns_outcomes_in_job_order():
+    def call(job):
+        if job == 2:
+            raise ValueError('bad job')
+        time.sleep(0.01 * (5 - job))
+        return job * 10
+
+    outcomes = run_fanout(call, list(range(5)), concurrency=3)
+    assert [result for result, _, _ in outcomes] == [0, 10, None, 30, 40]
+    assert isinstance(outcomes[2][2], ValueError)
+
+
+def test_iter_fanout_yields_in_order_and_reads_jobs_lazily():
+    drawn = []
+
+    def jobs():
+        for job in range(20):
+            drawn.append(job)
+            yield job
+
+    outcomes = iter_fanout(lambda job: job * 2, jobs(), concurrency=2, window=4)
+    index, job, result, latency, error = next(outcomes)
+    assert (index, job, result, error) == (0, 0, 0, None)
+    assert len(drawn) <= 4
+    assert [result for _, _, result, _, _ in outcomes] == [job * 2 for job in range(1, 20)]
+
+
+def test_iter_fanout_keeps_concurrency_across_the_whole_input():
+    lock = threading.Lock()
+    in_flight = [0]
+    peaks = []
+
+    def call(job):
+        with lock:
+            in_flight[0] += 1
+            peaks.append(in_flight[0])
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+        return job
+
+    # With fixed batches of 5 the tail of every batch would run with fewer calls in flight
+    list(iter_fanout(call, iter(range(40)), concurrency=4))
+    assert max(peaks) == 4
+    assert peaks.count(4) >= 30
+
+
+def test_iter_fanout_runs_inline_at_concurrency_one():
+    threads = set()
+    results = list(iter_fanout(lambda job: threads.add(threading.get_ident()) or job, range(3)))
+    assert [result for _, _, result, _, _ in results] == [0, 1, 2]
+    assert threads == {threading.get_ident()}
@@ -0,0 +1,103 @@
+import math
+
+import pytest
+
+from src import judge_protocol, llm_client
+from src.judge_protocol import STORY_SCHEMA, JudgeSchema, judge
+
+SCHEMA = JudgeSchema({'Relevance': 'How relevant?', 'Diversity': 'How diverse?', 'Clarity': 'How clear?'}, low=0, high=5)
+TEMPLATE = 'Prompt: {prompt}\n{metrics}\n{instruction}'
+
+
+def test_parse_json_object_with_surrounding_text():
+    scores, missing = SCHEMA.parse('Sure! {"Relevance": 4, "diversity": "2", "Clarity": 5.0} Hope this helps.')
+    assert scores == {'Relevance': 4, 'Diversity': 2, 'Clarity': 5}
+    assert missing == []
+
+
+def test_parse_falls_back_to_metric_lines():
+    response = '**Relevance**: 3\n- Diversity = 1\n"Clarity": "4" (very clear)'
+    assert SCHEMA.parse(response) == ({'Relevance': 3, 'Diversity': 1, 'Clarity': 4}, [])
+
+
+def test_parse_drops_invalid_and_unknown_scores():
+    response = '{"Relevance": 6, "Diversity": 2.5, "Clarity": true, "Humour": 3, "relevance ": -1}'
+    assert SCHEMA.parse(response) == ({}, ['Relevance', 'Diversity', 'Clarity'])
+
+
+def test_parse_keeps_the_first_score_of_a_repeated_metric():
+    assert STORY_SCHEMA.parse('Creativity: 1\nCreativity: 0')[0] == {'Creativity': 1}
+
+
+def test_parse_of_unusable_text_reports_every_metric_missing():
+    assert SCHEMA.parse('I cannot judge this.') == ({}, list(SCHEMA.metrics))
+
+
+class ScriptedJudge:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.prompts = []
+
+    def __call__(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def scripted(monkeypatch):
+    monkeypatch.setattr(llm_client, 'get_cache', lambda: None)
+
+    def install(*responses):
+        scripted_judge = ScriptedJudge(*responses)
+        monkeypatch.setattr(judge_protocol, 'generate_text', scripted_judge)
+        return scripted_judge
+    return install
+
+
+def counters_delta(before):
+    after = judge_protocol.stats()
+    return {name: after[name] - before[name] for name in after if after[name] != before[name]}
+
+
+def test_judge_reasks_only_for_missing_metrics(scripted):
+    scripted_judge = scripted('{"Relevance": 4}', '{"Diversity": 2, "Clarity": 3, "Relevance": 0}')
+    before = judge_protocol.stats()
+
+    assert judge(TEMPLATE, {'prompt': 'a dragon'}, SCHEMA) == {'Relevance': 4, 'Diversity': 2, 'Clarity': 3}
+    reask = scripted_judge.prompts[1]
+    assert judge_protocol.REASK_NOTE in reask
+    assert 'Relevance:' not in reask and 'Diversity:' in reask and 'Clarity:' in reask
+    assert counters_delta(before) == {'judgements': 1, 'partial': 1, 'reasks': 1, 'recovered': 1}
+
+
+def test_judge_returns_nan_for_metrics_still_missing(scripted):
+    scripted('{"Relevance": 4}', 'no idea')
+    before = judge_protocol.stats()
+
+    scores = judge(TEMPLATE, {'prompt': 'a dragon'}, SCHEMA)
+    assert scores['Relevance'] == 4
+    assert math.isnan(scores['Diversity']) and math.isnan(scores['Clarity'])
+    assert counters_delta(before) == {'judgements': 1, 'partial': 1, 'reasks': 1, 'incomplete': 1}
+
+
+def test_judge_raises_when_partial_results_are_not_allowed(scripted):
+    scripted('{"Relevance": 4}', 'no idea')
+    with pytest.raises(ValueError, match='missing scores for Diversity, Clarity'):
+        judge(TEMPLATE, {'prompt': 'a dragon'}, SCHEMA, allow_partial=False)
+
+
+def test_judge_raises_when_nothing_can_be_scored(scripted):
+    scripted_judge = scripted('no idea', 'still no idea')
+    before = judge_protocol.stats()
+
+    with pytest.raises(ValueError, match='No valid scores'):
+        judge(TEMPLATE, {'prompt': 'a dragon'}, SCHEMA)
+    assert len(scripted_judge.prompts) == 2
+    assert counters_delta(before) == {'judgements': 1, 'parse_failures': 1, 'reasks': 1, 'discarded': 1}
+
+
+def test_judge_without_reasks_makes_one_call(scripted):
+    scripted_judge = scripted('{"Relevance": 4, "Diversity": 1}')
+    scores = judge(TEMPLATE, {'prompt': 'a dragon'}, SCHEMA, reasks=0)
+    assert len(scripted_judge.prompts) == 1
+    assert math.isnan(scores['Clarity'])
@@ -0,0 +1,88 @@
+import pytest
+
+from src import llm_client
+from src.judge_protocol import JudgeSchema, judge
+from src.llm_cache import LLMCache
+
+SCHEMA = JudgeSchema({'Relevance': 'How relevant?', 'Diversity': 'How diverse?'}, low=0, high=5)
+TEMPLATE = 'Prompt: {prompt}\n{metrics}\n{instruction}'
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = LLMCache(str(tmp_path / 'cache.sqlite'))
+    monkeypatch.setattr(llm_client, 'get_cache', lambda: cache)
+    return cache
+
+
+def test_default_temperature_is_not_cached(tmp_path):
+    cache = LLMCache(str(tmp_path / 'cache.sqlite'))
+    assert cache.should_cache(0.01)
+    assert not cache.should_cache(0.7)
+    assert not cache.should_cache(None)
+    sampled = LLMCache(str(tmp_path / 'sampled.sqlite'), cache_sampled=True)
+    assert sampled.should_cache(None) and sampled.should_cache(0.7)
+
+
+def test_delete_removes_entry_and_its_size(cache):
+    cache.put('a', 'hello')
+    cache.put('b', 'world!')
+    cache.delete('a')
+    cache.delete('missing')
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 1
+    assert cache.total_bytes == len('world!')
+
+
+def test_judge_evicts_unparseable_cached_answer(cache):
+    fields = {'prompt': 'a dragon'}
+    formatted_prompt = TEMPLATE.format(metrics=SCHEMA.describe(), instruction=SCHEMA.instruction(), **fields)
+    key = cache.make_key(TEMPLATE, formatted_prompt, None, 0.01, 500)
+    cache.put(key, 'I would rather not say.')
+
+    with pytest.raises(ValueError):
+        judge(TEMPLATE, fields, SCHEMA, reasks=0, allow_partial=False)
+    assert cache.get(key) is None
+
+
+def test_judge_keeps_complete_cached_answer(cache):
+    fields = {'prompt': 'a dragon'}
+    formatted_prompt = TEMPLATE.format(metrics=SCHEMA.describe(), instruction=SCHEMA.instruction(), **fields)
+    key = cache.make_key(TEMPLATE, formatted_prompt, None, 0.01, 500)
+    cache.put(key, '{"Relevance": 4, "Diversity": 2}')
+
+    assert judge(TEMPLATE, fields, SCHEMA, reasks=0) == {'Relevance': 4, 'Diversity': 2}
+    assert cache.get(key) is not None
+
+
+def test_sample_index_separates_repeated_samples(tmp_path):
+    cache = LLMCache(str(tmp_path / 'cache.sqlite'), cache_sampled=True)
+    keys = {cache.make_key('t', 'p', None, 0.7, 100, sample) for sample in (None, 0, 1, 2)}
+    assert len(keys) == 4
+    assert cache.make_key('t', 'p', None, 0.7, 100) == cache.make_key('t', 'p', None, 0.7, 100, None)
+
+
+def test_generation_caches_each_candidate_separately(tmp_path, monkeypatch):
+    pytest.importorskip('cohere')
+    pytest.importorskip('pandas')
+    from src.local_llm_server import start_server
+    from src.prompt_generation import tot_prompts
+
+    server = start_server(ttft='fixed:0', tokens_per_second=0)
+    try:
+        monkeypatch.setenv('COHERE_BASE_URL', server.url)
+        monkeypatch.setenv('COHERE_API_KEY', 'local')
+        cache = LLMCache(str(tmp_path / 'cache.sqlite'), cache_sampled=True)
+        monkeypatch.setattr(llm_client, 'get_cache', lambda: cache)
+
+        tot_prompts.generate_responses_with_metrics(['a dragon'], ['story'], num_calls=3)
+        assert server.stats()['requests'] == 3
+        assert cache.stats()['entries'] == 3
+
+        # A rerun is served from the cache, one entry per candidate
+        tot_prompts.generate_responses_with_metrics(['a dragon'], ['story'], num_calls=3)
+        assert server.stats()['requests'] == 3
+        assert cache.stats()['hits'] == 3
+    finally:
+        server.shutdown()
+        llm_client.close_clients()
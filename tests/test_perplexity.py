@@ -0,0 +1,95 @@
+import math
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+
+from src.story_analysis import perplexity
+from src.story_analysis.perplexity import PerplexityScorer, _windows, token_perplexities
+
+VOCAB_SIZE = 500
+N_POSITIONS = 128
+
+
+@pytest.fixture(scope='module')
+def model():
+    torch.manual_seed(0)
+    config = transformers.GPT2Config(n_layer=2, n_head=2, n_embd=64, n_positions=N_POSITIONS, vocab_size=VOCAB_SIZE)
+    return transformers.GPT2LMHeadModel(config).eval()
+
+
+def strided_perplexity(ids, model, max_length, stride):
+    # The sliding-window recipe from the Hugging Face perplexity guide, one window per forward pass
+    nll_sum, scored = 0.0, 0
+    previous_end = 0
+    for start in range(0, len(ids), stride):
+        end = min(start + max_length, len(ids))
+        target_length = end - previous_end
+        input_ids = torch.tensor([ids[start:end]])
+        labels = input_ids.clone()
+        labels[:, :-target_length] = -100
+        with torch.no_grad():
+            loss = model(input_ids, labels=labels).loss
+        valid = int((labels[:, 1:] != -100).sum())
+        nll_sum += loss.item() * valid
+        scored += valid
+        previous_end = end
+        if end == len(ids):
+            break
+    return math.exp(nll_sum / scored)
+
+
+def random_ids(lengths, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, VOCAB_SIZE, size=length).tolist() for length in lengths]
+
+
+def test_windows_score_every_token_after_the_first_once():
+    for num_tokens, max_length, stride in [(1, 8, 4), (7, 8, 4), (8, 8, 7), (30, 8, 3), (30, 8, 7), (100, 32, 16)]:
+        windows = _windows(num_tokens, max_length, stride)
+        scored = [token for _, end, first_scored in windows for token in range(first_scored, end)]
+        assert scored == list(range(1, num_tokens))
+        assert all(end - start <= max_length for start, end, _ in windows)
+
+
+@pytest.mark.parametrize('max_length, stride', [(N_POSITIONS, 512), (32, 16), (32, 32), (24, 7)])
+def test_token_perplexities_match_strided_reference(model, max_length, stride):
+    token_ids = random_ids([2, 5, 31, 40, 90, 200, 17])
+    # A stride of max_length or more is clamped so that consecutive windows overlap
+    expected = [strided_perplexity(ids, model, max_length, min(stride, max_length - 1)) for ids in token_ids]
+    # Small batches and logit chunks force several packed batches and projection passes
+    scores = token_perplexities(token_ids, model, max_length=max_length, stride=stride, batch_tokens=96, logits_rows=13)
+    np.testing.assert_allclose(scores, expected, rtol=1e-4)
+
+
+def test_token_perplexities_are_nan_for_texts_without_a_prediction(model):
+    scores = token_perplexities([[], [7], [7, 8]], model)
+    assert math.isnan(scores[0]) and math.isnan(scores[1])
+    assert scores[2] == pytest.approx(strided_perplexity([7, 8], model, N_POSITIONS, N_POSITIONS - 1), rel=1e-4)
+
+
+class WordTokenizer:
+    pad_token_id = None
+    eos_token_id = 0
+
+    def __call__(self, texts):
+        return {'input_ids': [[hash(word) % VOCAB_SIZE for word in text.split()] for text in texts]}
+
+
+def test_scorer_reuses_cached_scores(model, tmp_path, monkeypatch):
+    monkeypatch.setattr(perplexity, 'get_model', lambda model_name: (model, WordTokenizer()))
+    calls = []
+    real_token_perplexities = perplexity.token_perplexities
+    monkeypatch.setattr(perplexity, 'token_perplexities',
+                        lambda token_ids, *args, **kwargs: calls.append(len(token_ids)) or real_token_perplexities(token_ids, *args, **kwargs))
+
+    scorer = PerplexityScorer(model_name='tiny', cache_path=str(tmp_path / 'perplexity.sqlite'))
+    texts = ['the dragon slept', None, 'the dragon slept', 'a knight rode out at dawn']
+    first = scorer.score(texts)
+    second = PerplexityScorer(model_name='tiny', cache_path=str(tmp_path / 'perplexity.sqlite')).score(texts)
+
+    assert calls == [2]  # Duplicates are scored once, and the second scorer only reads the cache
+    assert math.isnan(first[1]) and first[0] == first[2]
+    np.testing.assert_array_equal(first, second)
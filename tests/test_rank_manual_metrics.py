@@ -0,0 +1,86 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sentence_transformers')
+
+from src.prompt_ranking import rank_manual_metrics
+from src.prompt_ranking.embedding_store import EmbeddingStore
+from src.prompt_ranking.rank_manual_metrics import rank_prompts_bulk, rank_prompts_using_eval_metrics
+
+DIM = 16
+
+
+class FakeModel:
+    """Stands in for the sentence transformer: a fixed random vector per text, no download needed."""
+
+    def encode(self, texts, convert_to_tensor=False, batch_size=32, **kwargs):
+        vectors = np.stack([self.vector(text) for text in texts])
+        if convert_to_tensor:
+            import torch
+            return torch.from_numpy(vectors)
+        return vectors
+
+    @staticmethod
+    def vector(text):
+        seed = int.from_bytes(hashlib.sha256(str(text).encode('utf-8')).digest()[:4], 'little')
+        return np.random.default_rng(seed).normal(size=DIM).astype(np.float32)
+
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch):
+    monkeypatch.setattr(rank_manual_metrics, '_model', FakeModel())
+
+
+STARTING_PROMPTS = ['a dragon who fears fire', 'a lighthouse keeper alone', 'a robot learning to paint', 'a city under the sea']
+GENERATED_ROWS = [
+    [f'{starting} (variant {i})' for i in range(3)] for starting in STARTING_PROMPTS
+]
+# A row whose candidates repeat, where ties must be broken the same way on both paths
+GENERATED_ROWS[3] = ['the same prompt', 'another prompt', 'the same prompt']
+
+
+def assert_same_rankings(bulk_rows, reference_rows):
+    assert len(bulk_rows) == len(reference_rows)
+    for bulk, reference in zip(bulk_rows, reference_rows):
+        assert [prompt for prompt, *_ in bulk] == [prompt for prompt, *_ in reference]
+        np.testing.assert_allclose([scores for _, *scores in bulk], [scores for _, *scores in reference], rtol=1e-5, atol=1e-6)
+
+
+def test_bulk_ranking_matches_the_reference_path():
+    reference = [rank_prompts_using_eval_metrics(starting, row) for starting, row in zip(STARTING_PROMPTS, GENERATED_ROWS)]
+    assert_same_rankings(rank_prompts_bulk(STARTING_PROMPTS, GENERATED_ROWS), reference)
+
+
+def test_bulk_ranking_matches_with_other_weights_and_a_store(tmp_path):
+    store = EmbeddingStore(str(tmp_path / 'embeddings'), dim=DIM, dtype='float32', model_name='fake')
+    reference = [rank_prompts_using_eval_metrics(starting, row, alpha=0.3, beta=0.7)
+                 for starting, row in zip(STARTING_PROMPTS, GENERATED_ROWS)]
+    bulk = rank_prompts_bulk(STARTING_PROMPTS, GENERATED_ROWS, alpha=0.3, beta=0.7, embedding_store=store, batch_size=2)
+    assert_same_rankings(bulk, reference)
+    # The reference path reads the same store back
+    assert_same_rankings(bulk, [rank_prompts_using_eval_metrics(starting, row, alpha=0.3, beta=0.7, embedding_store=store)
+                                for starting, row in zip(STARTING_PROMPTS, GENERATED_ROWS)])
+
+
+def test_bulk_and_row_by_row_csv_output_match(tmp_path):
+    pd = pytest.importorskip('pandas')
+    input_csv = tmp_path / 'generated.csv'
+    pd.DataFrame({
+        'Prompt': STARTING_PROMPTS,
+        'Human Story': [f'story {i}' for i in range(len(STARTING_PROMPTS))],
+        'Response 1': [row[0] for row in GENERATED_ROWS],
+        'Response 2': [row[1] for row in GENERATED_ROWS],
+        'Response 3': [row[2] for row in GENERATED_ROWS],
+    }).to_csv(input_csv, index=False)
+
+    rows_csv, bulk_csv = str(tmp_path / 'rows.csv'), str(tmp_path / 'bulk.csv')
+    rank_manual_metrics.process_and_rank_prompts(str(input_csv), rows_csv)
+    rank_manual_metrics.process_and_rank_prompts(str(input_csv), bulk_csv, bulk=True, chunk_size=3)
+    rows = pd.read_csv(rows_csv).drop(columns='Latency')
+    bulk = pd.read_csv(bulk_csv).drop(columns='Latency')
+    pd.testing.assert_frame_equal(bulk, rows, rtol=1e-5)
@@ -0,0 +1,151 @@
+import pytest
+
+from src import rate_control
+from src.rate_control import RateController, TokenBucket, current_controller, rate_limits_handled, throttle_calls
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        # Like a real clock, always move on, even when rounding leaves a wait of almost nothing
+        self.now += max(seconds, 1e-6)
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+def controller(clock, **options):
+    options = {'requests_per_minute': 60, 'max_requests_per_minute': 600, 'max_concurrency': 8,
+               'backoff_seconds': 10, **options}
+    return RateController(clock=clock, sleep=clock.sleep, **options)
+
+
+def test_token_bucket_waits_for_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=2, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.now == pytest.approx(0.5)
+
+
+def test_token_bucket_drain_pauses_new_calls():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=1, clock=clock, sleep=clock.sleep)
+    bucket.drain(10)
+    bucket.acquire()
+    assert clock.now == pytest.approx(10.0)
+
+
+def test_success_raises_rate_and_limit():
+    clock = FakeClock()
+    rc = controller(clock)
+    for _ in range(10):
+        assert rc.call(lambda: 'ok') == 'ok'
+    stats = rc.stats()
+    assert stats['successes'] == 10
+    assert stats['requests_per_minute'] > 60
+    assert stats['concurrency_limit'] > 1
+
+
+def test_rate_limit_halves_rate_and_limit_then_retries():
+    clock = FakeClock()
+    rc = controller(clock, requests_per_minute=120, min_concurrency=4)
+    attempts = []
+
+    def flaky():
+        attempts.append(clock.now)
+        if len(attempts) == 1:
+            raise RateLimited('429 Too Many Requests')
+        return 'ok'
+
+    assert rc.call(flaky) == 'ok'
+    stats = rc.stats()
+    assert stats['rate_limited'] == 1 and stats['successes'] == 1
+    assert stats['requests_per_minute'] < 120 * 0.5 * 1.1
+    assert stats['concurrency_limit'] == 4  # Halved to 2, but never below min_concurrency
+    # The retry waited out the backoff: 3 tokens left, 10 seconds' worth drained, refilled at the halved 1/s
+    assert attempts[1] - attempts[0] == pytest.approx(8.0)
+
+
+def test_rate_limit_gives_up_after_max_retries():
+    clock = FakeClock()
+    rc = controller(clock, max_retries=2)
+    calls = []
+
+    def always_limited():
+        calls.append(1)
+        raise RateLimited('rate limit')
+
+    with pytest.raises(RateLimited):
+        rc.call(always_limited)
+    assert len(calls) == 3
+    assert rc.stats()['in_flight'] == 0
+
+
+@pytest.mark.parametrize('error', [ServerError('upstream failed'), TimeoutError('read timed out'), ValueError('bad')])
+def test_other_failures_release_the_slot_without_speeding_up(error):
+    clock = FakeClock()
+    rc = controller(clock)
+    before = rc.stats()
+
+    def failing():
+        raise error
+
+    for _ in range(20):
+        with pytest.raises(type(error)):
+            rc.call(failing)
+    after = rc.stats()
+    assert after['failures'] == 20 and after['successes'] == 0 and after['rate_limited'] == 0
+    assert after['requests_per_minute'] == pytest.approx(before['requests_per_minute'])
+    assert after['concurrency_limit'] == before['concurrency_limit']
+    assert after['in_flight'] == 0
+
+
+def test_rate_never_exceeds_the_ceiling():
+    clock = FakeClock()
+    rc = controller(clock, requests_per_minute=590, max_requests_per_minute=600, increase_fraction=0.5)
+    for _ in range(5):
+        rc.call(lambda: None)
+    assert rc.stats()['requests_per_minute'] == pytest.approx(600)
+
+
+def test_starting_rate_above_ceiling_is_clamped_with_a_warning(capsys):
+    rc = controller(FakeClock(), requests_per_minute=1200, max_requests_per_minute=600)
+    assert rc.stats()['requests_per_minute'] == pytest.approx(600)
+    assert 'clamped' in capsys.readouterr().out
+
+
+def test_calls_inside_the_controller_see_rate_limits_handled():
+    rc = controller(FakeClock())
+    assert not rate_limits_handled()
+    assert rc.call(rate_limits_handled) is True
+    assert not rate_limits_handled()
+
+
+def test_throttle_calls_sets_and_restores_the_thread_controller():
+    outer, inner = controller(FakeClock()), controller(FakeClock())
+    with throttle_calls(outer):
+        with throttle_calls(inner):
+            assert current_controller() is inner
+        assert current_controller() is outer
+    assert current_controller() is None
+
+
+def test_is_rate_limit_error_recognises_status_and_message():
+    assert rate_control.is_rate_limit_error(RateLimited())
+    assert rate_control.is_rate_limit_error(Exception('Too Many Requests'))
+    assert not rate_control.is_rate_limit_error(ServerError('boom'))
@@ -0,0 +1,208 @@
+import threading
+import time
+
+import pytest
+
+from src import resilience
+from src.rate_control import RateController
+from src.resilience import DeadlineExceeded, Hedger, RetryPolicy, call_with_retries, classify_error
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class ReadTimeout(Exception):
+    pass
+
+
+class Scripted:
+    """Returns or raises the scripted outcomes in order, advancing the clock by `duration` per call."""
+
+    def __init__(self, clock, *outcomes, duration=1.0):
+        self.clock = clock
+        self.outcomes = list(outcomes)
+        self.duration = duration
+        self.timeouts = []
+
+    def __call__(self, timeout):
+        self.timeouts.append(timeout)
+        self.clock.now += self.duration
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def policy_for(clock, **kwargs):
+    return RetryPolicy(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+@pytest.mark.parametrize('error, kind', [
+    (HTTPError(429), 'rate_limit'),
+    (HTTPError(503), 'transient'),
+    (HTTPError(400), 'fatal'),
+    (HTTPError(401), 'fatal'),
+    (ReadTimeout(), 'transient'),
+    (ConnectionResetError(), 'transient'),
+    (ValueError('bad json'), 'fatal'),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+def test_retry_delay_backs_off_within_the_ceiling(clock):
+    policy = policy_for(clock, max_attempts=5, base_delay=1.0, max_delay=3.0)
+    for attempt, ceiling in enumerate([1.0, 2.0, 3.0, 3.0]):
+        assert 0 <= policy.retry_delay(HTTPError(503), attempt, deadline_at=100) <= ceiling
+    assert policy.retry_delay(HTTPError(503), 4, deadline_at=100) is None
+
+
+def test_retry_delay_honours_retry_after_and_the_deadline(clock):
+    policy = policy_for(clock, base_delay=0.1)
+    assert policy.retry_delay(HTTPError(503, {'retry-after': '7'}), 0, deadline_at=100) == 7
+    assert policy.retry_delay(HTTPError(503, {'retry-after': '7'}), 0, deadline_at=5) is None
+    assert policy.retry_delay(HTTPError(400), 0, deadline_at=100) is None
+
+
+def test_retry_delay_leaves_rate_limits_to_a_controller(clock):
+    policy = policy_for(clock)
+    assert policy.retry_delay(HTTPError(429), 0, deadline_at=100) is not None
+    controller = RateController(requests_per_minute=600, max_retries=0)
+    delays = []
+
+    def inside(timeout):
+        delays.append(policy.retry_delay(HTTPError(429), 0, deadline_at=100))
+    controller.call(inside, 10)
+    assert delays == [None]
+
+
+def test_call_with_retries_retries_transient_failures(clock):
+    fn = Scripted(clock, ReadTimeout(), HTTPError(502), 'done')
+    assert call_with_retries(fn, policy=policy_for(clock, deadline=60)) == 'done'
+    assert len(clock.sleeps) == 2
+    # Each attempt's timeout is what is left of the shared deadline
+    assert fn.timeouts[0] == 60
+    assert fn.timeouts[2] == pytest.approx(60 - 2 - sum(clock.sleeps))
+
+
+def test_call_with_retries_raises_fatal_errors_at_once(clock):
+    fn = Scripted(clock, HTTPError(400), 'never')
+    with pytest.raises(HTTPError):
+        call_with_retries(fn, policy=policy_for(clock))
+    assert len(fn.timeouts) == 1 and clock.sleeps == []
+
+
+def test_call_with_retries_gives_up_after_max_attempts(clock):
+    fn = Scripted(clock, *[ReadTimeout()] * 3)
+    with pytest.raises(ReadTimeout):
+        call_with_retries(fn, policy=policy_for(clock, max_attempts=3))
+    assert len(fn.timeouts) == 3
+
+
+def test_call_with_retries_stops_at_the_deadline(clock):
+    fn = Scripted(clock, ReadTimeout(), ReadTimeout(), 'late', duration=5.0)
+    # No backoff, so only the deadline ends the retries: the second attempt ends past it
+    policy = policy_for(clock, base_delay=0.0, deadline=9)
+    with pytest.raises(ReadTimeout):
+        call_with_retries(fn, policy=policy, deadline=9)
+    assert len(fn.timeouts) == 2
+    assert clock.now == 10
+
+    clock.now = 0
+    before = resilience.stats()['deadline_exceeded']
+    with pytest.raises(DeadlineExceeded):
+        call_with_retries(lambda timeout: 'unused', policy=policy, deadline=0)
+    assert resilience.stats()['deadline_exceeded'] == before + 1
+
+
+def warmed_hedger(latency=0.01, **kwargs):
+    hedger = Hedger(min_samples=5, min_delay=0.05, **kwargs)
+    for _ in range(50):
+        hedger.record('template', latency)
+    return hedger
+
+
+def test_hedger_runs_the_primary_on_the_calling_thread():
+    hedger = warmed_hedger()
+    threads = []
+
+    def fn(timeout):
+        threads.append(threading.current_thread())
+        return 'ok'
+    assert hedger.call(fn, 10, key='template') == 'ok'
+    assert threads == [threading.current_thread()]
+    assert hedger.stats() == {'calls': 1, 'hedged': 0, 'hedge_wins': 0}
+
+
+def test_hedger_uses_the_duplicate_when_a_slow_primary_fails():
+    hedger = warmed_hedger(max_fraction=1.0)
+    caller = threading.current_thread()
+
+    def fn(timeout):
+        if threading.current_thread() is caller:
+            time.sleep(0.3)
+            raise ReadTimeout()
+        return 'from the duplicate'
+    assert hedger.call(fn, 10, key='template') == 'from the duplicate'
+    assert hedger.stats() == {'calls': 1, 'hedged': 1, 'hedge_wins': 1}
+
+
+def test_hedger_raises_the_primary_error_without_a_duplicate():
+    hedger = warmed_hedger(max_fraction=1.0)
+
+    def fn(timeout):
+        raise ReadTimeout()
+    with pytest.raises(ReadTimeout):
+        hedger.call(fn, 10, key='template')
+    # A primary failing before the hedging delay never starts a duplicate
+    time.sleep(0.1)
+    assert hedger.stats()['hedged'] == 0
+
+
+def test_hedger_caps_the_fraction_of_hedged_calls():
+    # The median stays at the warm-up latency while the slow calls below are recorded
+    hedger = warmed_hedger(max_fraction=0.5, quantile=0.5)
+    duplicates = []
+    caller = threading.current_thread()
+
+    def fn(timeout):
+        if threading.current_thread() is not caller:
+            duplicates.append(1)
+        time.sleep(0.1)
+        return 'ok'
+    for _ in range(4):
+        hedger.call(fn, 10, key='template')
+    assert hedger.stats()['hedged'] == 2
+    time.sleep(0.2)
+    assert len(duplicates) == 2
+
+
+def test_hedger_waits_for_samples_before_hedging():
+    hedger = Hedger(min_samples=5)
+    assert hedger.hedge_delay('template') is None
+    for latency in [0.1, 0.2, 0.3, 0.4, 2.0]:
+        hedger.record('template', latency)
+    assert hedger.hedge_delay('template') == 2.0
+    assert hedger.hedge_delay('other') is None
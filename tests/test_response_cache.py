@@ -0,0 +1,35 @@
+import threading
+import time
+
+from src import response_cache
+from src.response_cache import ResponseCache
+
+
+def test_concurrent_first_requests_share_one_disk_cache(tmp_path, monkeypatch):
+    opened = []
+    real_cache = response_cache.LLMCache
+
+    def slow_cache(*args, **kwargs):
+        # Widen the window in which an unlocked check would let a second caller in
+        time.sleep(0.05)
+        opened.append(real_cache(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(response_cache, 'LLMCache', slow_cache)
+    cache = ResponseCache(disk_path=str(tmp_path / 'responses.sqlite'))
+    threads = [threading.Thread(target=cache.get, args=('key',)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(opened) == 1
+    assert cache.stats()['misses'] == 8
+
+
+def test_disk_entries_are_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'responses.sqlite')
+    ResponseCache(disk_path=path).put('key', {'prompt': 'a dragon'})
+    other = ResponseCache(disk_path=path)
+    assert other.get('key') == {'prompt': 'a dragon'}
+    assert other.stats()['disk_hits'] == 1
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from app import server
+
+
+@pytest.fixture
+def client():
+    server.app.config['TESTING'] = True
+    return server.app.test_client()
+
+
+def test_generate_prompts_requires_input_prompt(client):
+    response = client.post('/generate_prompts', json={})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Input prompt is required'}
+
+
+@pytest.mark.parametrize('body', [{}, {'input_prompts': []}, {'input_prompts': 'a prompt'}])
+def test_batch_requires_non_empty_list(client, body):
+    response = client.post('/generate_prompts/batch', json=body)
+    assert response.status_code == 400
+    assert 'non-empty list' in response.get_json()['error']
+
+
+def test_batch_rejects_too_many_inputs(client, monkeypatch):
+    monkeypatch.setattr(server, 'BATCH_MAX_ITEMS', 2)
+    response = client.post('/generate_prompts/batch', json={'input_prompts': ['a', 'b', 'c']})
+    assert response.status_code == 400
+    assert 'At most 2' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('concurrency', ['abc', None, [], {}])
+def test_batch_rejects_non_integer_concurrency(client, concurrency):
+    response = client.post('/generate_prompts/batch', json={'input_prompts': ['a'], 'concurrency': concurrency})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'concurrency must be an integer'}
+
+
+@pytest.mark.parametrize('method', ['GET', 'POST'])
+def test_stream_requires_input_prompt(client, method):
+    response = client.open('/generate_prompts/stream', method=method, json={} if method == 'POST' else None)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Input prompt is required'}
+
+
+def test_generate_prompts_sheds_load_when_pool_is_full(client, monkeypatch):
+    monkeypatch.setattr(server.branch_pool, 'capacity', 1)
+    response = client.post('/generate_prompts', json={'input_prompt': 'a lighthouse keeper'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert 'busy' in response.get_json()['error']
+    assert server.branch_pool.stats()['in_use'] == 0
+
+
+def test_batch_sheds_load_before_streaming(client, monkeypatch):
+    monkeypatch.setattr(server.branch_pool, 'capacity', 1)
+    response = client.post('/generate_prompts/batch', json={'input_prompts': ['a', 'b'], 'stream': True})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_branch_pool_waits_for_room():
+    pool = server.BranchPool(max_workers=2)
+    release = threading.Event()
+    pool.submit_all([release.wait, release.wait])
+    with pytest.raises(server.ServerBusy):
+        pool.submit_all([lambda: 1])
+
+    threading.Timer(0.05, release.set).start()
+    futures = pool.submit_all([lambda: 1, lambda: 2], wait=5)
+    assert [future.result(timeout=5) for future in futures] == [1, 2]
+    assert pool.stats()['rejected'] == 1
+    pool.shutdown()
+
+
+def test_batch_stops_starting_inputs_after_disconnect(monkeypatch):
+    started = []
+
+    def build(input_prompt, wait=0.0):
+        started.append(input_prompt)
+        time.sleep(0.05)
+        return {'tree_of_thought_prompt': input_prompt}
+
+    monkeypatch.setattr(server, 'build_prompt_response', build)
+    items = server.generate_batch([f'prompt {i}' for i in range(20)], concurrency=1)
+    assert next(items)['index'] == 0
+    items.close()  # What the WSGI server does when the client goes away
+    time.sleep(0.3)
+    assert len(started) <= 3